@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# Synthetic Japanese corpus, for benchmarks of text-scanning workloads
+# (coverage, annotation, normalization).
+#
+# Usage: python3 bench/corpus.py [-o FILE] [--size CHARACTERS] [--seed SEED]
+#
+# The text is made of the Joyo examples (from output/examples.tsv), joined by
+# kana, punctuation and non-Joyo kanji, in lines of sentence-like length.  The
+# examples are in popular forms (e.g. 叱), as in the TSV; some are switched to
+# the MEXT forms (e.g. 𠮟), so that popularize() has something to replace.
+# The same seed always gives the same text.
+
+import argparse
+import os
+import random
+import sys
+
+basedir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, basedir)
+
+import joyodb
+
+PARTICLES = ['は', 'が', 'を', 'に', 'で', 'と', 'の', 'も', 'から', 'まで']
+ENDINGS = ['。', '、', 'です。', 'ました。', 'だろう。', '！', '？']
+NON_JOYO = '鬱薔薇檸檬醤鰯蝋燭'
+
+def load_examples(directory=None):
+    "The examples of output/examples.tsv (or of directory), as a list."
+    with open((directory or joyodb.outputdir) + '/examples.tsv', 'rt') as f:
+        # Throw away the header.
+        f.readline()
+        return([line.split('\t')[4] for line in f])
+
+def mext_translation_table():
+    "A str.translate() table from popular to MEXT forms (cf. popularize())."
+    return(str.maketrans({popular: mext for mext, popular
+                          in joyodb.load_popular_alternatives().items()}))
+
+def mext_characters():
+    "The set of MEXT-style kanji which have popular alternatives."
+    return(set(joyodb.load_popular_alternatives()))
+
+def generate_corpus(size, seed=0, examples=None):
+    """Return a synthetic text of at least size characters, made of
+    examples (by default, those of load_examples())."""
+
+    rng = random.Random(seed)
+    examples = examples or load_examples()
+    to_mext = mext_translation_table()
+    parts = []
+    length = 0
+    while length < size:
+        line = []
+        for i in range(rng.randint(3, 12)):
+            word = rng.choice(examples)
+            if rng.random() < 0.1:
+                word = word.translate(to_mext)
+            if rng.random() < 0.05:
+                word += rng.choice(NON_JOYO)
+            line.append(word + rng.choice(PARTICLES))
+        line.append(rng.choice(ENDINGS) + '\n')
+        line = ''.join(line)
+        parts.append(line)
+        length += len(line)
+    return(''.join(parts))
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic corpus.")
+    parser.add_argument('-o', '--output', default='-',
+                        help="file to write (default: standard output)")
+    parser.add_argument('--size', type=int, default=10 ** 7,
+                        help="approximate size, in characters (default: 10⁷)")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="random seed (default: 0)")
+    args = parser.parse_args()
+
+    text = generate_corpus(args.size, args.seed)
+    if args.output == '-':
+        sys.stdout.write(text)
+    else:
+        with open(args.output, 'wt') as f:
+            f.write(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# Import time of the joyodb package.
+#
+# Usage: python3 bench/importtime.py [-n RUNS] [--max-us MICROSECONDS]
+#
+# Imports joyodb in fresh interpreters, with python3 -X importtime, and
+# reports the cumulative time spent importing it (including its own imports).
+# With --max-us, exits with an error if the median is over that limit, so it
+# can be used to catch regressions.
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+basedir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+def import_time(module):
+    """Cumulative import time of module in a fresh interpreter, in µs."""
+    result = subprocess.run([sys.executable, '-X', 'importtime',
+                             '-c', 'import ' + module],
+                            cwd=basedir, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    # Lines look like "import time:   self [us] | cumulative | imported package".
+    for line in result.stderr.splitlines():
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            return(int(fields[1]))
+    raise(RuntimeError("No import time reported for " + module))
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure joyodb import time.")
+    parser.add_argument('-n', '--runs', type=int, default=20,
+                        help="number of interpreters to start (default: 20)")
+    parser.add_argument('-m', '--module', default='joyodb',
+                        help="module to import (default: joyodb)")
+    parser.add_argument('--max-us', type=int,
+                        help="fail if the median is over this many µs")
+    args = parser.parse_args()
+
+    times = [import_time(args.module) for i in range(args.runs)]
+    median = statistics.median(times)
+    print("import %s: median %d µs, min %d µs (%d runs)" %
+          (args.module, median, min(times), args.runs))
+
+    if args.max_us and median > args.max_us:
+        print("FAIL: over the limit of %d µs" % args.max_us)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# Per-process memory footprint of the Joyo data, as loaded from output/*.tsv.
+#
+# Run from anywhere: python3 bench/memory.py
+#
+# Reports the memory retained by the object graph (Kanji, Reading and Example
+# objects), and by the columnar store built from it, as measured by
+# tracemalloc; plus the process' peak RSS.
+
+import gc
+import os
+import resource
+import sys
+import tracemalloc
+
+basedir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, basedir)
+
+import joyodb.convert
+
+def retained(build):
+    """Call build(), and return (result, bytes retained by it)."""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return((result, size))
+
+def main():
+    db, size = retained(joyodb.convert.load_tsv)
+    kanjis = db.kanjis
+    readings = sum(len(k.readings) for k in kanjis)
+    examples = sum(len(r.examples) for k in kanjis for r in k.readings)
+    print("objects:  %8d kanji, %d readings, %d examples" %
+          (len(kanjis), readings, examples))
+    print("graph:    %8.1f KiB" % (size / 1024))
+
+    try:
+        from joyodb.columnar import ColumnarStore
+    except ImportError:
+        pass
+    else:
+        store, size = retained(
+            lambda: ColumnarStore(joyodb.convert.load_tsv().kanjis))
+        print("columnar: %8.1f KiB" % (size / 1024))
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print("max RSS:  %8.1f MiB" % (maxrss / 1024))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# Speed of the parse, export and lookup hot paths.
+#
+# Usage: python3 bench/speed.py [-k PATTERN] [-o RESULTS.json]
+#                               [--baseline BASELINE.json] [--threshold RATIO]
+#
+# Each benchmark is run for at least --min-time seconds per repetition, and
+# the median time per call over --repeat repetitions is reported.  Results
+# are saved as JSON with -o; with --baseline, they are compared with a
+# previous results file, and the script exits with an error if any benchmark
+# got slower than the baseline by more than --threshold (0.2: 20%).
+#
+# The data is loaded from output/*.tsv.  The parse benchmarks need the Joyo
+# .txt file (cf. joyodb.JOYOHYO_TXT), and are skipped without it.  Text
+# scanning benchmarks run on a synthetic corpus (cf. bench/corpus.py).
+
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+basedir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, basedir)
+
+import joyodb
+import joyodb.convert
+from joyodb.model import delimit_okurigana, Kind
+
+from corpus import generate_corpus, mext_characters
+
+# Registered benchmarks: a list of (name, function) pairs.  The function is
+# called with the Context, and returns run (the function to time), or a
+# (setup, run) pair; in that case setup() is called before each run, untimed,
+# and its result is passed to run().
+benchmarks = []
+
+def benchmark(name):
+    "Decorator to register a benchmark function."
+    def register(function):
+        benchmarks.append((name, function))
+        return(function)
+    return(register)
+
+class Context:
+    "Data shared by the benchmarks."
+
+    def __init__(self, corpus_size):
+        self.db = joyodb.load()
+        self.readings = [r for k in self.db.kanjis for r in k.readings]
+        # Kun readings with okurigana, and their examples.
+        self.okurigana = [(k.kanji, r.reading.replace('.', ''), e.example)
+                          for k in self.db.kanjis for r in k.readings
+                          if r.kind == Kind.KUN and '.' in r.reading
+                          for e in r.examples]
+        self.corpus = generate_corpus(corpus_size)
+        # Otherwise text.popularize and text.normalize never replace anything.
+        assert(mext_characters().intersection(self.corpus)), \
+            "no MEXT-style kanji in the corpus; try a larger --corpus-size"
+        self.tmpdir = tempfile.mkdtemp()
+
+        self.joyotxt = None
+        if os.path.exists(joyodb.JOYOHYO_TXT):
+            with open(joyodb.JOYOHYO_TXT, 'rt') as f:
+                self.joyotxt = f.read()
+
+    def joyotxt_file(self, stage):
+        """An in-memory copy of the Joyo .txt file, positioned at the start of
+        a stage: 'main' or 'appendix' table."""
+
+        f = io.StringIO(self.joyotxt)
+        if stage in ('main', 'appendix'):
+            joyodb.convert.find_main_table(f)
+        if stage == 'appendix':
+            joyodb.convert.parse_main_table(f)
+        return(f)
+
+class Skipped(Exception):
+    pass
+
+def needs_joyotxt(context):
+    if context.joyotxt is None:
+        raise(Skipped("no %s" % joyodb.JOYOHYO_TXT))
+
+@benchmark('parse.find_main_table')
+def bench_find_main_table(context):
+    needs_joyotxt(context)
+    return((lambda: context.joyotxt_file(None),
+            joyodb.convert.find_main_table))
+
+@benchmark('parse.parse_main_table')
+def bench_parse_main_table(context):
+    needs_joyotxt(context)
+    return((lambda: context.joyotxt_file('main'),
+            joyodb.convert.parse_main_table))
+
+@benchmark('parse.parse_appendix_table')
+def bench_parse_appendix_table(context):
+    needs_joyotxt(context)
+    return((lambda: context.joyotxt_file('appendix'),
+            joyodb.convert.parse_appendix_table))
+
+@benchmark('export.tsv')
+def bench_export_tsv(context):
+    return(lambda: joyodb.convert.convert_to_tsv(context.tmpdir,
+                                                 db=context.db))
+
+@benchmark('export.sql')
+def bench_export_sql(context):
+    filename = context.tmpdir + '/joyodb.sqlite3'
+    return(lambda: joyodb.convert.convert_to_sql(filename, db=context.db))
+
+@benchmark('export.html')
+def bench_export_html(context):
+    return(lambda: joyodb.convert.convert_to_html(db=context.db))
+
+@benchmark('model.delimit_okurigana')
+def bench_delimit_okurigana(context):
+    def run():
+        for kanji, reading, example in context.okurigana:
+            delimit_okurigana(kanji, reading, example)
+    return(run)
+
+@benchmark('model.Reading.romaji')
+def bench_romaji(context):
+    def run():
+        for r in context.readings:
+            r.romaji()
+    return(run)
+
+@benchmark('model.Reading.to_hiragana')
+def bench_to_hiragana(context):
+    def run():
+        for r in context.readings:
+            r.to_hiragana()
+    return(run)
+
+@benchmark('lookup.kanji')
+def bench_lookup_kanji(context):
+    characters = [k.kanji for k in context.db.kanjis]
+    db = context.db
+    def run():
+        for ch in characters:
+            db[ch]
+    return(run)
+
+@benchmark('lookup.reading')
+def bench_lookup_reading(context):
+    from joyodb.index import ReadingIndex
+    index = ReadingIndex(context.db.kanjis)
+    queries = [r.reading for r in context.readings]
+    def run():
+        for query in queries:
+            index.lookup(query)
+    return(run)
+
+@benchmark('text.popularize')
+def bench_popularize(context):
+    return(lambda: joyodb.popularize(context.corpus))
+
+@benchmark('text.normalize')
+def bench_normalize(context):
+    from joyodb.normalize import normalize
+    return(lambda: normalize(context.corpus))
+
+@benchmark('text.coverage')
+def bench_coverage(context):
+    from joyodb.coverage import CoverageScanner
+    scanner = CoverageScanner(context.db.kanjis)
+    return(lambda: scanner.scan_text(context.corpus))
+
+@benchmark('text.annotate')
+def bench_annotate(context):
+    from joyodb.annotate import Annotator
+    annotator = Annotator(context.db.kanjis, context.db.compound_readings)
+    return(lambda: annotator.find_all(context.corpus))
+
+def time_benchmark(function, context, repeat=5, min_time=0.2):
+    """Time a registered benchmark; returns a dictionary of results, with
+    times per call in seconds."""
+
+    prepared = function(context)
+    if isinstance(prepared, tuple):
+        setup, run = prepared
+    else:
+        setup, run = None, prepared
+
+    times = []
+    loops = 0
+    for i in range(repeat):
+        elapsed = 0.0
+        calls = 0
+        while elapsed < min_time or calls == 0:
+            if setup:
+                arg = setup()
+                start = time.perf_counter()
+                run(arg)
+            else:
+                start = time.perf_counter()
+                run()
+            elapsed += time.perf_counter() - start
+            calls += 1
+        times.append(elapsed / calls)
+        loops += calls
+    return({'median': statistics.median(times),
+            'min': min(times),
+            'loops': loops})
+
+def compare(results, baseline, threshold):
+    """Print results against a baseline; returns the names of the benchmarks
+    that got slower by more than threshold."""
+
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['median'] / baseline[name]['median']
+        status = ''
+        if ratio > 1 + threshold:
+            status = 'REGRESSION'
+            regressions.append(name)
+        print("%-32s %7.2fx baseline %s" % (name, ratio, status))
+    return(regressions)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark joyodb.")
+    parser.add_argument('-k', '--keyword', default='',
+                        help="only run benchmarks whose name contains this")
+    parser.add_argument('-o', '--output',
+                        help="save the results to this JSON file")
+    parser.add_argument('--baseline',
+                        help="compare with this results file, if it exists")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="fail if slower than the baseline by more than "
+                        "this ratio (default: 0.2)")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="repetitions per benchmark (default: 5)")
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help="minimum seconds per repetition (default: 0.2)")
+    parser.add_argument('--corpus-size', type=int, default=10 ** 6,
+                        help="characters of synthetic text (default: 10⁶)")
+    args = parser.parse_args()
+
+    context = Context(args.corpus_size)
+    results = {}
+    for name, function in benchmarks:
+        if args.keyword not in name:
+            continue
+        try:
+            results[name] = time_benchmark(function, context,
+                                           args.repeat, args.min_time)
+        except Skipped as e:
+            print("%-32s skipped (%s)" % (name, e))
+            continue
+        print("%-32s %10.3f ms" % (name, results[name]['median'] * 1000))
+
+    if args.output:
+        with open(args.output, 'wt') as f:
+            json.dump({'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'benchmarks': results},
+                      f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, 'rt') as f:
+            baseline = json.load(f)['benchmarks']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("FAIL: %d regressions over %d%%" %
+                  (len(regressions), args.threshold * 100))
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+# This file sets up file paths, and reserves space on memory to store things.
+#
+# Importing joyodb must stay cheap (it's done by every tool and worker
+# process): nothing is read or written here.  The data tables below are loaded
+# on first use; cf. __getattr__().
+import os
+
+class LoadedData:
+    """The current data set, for code which doesn't keep its own reference to
+    a JoyoDB snapshot; cf. publish().
+
+    db is the snapshot itself.  kanjis and compound_readings, for older code,
+    are read from it, so they always come from the same snapshot as db.
+
+    >>> from joyodb.model import JoyoDB, Kanji
+    >>> data = LoadedData()
+    >>> data.db = JoyoDB([Kanji('亜')], {})
+    >>> [k.kanji for k in data.kanjis]
+    ['亜']
+    >>> data.compound_readings is data.db.compound_readings
+    True
+    """
+
+    def __init__(self):
+        self.db = None
+
+    @property
+    def kanjis(self):
+        return(self.db.kanjis)
+
+    @property
+    def compound_readings(self):
+        return(self.db.compound_readings)
+
+loaded_data = LoadedData()
+
+# "The parent dir of the directory of the full path of this file."
+basedir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# Here we store data downloaded from the Internet, including the Joyo table
+# PDF.  Created when something is first saved there.
+cachedir = basedir + '/cache'
+
+# Auxiliary data which comes bundled with this program.
+datadir = basedir + '/data'
+
+# Here we save the data converted to other formats.  Created when something
+# is first saved there.
+outputdir = basedir + '/output'
+
+# The Joyo table, as text extracted from the PDF by the Makefile.  Can be
+# overridden with the JOYOHYO_TXT environment variable.
+JOYOHYO_TXT = os.environ.get('JOYOHYO_TXT',
+                             cachedir + '/joyokanjihyo_20101130.txt')
+
+def load(directory=None):
+    """Load the Joyo data from the converted TSV files.
+
+    This is a fast alternative to joyodb.convert.parse(), for when one only
+    has the converted tables (by default, the ones in outputdir), and not the
+    Joyo PDF.  Returns a JoyoDB snapshot (cf. joyodb.model), which is also
+    published in loaded_data.
+    """
+
+    import joyodb.convert
+    return(publish(joyodb.convert.load_tsv(directory or outputdir)))
+
+def publish(db):
+    """Make a JoyoDB snapshot the current data set in loaded_data.
+
+    This is a single assignment to loaded_data.db, which the other fields of
+    loaded_data are read from; so concurrent readers see either the old or
+    the new snapshot.  Returns db.
+    """
+
+    loaded_data.db = db
+    return(db)
+
+# The data tables, once loaded, by name.
+loaded_tables = {}
+
+def __getattr__(name):
+    """Load the data tables on first access, as module attributes (PEP 562).
+
+    joyodb.popular_alternatives, joyodb.popular_translation and
+    joyodb.variants are what load_popular_alternatives(),
+    popular_translation_table() and load_variants() return.
+
+    >>> import joyodb
+    >>> joyodb.popular_alternatives['塡']
+    '填'
+    """
+
+    if name == 'popular_alternatives':
+        value = load_popular_alternatives()
+    elif name == 'popular_translation':
+        value = popular_translation_table()
+    elif name == 'variants':
+        value = load_variants()
+    else:
+        raise(AttributeError("module %r has no attribute %r" %
+                             (__name__, name)))
+    # Next time, it's found without calling us.
+    globals()[name] = value
+    return(value)
+
+# Read the alternative (通用字体) characters from datafile.
+#
+# These three kanji have multiple Unicode codepoints, with minor graphical
+# differences:
+#
+# - U+5861 塡   U+586B 填
+# - U+525D 剝   U+5265 剥
+# - U+9830 頰   U+982C 頬
+#
+# The PDF document uses the ones on the left, which are the default MEXT
+# recommendation.  However, the ones on the right were the only ones available
+# in JIS X 0208, and became widespread. Today most people use them, and they're
+# considered to be alternatives in "popular use" (通用字体).
+#
+# Because I expect most users will want the popular variants, this program
+# converts the data into them.
+#
+# - U+20B9F 𠮟   U+53F1 叱
+#
+# These look pretty much the same, but MEXT says they're technically different
+# characters (cf. 付 3.4 in the PDF).  According to the Joyo document, U+20B9F
+# is the actual Joyo kanji (SHITSU/shikaru "to scold"), and U+53F1 is a
+# separate one (apparently pronounced KA; cf.
+# https://hydrocul.github.io/wiki/blog/2014/1201-shikaru.html ).  The PDF table
+# uses U+20B9F.
+#
+# However, U+20B9F is a newer codepoint, outside the Basic Multilingual Plane;
+# and in fact Unicode's Unihan list SHITSU/shikaru for U+53F1. A search on
+# Google Books in July/2016 found ~56000 hits for 叱る encoded as U+53F1, and
+# only 1 hit for 𠮟る with U+20B9F.  And the PDF itself says that, given
+# current usage, U+53F1 is to be accepted as a variant character (異体字) for
+# SHITSU/shikaru.
+#
+# So in this, too, we'll favor the popular form.  The original MEXT codepoints
+# are available in Kanji.default_variant.
+def load_popular_alternatives():
+    "Dictionary from MEXT-style kanji to their popular alternatives."
+    if 'popular_alternatives' not in loaded_tables:
+        popular_alternatives = {}
+        with open(datadir + '/popular_alternatives.tsv', 'rt') as f:
+            for line in f:
+                default, popular = line.strip().split("\t")
+                popular_alternatives[default] = popular
+        loaded_tables['popular_alternatives'] = popular_alternatives
+    return(loaded_tables['popular_alternatives'])
+
+def popular_translation_table():
+    "A str.translate() table for popularize()."
+    if 'popular_translation' not in loaded_tables:
+        loaded_tables['popular_translation'] = str.maketrans(
+            load_popular_alternatives())
+    return(loaded_tables['popular_translation'])
+
+def popularize(s):
+    r"""Convert MEXT-style kanjis in string to popular alternatives.
+
+    >>> popularize('1: 塡 2: 剝 3: 頰 4: 𠮟')
+    '1: 填 2: 剥 3: 頬 4: 叱'
+
+    >>> s = "Innocuous string  漢字 \n"
+    >>> popularize(s) == s
+    True
+
+    This is done in a single pass; for more options, see joyodb.normalize.
+    """
+    return(s.translate(popular_translation_table()))
+
+
+# Read the variants from datafile.
+#
+# Five Jōyō kanji have alternate "accepted character forms" 許容字体, marked
+# with brackets [] in the PDF.  These can be represented by Unicode variation
+# sequences[1].  Sadly, at the moment of this writing (2016), very few software
+# support such sequences.  At any rate, I've hand-picked Unicode variations
+# that look like the reference images, because this is "forward-compatible" –
+# these sequences can be useful in the future, when Unicode support gets more
+# widespread.
+#
+# [1] https://en.wikipedia.org/wiki/Variant_form_(Unicode)
+def load_variants():
+    """Dictionary from base kanji to (default, accepted) variation sequences.
+
+    >>> len(load_variants())
+    5
+    """
+
+    if 'variants' in loaded_tables:
+        return(loaded_tables['variants'])
+
+    variants = {}
+    with open(datadir + '/variants.tsv', 'rt') as f:
+        # Throw away the header.
+        f.readline()
+        for line in f:
+            # - Base: the basic Unicode codepoint for that character.
+            # - Default: A variation sequence that's graphically equivalent to
+            #            the main reference image in the Joyo table.
+            # - Accepted: A variation sequence that's graphically equivalent to
+            #            the 'accepted variant' in the Joyo table.
+            #
+            # Contrary to what one would expect, often the 'accepted' variant
+            # is actually the one in current use, and the one that shows up for
+            # the base Unicode codepoint under most Japanese fonts.
+            base, default, accepted = line.rstrip("\n").split("\t")
+            variants[base] = (default, accepted)
+    loaded_tables['variants'] = variants
+    return(variants)
@@ -0,0 +1,196 @@
+# Find Joyo words in running text.
+#
+# The Annotator class builds an Aho-Corasick automaton[1] out of the example
+# words, the appendix compounds and the prefecture names, then scans text in a
+# single pass, however many words there are.
+#
+# [1] https://en.wikipedia.org/wiki/Aho%E2%80%93Corasick_algorithm
+
+from collections import namedtuple, deque
+
+# What we know about a word found in the text:
+#
+# - kind: 'example' (from Reading.examples), 'compound' (from the appendix) or
+#   'placename' (from Kanji.placename_readings).
+# - kanji: The Joyo kanji the word is listed under, as a string; None for
+#   appendix compounds, which are listed by reading only.
+# - reading: For examples, the reading of that kanji in the word (a Reading's
+#   .reading string); for compounds and placenames, the reading of the whole
+#   word.
+Annotation = namedtuple('Annotation', ['kind', 'kanji', 'reading'])
+
+# A word found in the text, at text[start:end].  annotations is a tuple of
+# Annotation, because the same word may be listed many times (e.g. 愛媛 is a
+# placename for both 愛 and 媛).
+Match = namedtuple('Match', ['start', 'end', 'word', 'annotations'])
+
+class Annotator:
+    """Scanner for the Joyo words in a text.
+
+    Build it once from a list of Kanji objects and the appendix compounds
+    (cf. loaded_data), then call find_all(), scan() or scan_file().
+
+    Matches are leftmost-longest and don't overlap: from each position, the
+    longest listed word is taken, and scanning resumes after it.
+
+    >>> from joyodb.model import Kanji
+    >>> k = Kanji('雨')
+    >>> k.add_reading('あめ')
+    >>> k.add_examples('雨具')
+    >>> k.add_reading('あま')
+    >>> k.add_examples('雨戸')
+    >>> a = Annotator([k], {'つゆ': ['梅雨'], 'さみだれ': ['五月雨']})
+    >>> for m in a.find_all('梅雨の雨戸と五月雨と雨具'):
+    ...     print(m.start, m.word, m.annotations)
+    0 梅雨 (Annotation(kind='compound', kanji=None, reading='つゆ'),)
+    3 雨戸 (Annotation(kind='example', kanji='雨', reading='あま'),)
+    6 五月雨 (Annotation(kind='compound', kanji=None, reading='さみだれ'),)
+    10 雨具 (Annotation(kind='example', kanji='雨', reading='あめ'),)
+
+    The longest word wins, even if a shorter one ends first:
+
+    >>> a = Annotator([], {'ab': ['ab'], 'bcde': ['bcde'], 'e': ['e']})
+    >>> [m.word for m in a.find_all('abcde')]
+    ['ab', 'e']
+    >>> [m.word for m in a.find_all('xbcdex')]
+    ['bcde']
+    """
+
+    def __init__(self, kanjis, compound_readings):
+        # The trie: one dict of transitions per node; node 0 is the root.
+        self.goto = [{}]
+        # Failure link of each node: the node for the longest proper suffix
+        # of its path that is also in the trie.
+        self.fail = [0]
+        # Nearest node down the failure chain that ends a word (0 if none).
+        self.output = [0]
+        # Length of the path to each node.
+        self.depth = [0]
+        # For nodes that end a word: (word, annotations).
+        self.words = {}
+        self.longest = 0
+
+        annotations = {}
+        def add(word, annotation):
+            if word and '○' not in word:
+                annotations.setdefault(word, [])
+                if annotation not in annotations[word]:
+                    annotations[word].append(annotation)
+
+        for k in kanjis:
+            for r in k.readings:
+                for e in r.examples:
+                    add(e.example, Annotation('example', k.kanji, r.reading))
+            for placename, reading in k.placename_readings.items():
+                add(placename, Annotation('placename', k.kanji, reading))
+        for reading, orthographies in compound_readings.items():
+            for orthography in orthographies:
+                add(orthography, Annotation('compound', None, reading))
+
+        for word, word_annotations in annotations.items():
+            self.add_word(word, tuple(word_annotations))
+        self.build_links()
+
+    def add_word(self, word, annotations):
+        node = 0
+        for ch in word:
+            if ch not in self.goto[node]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(0)
+                self.depth.append(self.depth[node] + 1)
+                self.goto[node][ch] = len(self.goto) - 1
+            node = self.goto[node][ch]
+        self.words[node] = (word, annotations)
+        self.longest = max(self.longest, len(word))
+
+    def build_links(self):
+        "Compute failure and output links, breadth-first."
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(ch, 0)
+                if self.fail[child] in self.words:
+                    self.output[child] = self.fail[child]
+                else:
+                    self.output[child] = self.output[self.fail[child]]
+
+    def scan(self, chunks):
+        """Yield Match tuples for the words in a text given as string chunks.
+
+        The text may be split anywhere, even in the middle of a word; offsets
+        are relative to the start of the whole text.  Only one chunk is held in
+        memory at a time, plus a few pending matches.
+
+        >>> a = Annotator([], {'つゆ': ['梅雨']})
+        >>> [(m.start, m.word) for m in a.scan(['晴れ、梅', '雨、梅雨'])]
+        [(3, '梅雨'), (6, '梅雨')]
+        """
+
+        goto, fail, output = self.goto, self.fail, self.output
+        depth, words, longest = self.depth, self.words, self.longest
+
+        state = 0
+        position = 0
+        # Matches found but not yet known to be leftmost-longest, as (start,
+        # end, node).  Matches may only be final once no longer match could
+        # start at or before them.
+        pending = []
+        last_end = 0
+
+        for chunk in chunks:
+            for ch in chunk:
+                while state and ch not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(ch, 0)
+                position += 1
+
+                node = state if state in words else output[state]
+                while node:
+                    start = position - depth[node]
+                    if start >= last_end:
+                        pending.append((start, position, node))
+                    node = output[node]
+
+                while pending:
+                    start, end, node = min(pending,
+                                           key=lambda m: (m[0], -m[1]))
+                    if start + longest > position:
+                        break
+                    yield(Match(start, end, *words[node]))
+                    last_end = end
+                    pending = [m for m in pending if m[0] >= last_end]
+
+        while pending:
+            start, end, node = min(pending, key=lambda m: (m[0], -m[1]))
+            yield(Match(start, end, *words[node]))
+            pending = [m for m in pending if m[0] >= end]
+
+    def find_all(self, text):
+        "Return a list of Match tuples for the words in text."
+        return(list(self.scan((text,))))
+
+    def scan_file(self, f, chunk_size=1 << 20):
+        """Yield Match tuples for the words in a text file object.
+
+        The file is read chunk_size characters at a time, so arbitrarily large
+        files can be scanned in constant memory.
+
+        >>> import io
+        >>> a = Annotator([], {'つゆ': ['梅雨']})
+        >>> f = io.StringIO('梅雨' * 5)
+        >>> [m.start for m in a.scan_file(f, chunk_size=3)]
+        [0, 2, 4, 6, 8]
+        """
+
+        return(self.scan(iter(lambda: f.read(chunk_size), '')))
+
+# With this, one can test with: python3 annotate.py -v
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,186 @@
+# Helpers to persist computed data in the cache directory.
+#
+# Cached files are named after a digest of the files they were computed from,
+# so that a changed input simply misses the cache, instead of loading stale
+# data.
+
+from contextlib import contextmanager
+import glob
+import hashlib
+import os
+import pickle
+
+def files_digest(*filenames):
+    """Return a hexadecimal SHA-256 digest of the contents of the given files.
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile('wt', delete=False) as f:
+    ...     _ = f.write('漢字')
+    >>> d1 = files_digest(f.name)
+    >>> len(d1)
+    64
+    >>> d1 == files_digest(f.name)
+    True
+    >>> with open(f.name, 'at') as f:
+    ...     _ = f.write('\\n')
+    >>> d1 == files_digest(f.name)
+    False
+    >>> os.remove(f.name)
+    """
+
+    digest = hashlib.sha256()
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        # Separate files, so that moving bytes from one file to the next
+        # changes the digest.
+        digest.update(b'\0%d\0' % os.path.getsize(filename))
+    return(digest.hexdigest())
+
+def load_pickle(filename):
+    """Return the object pickled in filename, or None if it can't be loaded.
+
+    Any problem with the file (missing, truncated, pickled by an incompatible
+    version of the code...) is treated as a cache miss.
+    """
+
+    try:
+        with open(filename, 'rb') as f:
+            return(pickle.load(f))
+    except (OSError, EOFError, pickle.UnpicklingError,
+            AttributeError, ImportError, TypeError, ValueError):
+        return None
+
+@contextmanager
+def atomic_write(filename):
+    """Context to replace filename atomically; yields the name of a temporary
+    file to write to, which is renamed over filename when the context exits.
+    Readers see either the old or the new file, never a partial one.
+
+    If anything fails, the temporary file is removed, and filename is left
+    as it was.  Missing directories are created.
+
+    >>> import tempfile
+    >>> d = tempfile.mkdtemp()
+    >>> with atomic_write(d + '/new/x.txt') as tmp:
+    ...     with open(tmp, 'wt') as f:
+    ...         _ = f.write('亜')
+    >>> os.listdir(d + '/new')
+    ['x.txt']
+    >>> with atomic_write(d + '/new/x.txt') as tmp:
+    ...     with open(tmp, 'wt') as f:
+    ...         _ = f.write('亞')
+    ...     raise(ValueError('failed'))
+    Traceback (most recent call last):
+    ValueError: failed
+    >>> os.listdir(d + '/new'), open(d + '/new/x.txt').read()
+    (['x.txt'], '亜')
+
+    A filename without a directory is relative to the current one:
+
+    >>> cwd = os.getcwd()
+    >>> os.chdir(d)
+    >>> with atomic_write('y.txt') as tmp:
+    ...     open(tmp, 'wt').close()
+    >>> os.chdir(cwd)
+    >>> sorted(os.listdir(d))
+    ['new', 'y.txt']
+    """
+
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    tmp = '%s.%d.tmp' % (filename, os.getpid())
+    try:
+        yield(tmp)
+        os.replace(tmp, filename)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+def save_pickle(obj, filename, stale_pattern=None):
+    """Pickle obj into filename, atomically.
+
+    The data is written with atomic_write(), so that concurrent readers never
+    see a half-written file.  If stale_pattern is
+    given, other files matching this glob pattern are removed afterwards (they
+    are presumably snapshots of older inputs).
+
+    >>> import tempfile
+    >>> d = tempfile.mkdtemp()
+    >>> save_pickle({'a': 1}, d + '/x_old.pickle')
+    >>> save_pickle({'a': 2}, d + '/x_new.pickle', stale_pattern=d + '/x_*.pickle')
+    >>> sorted(os.listdir(d))
+    ['x_new.pickle']
+    >>> load_pickle(d + '/x_new.pickle')
+    {'a': 2}
+    >>> load_pickle(d + '/missing.pickle') is None
+    True
+    """
+
+    with atomic_write(filename) as tmp:
+        with open(tmp, 'wb') as f:
+            pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+
+    if stale_pattern:
+        for old in glob.glob(stale_pattern):
+            if old != filename:
+                os.remove(old)
+
+def files_stamp(*filenames):
+    "Return the (mtime, size) of each of the given files, as a tuple."
+    return(tuple((st.st_mtime_ns, st.st_size)
+                 for st in map(os.stat, filenames)))
+
+def cached_build(build, snapshot, *sources):
+    """Return build(), computed from the files in sources, caching the result
+    in the snapshot file.
+
+    The snapshot is reused while the sources keep their modification times
+    and sizes; if those changed, the sources are hashed, and the snapshot is
+    still reused if their contents didn't (e.g. a file was just touched).
+
+    >>> import tempfile
+    >>> d = tempfile.mkdtemp()
+    >>> with open(d + '/src.txt', 'wt') as f:
+    ...     _ = f.write('亜 亞')
+    >>> def build():
+    ...     print('building')
+    ...     with open(d + '/src.txt', 'rt') as f:
+    ...         return(f.read().split())
+    >>> cached_build(build, d + '/x.pickle', d + '/src.txt')
+    building
+    ['亜', '亞']
+    >>> cached_build(build, d + '/x.pickle', d + '/src.txt')
+    ['亜', '亞']
+    >>> os.utime(d + '/src.txt', ns=(0, 0))
+    >>> cached_build(build, d + '/x.pickle', d + '/src.txt')
+    ['亜', '亞']
+    >>> with open(d + '/src.txt', 'at') as f:
+    ...     _ = f.write(' 悪')
+    >>> cached_build(build, d + '/x.pickle', d + '/src.txt')
+    building
+    ['亜', '亞', '悪']
+    """
+
+    stamp = files_stamp(*sources)
+    cached = load_pickle(snapshot)
+    if not isinstance(cached, dict):
+        cached = {}
+    if cached.get('stamp') == stamp:
+        return(cached['data'])
+
+    digest = files_digest(*sources)
+    if cached.get('digest') == digest:
+        data = cached['data']
+    else:
+        data = build()
+    save_pickle({'stamp': stamp, 'digest': digest, 'data': data}, snapshot)
+    return(data)
+
+# With this, one can test with: python3 cache.py -v
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
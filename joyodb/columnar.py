@@ -0,0 +1,178 @@
+# Columnar (array-backed) store for the Joyo data.
+#
+# The joyodb.model object graph has one Python object per kanji, reading and
+# example, plus their strings, lists and dicts: a few megabytes per process.
+# ColumnarStore keeps the same core data in a handful of flat arrays instead.
+# Kanji, readings and examples are rows, identified by their index; the
+# readings of a kanji (and the examples of a reading) are a contiguous range of
+# rows.  Each string column is packed into a single str.
+#
+# Besides being smaller, flat arrays aren't touched by reference counting when
+# read, so worker processes forked after building a store keep sharing its
+# memory pages.
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+from joyodb.model import Kind, PartOfSpeech
+
+# Codes for enumerated columns.  Reading kinds other than these (cf.
+# joyodb.model.Reading) get further codes, in each store's kinds table.
+KINDS = (Kind.ON, Kind.KUN)
+PARTS_OF_SPEECH = (None,) + tuple(PartOfSpeech)
+
+# What the row accessors return.
+ReadingRow = namedtuple('ReadingRow',
+                        ['kanji', 'reading', 'kind', 'uncommon', 'variation_of'])
+ExampleRow = namedtuple('ExampleRow', ['example', 'pos', 'literary'])
+
+class StringColumn:
+    """A sequence of strings, packed into a single string plus offsets.
+
+    >>> c = StringColumn(['ショウ', '', 'た.べる'])
+    >>> len(c), c[0], c[1], c[-1]
+    (3, 'ショウ', '', 'た.べる')
+    >>> list(c)
+    ['ショウ', '', 'た.べる']
+    """
+
+    def __init__(self, strings):
+        self.offsets = array('I', [0])
+        parts = []
+        end = 0
+        for string in strings:
+            parts.append(string)
+            end += len(string)
+            self.offsets.append(end)
+        self.text = ''.join(parts)
+
+    def __len__(self):
+        return(len(self.offsets) - 1)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise(IndexError("StringColumn index out of range"))
+        return(self.text[self.offsets[i]:self.offsets[i + 1]])
+
+class ColumnarStore:
+    """Joyo kanji, readings and examples as columns of flat arrays.
+
+    Build it from a list of Kanji objects (e.g. loaded_data.kanjis); the
+    objects can be dropped afterwards.
+
+    >>> from joyodb.model import Kanji
+    >>> k1 = Kanji('成')
+    >>> k1.add_reading('セイ')
+    >>> k1.add_examples('成功，〔副〕成立')
+    >>> k1.add_reading('なる')
+    >>> k1.add_examples('成る')
+    >>> k2 = Kanji('食')
+    >>> k2.add_reading('ショク')
+    >>> store = ColumnarStore([k1, k2])
+    >>> len(store), store.readings('成')
+    (2, ['セイ', 'な.る'])
+    >>> [store.reading_row(j) for j in store.reading_rows(store.kanji_row('食'))]
+    [ReadingRow(kanji='食', reading='ショク', kind='On', uncommon=False, variation_of=None)]
+    >>> [store.example_row(i) for i in store.example_rows(0)]
+    [ExampleRow(example='成功', pos=None, literary=False), ExampleRow(example='成立', pos='Adverb', literary=False)]
+    >>> store.kanji_of_reading(2)
+    '食'
+
+    Readings of other kinds than On and Kun are kept too:
+
+    >>> k3 = Kanji('大')
+    >>> k3.add_reading('おとな', kind='Jukujikun')
+    >>> store = ColumnarStore([k1, k3])
+    >>> store.reading_row(2).kind, store.kinds
+    ('Jukujikun', ('On', 'Kun', 'Jukujikun'))
+    """
+
+    def __init__(self, kanjis):
+        readings = [r for k in kanjis for r in k.readings]
+        examples = [e for r in readings for e in r.examples]
+
+        # Kanji columns.
+        self.kanji = StringColumn(k.kanji for k in kanjis)
+        self.old_kanji = StringColumn(
+            ','.join(k.old_kanji) if type(k.old_kanji) is list
+            else k.old_kanji or ''
+            for k in kanjis)
+        self.reading_start = array('I', [0])
+        for k in kanjis:
+            self.reading_start.append(self.reading_start[-1] + len(k.readings))
+
+        # Reading columns.
+        self.reading = StringColumn(r.reading for r in readings)
+        self.kinds = KINDS + tuple(dict.fromkeys(r.kind for r in readings
+                                                 if r.kind not in KINDS))
+        kind_codes = {kind: code for code, kind in enumerate(self.kinds)}
+        self.kind = array('B', (kind_codes[r.kind] for r in readings))
+        self.uncommon = array('B', (r.uncommon for r in readings))
+        self.variation_of = StringColumn(r.variation_of or ''
+                                         for r in readings)
+        self.example_start = array('I', [0])
+        for r in readings:
+            self.example_start.append(self.example_start[-1] + len(r.examples))
+
+        # Example columns.
+        self.example = StringColumn(e.example for e in examples)
+        self.pos = array('B', (PARTS_OF_SPEECH.index(e.pos) for e in examples))
+        self.literary = array('B', (e.literary for e in examples))
+
+        # Index for kanji_row(): codepoints in ascending order, and their rows.
+        order = sorted(range(len(kanjis)), key=lambda i: self.kanji[i])
+        self.index_codepoints = array('I', (ord(self.kanji[i]) for i in order))
+        self.index_rows = array('I', order)
+
+    def __len__(self):
+        return(len(self.kanji))
+
+    def kanji_row(self, kanji):
+        "Row number of kanji (a string); raises KeyError if it isn't Joyo."
+        codepoint = ord(kanji)
+        i = bisect_left(self.index_codepoints, codepoint)
+        if i == len(self.index_codepoints) or \
+           self.index_codepoints[i] != codepoint:
+            raise(KeyError(kanji))
+        return(self.index_rows[i])
+
+    def reading_rows(self, kanji_row):
+        "Rows of the readings of a kanji, as a range."
+        return(range(self.reading_start[kanji_row],
+                     self.reading_start[kanji_row + 1]))
+
+    def example_rows(self, reading_row):
+        "Rows of the examples of a reading, as a range."
+        return(range(self.example_start[reading_row],
+                     self.example_start[reading_row + 1]))
+
+    def kanji_of_reading(self, reading_row):
+        "The kanji (a string) that a reading row belongs to."
+        return(self.kanji[bisect_right(self.reading_start, reading_row) - 1])
+
+    def reading_row(self, j):
+        "Reading row j, as a ReadingRow tuple."
+        return(ReadingRow(self.kanji_of_reading(j),
+                          self.reading[j],
+                          self.kinds[self.kind[j]],
+                          bool(self.uncommon[j]),
+                          self.variation_of[j] or None))
+
+    def example_row(self, i):
+        "Example row i, as an ExampleRow tuple."
+        return(ExampleRow(self.example[i],
+                          PARTS_OF_SPEECH[self.pos[i]],
+                          bool(self.literary[i])))
+
+    def readings(self, kanji):
+        "The readings of kanji (a string), as a list of strings."
+        return([self.reading[j]
+                for j in self.reading_rows(self.kanji_row(kanji))])
+
+# With this, one can test with: python3 columnar.py -v
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
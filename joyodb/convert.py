@@ -1,4 +1,8 @@
-from collections import defaultdict
+from collections import Counter, defaultdict
+import contextlib
+import logging
+import os
+import time
 
 # as of this writing, we need the new regex library to get support for kanji and kana matching:
 # \p{Han}, \p{Hiragana}, \p{Katakana}
@@ -6,56 +10,392 @@ import regex as re
 
 from joyodb import *
 from joyodb.model import *
+from joyodb.cache import atomic_write, files_digest, load_pickle, save_pickle
+from joyodb.instrument import LineCounter, measure
+import joyodb.kana
+import joyodb.model
 
-def convert():
-    "Main function which converts the Joyo table to multiple formats."
-    parse()
-    convert_to_tsv()
-    convert_to_html()
-    convert_to_sql()
+# Output formats: a dictionary from format name to a function which exports
+# a JoyoDB snapshot in that format.  Cf. register_exporter().
+exporters = {}
 
-def parse():
-    "Main function to load data from the Joyo table."
-    open_joyo_txt_file()
-    find_main_table()
-    parse_main_table()
-    parse_appendix_table()
+def register_exporter(name):
+    """Decorator to register a function as the exporter for a format.
 
-def open_joyo_txt_file():
-    "Open the Joyo .txt file, storing a pointer in loaded_data."
-    import os.path
+    The function is called with a JoyoDB snapshot as its db keyword argument.
+    It may run in a separate process (cf. run_exporters()).
+    """
+
+    def register(function):
+        exporters[name] = function
+        return(function)
+    return(register)
+
+def convert(jobs=1, formats=None, use_cache=True, instrumentation=None):
+    """Main function which converts the Joyo table to multiple formats.
+
+    - jobs: Number of exporters to run concurrently, in separate processes.
+    - formats: Names of the formats to export (default: all registered
+      exporters).
+    - use_cache: Cf. parse().
+    - instrumentation: A joyodb.instrument.Instrumentation object to record
+      the stages of parsing (cf. parse()), and each exporter as
+      'export.<format>'.
+    """
+
+    db = parse(use_cache, instrumentation)
+    run_exporters(formats or list(exporters), db, jobs,
+                  snapshot=parse_cache_filename(),
+                  instrumentation=instrumentation)
+
+def stage_context(instrumentation):
+    """Return the function to enter the stages of a conversion with: the
+    stage() method of instrumentation, or one that does nothing if it's None."""
+
+    if instrumentation is None:
+        return(lambda name, lines=None: contextlib.nullcontext())
+    return(instrumentation.stage)
+
+def run_exporters(formats, db, jobs=1, snapshot=None, instrumentation=None):
+    """Run the exporters for the given format names, on a JoyoDB snapshot.
+
+    With jobs > 1, exporters run in a pool of up to that many processes.  Each
+    worker loads the data from a snapshot file (as saved by parse()); if
+    snapshot is None, or the file doesn't exist, a temporary snapshot of db is
+    saved for them.  Returns a dictionary from format name to what its
+    exporter returned.
 
-    loaded_data.joyotxt = open(JOYOHYO_TXT, 'rt')
+    Each exporter is recorded in instrumentation (if given) as a stage named
+    'export.<format>'; in worker processes, it's measured there.
+    """
+
+    if jobs <= 1 or len(formats) <= 1:
+        stage = stage_context(instrumentation)
+        results = {}
+        for name in formats:
+            with stage('export.' + name):
+                results[name] = exporters[name](db=db)
+        return(results)
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    temporary = None
+    if not (snapshot and os.path.exists(snapshot)):
+        snapshot = temporary = cachedir + '/export_%d.pickle' % os.getpid()
+        save_parse_cache(db, snapshot, stale_pattern=None)
+
+    try:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(formats)),
+                                 initializer=init_exporter_process,
+                                 initargs=(snapshot,)) as pool:
+            if instrumentation is None:
+                futures = {name: pool.submit(run_exporter, name)
+                           for name in formats}
+                return({name: future.result()
+                        for name, future in futures.items()})
+
+            futures = {name: pool.submit(run_measured_exporter, name,
+                                         instrumentation.memory,
+                                         instrumentation.started)
+                       for name in formats}
+            results = {}
+            for name, future in futures.items():
+                results[name], metrics = future.result()
+                instrumentation.record(metrics)
+            return(results)
+    finally:
+        if temporary:
+            os.remove(temporary)
+
+# The snapshot that exporters work on, in run_exporters() worker processes.
+exporter_process_db = None
+
+def init_exporter_process(snapshot):
+    global exporter_process_db
+    exporter_process_db = load_parse_cache(snapshot)
+
+def run_exporter(name):
+    "Run the exporter registered for a format name, in a worker process."
+    return(exporters[name](db=exporter_process_db))
+
+def run_measured_exporter(name, memory, origin):
+    """Like run_exporter(), but also measure it (cf.
+    joyodb.instrument.measure()); returns (result, StageMetrics)."""
+
+    with measure('export.' + name, memory, origin=origin) as metrics:
+        result = run_exporter(name)
+    return((result, metrics))
+
+def parse(use_cache=True, instrumentation=None):
+    """Main function to load data from the Joyo table.
+
+    Returns a JoyoDB snapshot, which is also published in loaded_data (cf.
+    joyodb.publish()).
+
+    The parsed data is saved as a snapshot in cachedir.  Further calls load the
+    snapshot instead of parsing again, as long as the Joyo .txt file, the
+    bundled data tables and the parser code are unchanged (cf.
+    parse_cache_filename()).  Pass use_cache=False to always parse from
+    scratch.
+
+    If a joyodb.instrument.Instrumentation object is given, each stage is
+    recorded in it: 'open', 'find_main_table', 'parse_main_table',
+    'parse_appendix_table' (with the lines they read), 'snapshot' and
+    'save_parse_cache'; and so are the counters of lines, rows and
+    milliseconds by row type (cf. MainTableStats), and the hits and
+    milliseconds of each notes rule (cf. joyodb.model.NotesStats).  There
+    would be nothing to measure in a cached snapshot, so the table is always
+    parsed then (but the snapshot is still saved).  Timings are only taken
+    when instrumented.
+    """
+
+    stage = stage_context(instrumentation)
+
+    if use_cache:
+        snapshot = parse_cache_filename()
+    if use_cache and instrumentation is None:
+        db = load_parse_cache(snapshot)
+        if db is not None:
+            return(publish(db))
+
+    stats = MainTableStats(timed=instrumentation is not None)
+    with stage('open'):
+        joyotxt = open_joyo_txt_file()
+    with joyotxt:
+        lines = joyotxt if instrumentation is None else LineCounter(joyotxt)
+        with stage('find_main_table', lines):
+            find_main_table(lines)
+        with stage('parse_main_table', lines):
+            kanjis = parse_main_table(lines, stats)
+        with stage('parse_appendix_table', lines):
+            compound_readings = parse_appendix_table(lines)
+    with stage('snapshot'):
+        db = JoyoDB(kanjis, compound_readings)
+
+    if instrumentation is not None:
+        instrumentation.count('main_table_lines', stats.lines)
+        instrumentation.count('main_table_rows', stats.rows)
+        instrumentation.count('main_table_ms', {
+            row_type: seconds * 1000
+            for row_type, seconds in stats.seconds.items()})
+        instrumentation.count('notes', stats.notes.hits)
+        instrumentation.count('notes_ms', {
+            rule: seconds * 1000
+            for rule, seconds in stats.notes.seconds.items()})
+
+    if use_cache:
+        with stage('save_parse_cache'):
+            save_parse_cache(db, snapshot)
+    return(publish(db))
+
+def parse_cache_filename():
+    """Path of the parse snapshot for the current inputs.
+
+    The name includes a digest of everything that can change the parse
+    results: the Joyo .txt file, the data tables read by joyodb, and the source
+    code of the parser itself, and of the modules whose objects are pickled
+    with the results (e.g. the kana conversions cached in each Reading).
+    """
+
+    digest = files_digest(JOYOHYO_TXT,
+                          datadir + '/popular_alternatives.tsv',
+                          datadir + '/variants.tsv',
+                          joyodb.__file__,
+                          joyodb.kana.__file__,
+                          joyodb.model.__file__,
+                          __file__)
+    return(cachedir + '/parsed_%s.pickle' % digest[:16])
+
+def load_parse_cache(filename):
+    "Load a JoyoDB snapshot file; return None if unavailable."
+    db = load_pickle(filename)
+    if isinstance(db, JoyoDB):
+        return(db)
+    return(None)
+
+def save_parse_cache(db, filename, stale_pattern=cachedir + '/parsed_*.pickle'):
+    """Save a JoyoDB as a snapshot file.
+
+    By default, older parse snapshots are removed.
+    """
 
-def find_main_table():
+    save_pickle(db, filename, stale_pattern=stale_pattern)
+
+def open_joyo_txt_file(filename=None):
+    "Open the Joyo .txt file (by default, JOYOHYO_TXT); returns the file."
+    return(open(filename or JOYOHYO_TXT, 'rt'))
+
+def find_main_table(joyotxt):
     "Moves up in the Joyo file until the start of the main table (本表)."
-    for line in loaded_data.joyotxt:
+    for line in joyotxt:
         line = line.strip()
         if re.match(r'本\s*表$', line):
             break
 
-def parse_main_table():
-    "Reads data from main table (本表) into memory."
+def parse_main_table(joyotxt, stats=None):
+    """Reads data from main table (本表) into memory; returns a list of Kanji.
+
+    Cf. iter_kanjis(), which does the actual work.
+    """
+
+    return(list(iter_kanjis(joyotxt, stats)))
+
+def iter_kanjis(joyotxt, stats=None):
+    r"""Parse the main table (本表), yielding each Kanji object as soon as it's
+    complete.
+
+    A kanji is complete when the row of the next kanji begins (or the table
+    ends), so consumers can process it (write it out, index it...) while the
+    rest of the table is being parsed, and only one kanji needs to be held in
+    memory.  The file must be positioned after the 本表 title (cf.
+    find_main_table()); it's left positioned after the title of the appendix.
+
+    Notes can span several rows (cf. Kanji.pending_note); a note still pending
+    when its kanji is complete is reported by finish_kanji().
+
+    Counts and parse times per row type (cf. main_table_row_fields()), and
+    of the notes rules, are kept in stats (a new MainTableStats, if not
+    given); they're logged at the end.  Each parse has its own stats, so
+    concurrent parses don't mix them up.
+
+    >>> import io
+    >>> joyotxt = io.StringIO(
+    ...     "漢字\t音訓\t例\t備考\n"
+    ...     "雨\t\t \t \t\t \t \t ウ\t 雨季，降雨\t\n"
+    ...     "\t \t \t あめ\t 雨，大雨\t 「春雨」，「小雨」，「霧雨」などは，\n"
+    ...     "「はるさめ」，「こさめ」，「きりさめ」。\n"
+    ...     "升\t\t \t \t\t \t \t ショウ\t 一升\t\n"
+    ...     "\t \t \t ます\t 升目\t\n"
+    ...     "付　表\n")
+    >>> kanjis = iter_kanjis(joyotxt)
+    >>> print(next(kanjis))
+    雨 [ウ,あめ,さめ]
+    >>> joyotxt.readline() # the rest of 升 wasn't read yet
+    '\t \t \t ます\t 升目\t\n'
+    >>> print(next(kanjis))
+    升 [ショウ]
+    """
 
-    # store the parsed data here
-    loaded_data.kanjis = []
     # we use this to skip the first content line, which is the header
     header_skipped = False
+    if stats is None:
+        stats = MainTableStats()
+    current = None
 
-    for line in loaded_data.joyotxt:
+    for line in joyotxt:
+        kind = classify_line(line)
 
         # skip page numbers and index headers
-        if is_empty(line) or is_page_index(line) or is_sound_index(line):
+        if kind in SKIPPED_LINES:
+            stats.count_line(kind)
             continue
         # stop when we reach the appendix
-        elif is_appendix_start(line):
+        elif kind == 'appendix':
             break
         else:
             if not header_skipped:
                 # throw away header line
                 header_skipped = True
             else:
-                parse_main_table_row(line)
+                kanji = parse_main_table_row(line, current, stats)
+                if kanji is not current:
+                    # a new kanji begins; the previous one is done.
+                    if current is not None:
+                        yield(finish_kanji(current))
+                    current = kanji
+
+    if current is not None:
+        yield(finish_kanji(current))
+    logging.info("Main table rows:\n%s" % stats)
+    logging.info("Notes rules:\n%s" % stats.notes)
+
+def finish_kanji(kanji):
+    """Called on each Kanji when its last row has been parsed; returns it.
+
+    If it still has a pending note (one whose continuation never came), that's
+    logged, and the flag is cleared: continuation lines only ever apply to the
+    kanji under construction, so the next kanji starts afresh.
+    """
+
+    if kanji.pending_note:
+        logging.warning("Unfinished note for %s: %s" % (kanji.kanji,
+                                                        kanji.notes))
+        kanji.pending_note = False
+    return(kanji)
+
+class MainTableStats:
+    """Counts and timings of the lines found in the main table.
+
+    - lines: Counter of skipped lines, by kind (cf. classify_line()).
+    - rows: Counter of content rows, by row type (cf. MAIN_TABLE_ROW_TYPES).
+    - seconds: Total time spent parsing rows, by row type; only measured if
+      timed is true (as it is when parse() is instrumented), since it costs
+      two clock reads per row.
+    - notes: The NotesStats of the notes rules (cf. joyodb.model.NoteRules),
+      timed along with the rows.
+    """
+
+    def __init__(self, timed=False):
+        self.timed = timed
+        self.lines = Counter()
+        self.rows = Counter()
+        self.seconds = defaultdict(float)
+        self.notes = NotesStats(timed)
+
+    def count_line(self, kind):
+        self.lines[kind] += 1
+
+    def count_row(self, row_type, seconds=None):
+        self.rows[row_type] += 1
+        if seconds is not None:
+            self.seconds[row_type] += seconds
+
+    def __str__(self):
+        if self.timed:
+            lines = ['%-8s %5d rows %8.2f ms' %
+                     (row_type, self.rows[row_type],
+                      self.seconds[row_type] * 1000)
+                     for row_type in sorted(self.rows)]
+        else:
+            lines = ['%-8s %5d rows' % (row_type, self.rows[row_type])
+                     for row_type in sorted(self.rows)]
+        lines += ['%-12s %5d lines' % (kind, count)
+                  for kind, count in sorted(self.lines.items())]
+        return("\n".join(lines))
+
+# Classifies whole lines of the .txt file, after stripping: each named group is
+# a kind of line.
+line_regexp = re.compile(r"""
+    (?P<empty>)
+    | (?P<page_index>[0-9].*)
+    | (?P<sound_index>[\p{Katakana}\p{Hiragana}－]+)
+    | (?P<appendix>付\s*表)
+""", re.VERBOSE)
+
+# Kinds of lines which carry no table data.
+SKIPPED_LINES = ('empty', 'page_index', 'sound_index')
+
+def classify_line(line):
+    r"""Return the kind of a line: 'empty', 'page_index', 'sound_index',
+    'appendix' (the start of the appendix table), or 'row' for anything else.
+
+    >>> classify_line(" \t\n")
+    'empty'
+    >>> classify_line('163')
+    'page_index'
+    >>> classify_line('キ－キツ')
+    'sound_index'
+    >>> classify_line('付　表')
+    'appendix'
+    >>> classify_line("\t \t \t なつける\t 懐ける\t")
+    'row'
+    """
+
+    match = line_regexp.fullmatch(line.strip())
+    if match:
+        return(match.lastgroup)
+    else:
+        return('row')
 
 def is_empty(line):
     # 'r' raw string so that doctest works with these special characters.
@@ -77,8 +417,7 @@ def is_empty(line):
     False
     """
 
-    line = line.strip()
-    return re.match('^$', line) != None
+    return(classify_line(line) == 'empty')
 
 def is_page_index(line):
     r"""Detects the page indices from the Joyo document.
@@ -98,13 +437,8 @@ def is_page_index(line):
     False
     """
 
-    line = line.strip()
-
     # We just test whether it starts with a number.
-    if re.match(r'^[0-9]', line):
-        return(True)
-    else:
-        return(False)
+    return(classify_line(line) == 'page_index')
 
 def is_sound_index(line):
     r"""Detects the sound indices present in every page of the Joyo PDF.
@@ -127,32 +461,30 @@ def is_sound_index(line):
     False
     """
 
-    line = line.strip()
-    if re.match(r'^[\p{Katakana}\p{Hiragana}－]+$', line):
-        return(True)
-    else:
-        return(False)
+    return(classify_line(line) == 'sound_index')
 
 def is_appendix_start(line):
     "Return true if this line starts the appendix table (付表)."
-    line = line.strip()
-    if re.match(r'付\s*表$', line):
-        return(True)
-    else:
-        return(False)
+    return(classify_line(line) == 'appendix')
+
 
+def parse_main_table_row(line, current=None, stats=None):
+    """Intelligently parse a line from the Joyo table, in pdfbox .txt format,
+    adding its data to the Kanji object under construction (current).
 
-def parse_main_table_row(line):
-    """Intelligently parse a line from the Joyo table, in pdfbox .txt format.
+    Returns the Kanji object that the row belongs to: a new one if the row
+    starts a kanji, and current otherwise.  The row is counted in stats (a
+    MainTableStats), if given, and timed if stats.timed.
 
     Entry-point function; most of work is done by others.
     """
-    fields = main_table_row_fields(line)
+    timed = stats is not None and stats.timed
+    if timed:
+        start = time.perf_counter()
+    row_type, fields = main_table_row_type_and_fields(line)
 
     if 'kanji' in fields.keys():
-        add_kanji(fields['kanji'])
-
-    current = current_kanji()
+        current = Kanji(fields['kanji'])
 
     if 'old_kanji' in fields.keys():
         current.add_old_kanji(fields['old_kanji'])
@@ -164,8 +496,14 @@ def parse_main_table_row(line):
         current.add_examples(fields['examples'])
 
     if 'notes' in fields.keys():
-        current.append_to_notes(fields['notes'])
+        current.append_to_notes(fields['notes'],
+                                None if stats is None else stats.notes)
 
+    if timed:
+        stats.count_row(row_type, time.perf_counter() - start)
+    elif stats is not None:
+        stats.count_row(row_type)
+    return(current)
 
 def main_table_row_fields(line):
     r"""Interprets the fields in a Joyo table row, ain pdftoolbox .txt format.
@@ -328,128 +666,146 @@ def main_table_row_fields(line):
     discard them and substitute a hardcoded Unicode '龜'.
     """
 
-    #       TODO: can examples, like notes, be append to previous line?
-    fields = split_main_table_row(line)
-    dfields = dict()
-
-    if len(fields) == 1:
-        if fields[0] in ('瓣', '辯'):
-            # Exception: old forms of 弁
-            dfields['old_kanji'] = fields[0]
-
-        elif is_examples(fields[0]):
-            assert(fields[0][0] in ('極', '慌', '四'))
-            dfields['examples'] = fields[0]
-
+    return(main_table_row_type_and_fields(line)[1])
+
+# Types of rows in the main table, as documented in main_table_row_fields():
+# for each type, what goes in each field.  None means the field is ignored.
+MAIN_TABLE_ROW_TYPES = {
+    '1.a': ('old_kanji',), # 瓣, 辯
+    '1.b': ('examples',),
+    '1.c': ('notes',),
+    '2.a': ('kanji', 'reading'),
+    '2.b': ('reading', 'examples'),
+    '2.c': ('reading', 'notes'),
+    '2.d': ('examples', 'notes'),
+    '3.a': ('kanji', 'reading', 'examples'),
+    '3.b': ('reading', 'examples', 'notes'),
+    '4.a': ('kanji', 'old_kanji', 'reading', 'examples'),
+    '4.a弥': ('kanji', 'old_kanji', 'reading', 'notes'),
+    '4.b': ('kanji', 'reading', 'examples', 'notes'),
+    '4.c': ('old_kanji', 'reading', 'examples', 'notes'),
+    '4.d': ('kanji', 'old_kanji', 'reading', 'examples'),
+    '5.a': ('kanji', 'old_kanji', 'reading', 'examples', 'notes'),
+    '5.b': ('kanji', None, 'reading', 'examples', 'notes'),
+    '5.c': ('kanji', None, None, 'reading', 'examples'),
+}
+
+# Exceptional rows, recognized by (number of fields, first field).
+MAIN_TABLE_EXCEPTIONS = {
+    (1, '瓣'): '1.a',
+    (1, '辯'): '1.a',
+    (4, '弥'): '4.a弥',
+    (4, '弁'): '4.d',
+    (5, '亀'): '5.c',
+}
+
+# Classes of fields, as returned by classify_field().
+KANJI = 'kanji'         # a single kanji
+OLD_KANJI = 'old_kanji' # a kanji in parenthesis: （亞）
+VARIANT = 'variant'     # a kanji in brackets: ［遡］
+READING = 'reading'     # kana
+INDENTED_READING = 'indented_reading' # kana indented by U+3000
+EXAMPLES = 'examples'   # list of examples
+NOTES = 'notes'         # anything else
+
+# Which field classes are acceptable for each column.  Examples may look like
+# kanji or readings; old kanji lose their parenthesis when stored.
+COLUMN_FIELD_CLASSES = {
+    'kanji': (KANJI,),
+    'old_kanji': (KANJI, OLD_KANJI),
+    'reading': (READING, INDENTED_READING),
+    'examples': (KANJI, READING, EXAMPLES),
+    'notes': (OLD_KANJI, VARIANT, NOTES),
+}
+
+def main_table_row_type(n_fields, first_class, second_class):
+    "Decide the row type for rows not in MAIN_TABLE_EXCEPTIONS."
+    if n_fields == 1:
+        if first_class in COLUMN_FIELD_CLASSES['examples']:
+            return('1.b')
         else:
             # Everything else is notes
-            dfields['notes'] = fields[0]
-
-    elif len(fields) == 2:
-        if is_kanji(fields[0]):
-            # 2.a: kanji leads
-            dfields['kanji'] = fields[0]
-            dfields['reading'] = fields[1]
-        elif is_reading(fields[0]):
-            # 2.b or 2.c: reading leads
-            dfields['reading'] = fields[0]
-            if is_examples(fields[1]):
-                dfields['examples'] = fields[1]
+            return('1.c')
+    elif n_fields == 2:
+        if first_class == KANJI:
+            return('2.a')
+        elif first_class in COLUMN_FIELD_CLASSES['reading']:
+            if second_class in COLUMN_FIELD_CLASSES['examples']:
+                return('2.b')
             else:
-                dfields['notes'] = fields[1]
+                return('2.c')
         else:
-            # 2.d
-            dfields['examples'] = fields[0]
-            dfields['notes'] = fields[1]
-
-    elif len(fields) == 3:
-        if is_kanji(fields[0]):
-            # 3.a: kanji leads
-            dfields['kanji'] = fields[0]
-            dfields['reading'] = fields[1]
-            dfields['examples'] = fields[2]
+            return('2.d')
+    elif n_fields == 3:
+        if first_class == KANJI:
+            return('3.a')
         else:
-            # 3.b: reading leads
-            dfields['reading'] = fields[0]
-            dfields['examples'] = fields[1]
-            dfields['notes'] = fields[2]
-
-
-    elif len(fields) == 4:
-        old_kanji = extract_old_kanji(fields[1])
-        if old_kanji:
-            # 4.a: old_kanji line.
-            dfields['kanji'] = fields[0]
-            dfields['old_kanji'] = old_kanji
-            dfields['reading'] = fields[2]
-            if dfields['kanji'] == '弥':
-                # exceptionally without examples in this line
-                dfields['notes'] = fields[3]
-            else:
-                dfields['examples'] = fields[3]
-
-        elif is_kanji(fields[0]):
-            if fields[0] == '弁':
-                # 4.d exception: old kanji without parenthesis.
-                dfields['kanji'] = fields[0]
-                dfields['old_kanji'] = fields[1]
-                dfields['reading'] = fields[2]
-                dfields['examples'] = fields[3]
-            else:
-                # 4.b.
-                dfields['kanji'] = fields[0]
-                dfields['reading'] = fields[1]
-                dfields['examples'] = fields[2]
-                dfields['notes'] = fields[3]
+            return('3.b')
+    elif n_fields == 4:
+        if second_class == OLD_KANJI:
+            return('4.a')
+        elif first_class == KANJI:
+            return('4.b')
         else:
-            # must be 4.c exception.
-            assert(fields[0] == '（餠）')
-            dfields['old_kanji'] = '餠'
-            dfields['reading'] = fields[1]
-            dfields['examples'] = fields[2]
-            dfields['notes'] = fields[3]
-
-    elif len(fields) == 5:
-        old_kanji = extract_old_kanji(fields[1])
-        if old_kanji:
-            # 5.a: kanji with old form, examples, notes
-            dfields['kanji'] = fields[0]
-            dfields['old_kanji'] = old_kanji
-            dfields['reading'] = fields[2]
-            dfields['examples'] = fields[3]
-            dfields['notes'] = fields[4]
-
-        elif fields[0] == '亀':
-            # 5.c: exception: unencoded old form
-            dfields['kanji'] = fields[0]
-            dfields['old_kanji'] = '龜'
-            dfields['reading'] = fields[3]
-            dfields['examples'] = fields[4]
-
+            return('4.c')
+    elif n_fields == 5:
+        if second_class == OLD_KANJI:
+            return('5.a')
         else:
-            # must be type 5.b: kanji with variant
-            match = re.match("［(.)］$", fields[1])
-            assert(match)
-            dfields['kanji'] = fields[0]
-
-            # throw away match[1]; it's bogus in the .txt, and will be
-            # identical to fields[0].
-
-            dfields['reading'] = fields[2]
-            dfields['examples'] = fields[3]
-            dfields['notes'] = fields[4]
-
-    if 'kanji' in dfields.keys():
-        assert(is_kanji(dfields['kanji']))
-    if 'old_kanji' in dfields.keys():
-        assert(is_kanji(dfields['old_kanji']))
-    if 'reading' in dfields.keys():
-        assert(is_reading(dfields['reading']))
-    if 'examples' in dfields.keys():
-        assert(is_examples(dfields['examples']))
-    if 'notes' in dfields.keys():
-        assert(is_notes(dfields['notes']))
-    return(dfields)
+            return('5.b')
+    else:
+        raise(RuntimeError("BUG: unknown row with %d fields" % n_fields))
+
+# Dispatch table from (number of fields, class of first field, class of second
+# field) to row type, so that each row is decided by a single lookup.
+FIELD_CLASSES = (KANJI, OLD_KANJI, VARIANT, READING, INDENTED_READING,
+                 EXAMPLES, NOTES)
+MAIN_TABLE_DISPATCH = {
+    (n_fields, first_class, second_class):
+        main_table_row_type(n_fields, first_class, second_class)
+    for n_fields in range(1, 6)
+    for first_class in FIELD_CLASSES
+    for second_class in FIELD_CLASSES + (None,)
+}
+
+def main_table_row_type_and_fields(line):
+    """Like main_table_row_fields(), but also return the row type.
+
+    >>> main_table_row_type_and_fields("涙\\t（淚）\\t \\t \\t\\t \\t \\t ルイ\\t 感涙\\t\\n")
+    ('4.a', {'kanji': '涙', 'old_kanji': '淚', 'reading': 'ルイ', 'examples': '感涙'})
+    """
+
+    fields = split_main_table_row(line)
+    classes = [classify_field(field) for field in fields]
+    n_fields = len(fields)
+
+    row_type = MAIN_TABLE_EXCEPTIONS.get((n_fields, fields[0]))
+    if not row_type:
+        second_class = classes[1] if n_fields > 1 else None
+        row_type = MAIN_TABLE_DISPATCH[(n_fields, classes[0], second_class)]
+
+    dfields = dict()
+    for column, field, field_class in zip(MAIN_TABLE_ROW_TYPES[row_type],
+                                          fields, classes):
+        if column:
+            assert(field_class in COLUMN_FIELD_CLASSES[column])
+            if field_class == OLD_KANJI and column == 'old_kanji':
+                field = field[1]
+            dfields[column] = field
+
+    if row_type == '1.b':
+        assert(fields[0][0] in ('極', '慌', '四'))
+    elif row_type == '4.c':
+        assert(fields[0] == '（餠）')
+    elif row_type == '5.b':
+        # the kanji in brackets is bogus in the .txt, and will be identical
+        # to fields[0]; throw it away.
+        assert(classes[1] == VARIANT)
+    elif row_type == '5.c':
+        # unencoded old form
+        dfields['old_kanji'] = '龜'
+
+    return((row_type, dfields))
 
 
 def split_main_table_row(line):
@@ -485,321 +841,379 @@ def split_main_table_row(line):
 
     # We can't use Python strip() as-is, because it would eat the U+3000
     # wide-space.  To clean the left side of the line, we remove strictly
-    # regular spaces and tabs.
-    line = re.sub("^[ \t]+", '', line)
-    # But trailing whitespace to the right side is fair game.
-    line = line.rstrip()
+    # regular spaces and tabs.  But trailing whitespace to the right side is
+    # fair game.
+    line = line.lstrip(" \t").rstrip()
+
+    # Then split on runs of spaces and tabs (cf. field_separator_regexp).
+    return(field_separator_regexp.split(line))
+
+# Fields are separated by any run of spaces and tabs; except that the "Notes"
+# column uses a regular space after '⇔', which isn't a separator.
+field_separator_regexp = re.compile(r"(?:(?<!⇔) |\t)[ \t]*")
+
+# Classifies a single field: each named group is a class of field (cf.
+# classify_field()), tried in order.
+field_regexp = re.compile(r"""
+    (?P<kanji>\p{Han})
+    | (?P<reading>[\p{Hiragana}\p{Katakana}]+)
+    | (?P<indented_reading>[\u3000\p{Hiragana}\p{Katakana}]+)
+    # found experimentally; it doesn't match glossed examples, which are
+    # indistinguishable from notes.
+    | (?P<examples>[\p{Han}\p{Hiragana}\p{Katakana}，〔〕…○Ａ]+)
+    | (?P<old_kanji>（\p{Han}）)
+    | (?P<variant>［.］)
+""", re.VERBOSE)
 
-    # The "Notes" column uses a regular space after '⇔'; we replace it with a
-    # special char, to simplify splitting.  The special char is from Unicode
-    # private-use area, which isn't used by the Joyo table.
-    line = line.replace('⇔ ', "⇔\ue000")
+glossed_examples = [
+    '一羽（わ）',
+    '六羽（ぱ）',
+    '三日（みっか）',
+    '四日（よっか）',
+    '一把（ワ）',
+    '三把（バ）',
+    '十把（パ）',
+]
+
+def classify_field(field):
+    """Return the class of a main table field: KANJI, OLD_KANJI, VARIANT,
+    READING, INDENTED_READING, EXAMPLES or NOTES.
 
-    # We can't use the defalt split() algorithm either.  So we first compress
-    # sequences of spaces and tabs into another private char, as a separator...
-    line = line.replace("\t", "\ue001")
-    line = re.sub("[ \ue001]+", "\ue001", line)
-    # Then give '⇔' its space back...
-    line = line.replace("\ue000", ' ')
-    # And, finally, split on the separator-char.
-    fields = line.split("\ue001")
+    >>> [classify_field(f) for f in ('哀', '（哀）', '［遡］', '\u3000あわれ', '哀れ，哀れな話')]
+    ['kanji', 'old_kanji', 'variant', 'indented_reading', 'examples']
+    >>> [classify_field(f) for f in ('一羽（わ），三羽', '真っ赤（まっか）')]
+    ['examples', 'notes']
+    """
+
+    match = field_regexp.fullmatch(field)
+    if match:
+        return(match.lastgroup)
 
-    return(fields)
+    for part in field.split('，'):
+        if part in glossed_examples:
+            return(EXAMPLES)
 
+    return(NOTES)
 
-kanji_regexp = re.compile(r"^\p{Han}$")
 def is_kanji(field):
-    return(re.match(kanji_regexp, field))
+    return(classify_field(field) == KANJI)
 
 def extract_old_kanji(field):
     """Return None if it isn't an old kanji field."""
-    match = re.match(r"^（(\p{Han})）$", field)
-    if match:
-        return(match[1])
+    if classify_field(field) == OLD_KANJI:
+        return(field[1])
     else:
         return None
 
-reading_regexp = re.compile(r"^[\u3000\p{Hiragana}\p{Katakana}]+$")
 def is_reading(field):
-    return(re.match(reading_regexp, field))
-
-# found experimentally; it doesn't match glossed examples, which are
-# indistinguishable from notes.
-examples_regexp = re.compile(r"[\p{Han}\p{Hiragana}\p{Katakana}，〔〕…○Ａ]+$")
-glossed_examples = [
-    '一羽（わ）',
-    '六羽（ぱ）',
-    '三日（みっか）',
-    '四日（よっか）',
-    '一把（ワ）',
-    '三把（バ）',
-    '十把（パ）',
-]
+    return(classify_field(field) in COLUMN_FIELD_CLASSES['reading'])
 
 def is_examples(field):
-    if re.match(examples_regexp, field):
-        return True
-    else:
-        parts = field.split('，')
-        for part in parts:
-            if part in glossed_examples:
-                return True
-
-    return False
+    return(classify_field(field) in COLUMN_FIELD_CLASSES['examples'])
 
 def is_notes(field):
-    return(not is_kanji(field)
-           and not is_reading(field)
-           and not is_examples(field))
+    return(classify_field(field) in COLUMN_FIELD_CLASSES['notes'])
+
+# Compounds with multiple kanji orthographies, marked by long {} in the PDF;
+# they end up bundled together in the TXT (e.g. 海女海士), and are split by
+# split_appendix_multiples().
+APPENDIX_MULTIPLES = (
+    '海女',
+    '海士',
+    '河原',
+    '川原',
+    '叔父',
+    '伯父',
+    '叔母',
+    '伯母',
+    '母屋',
+    '母家',
+    '数寄屋',
+    '数奇屋',
+    '二十',
+    '二十歳',
+)
+
+# Alternatives first by length, so that the longest multiple matches.
+appendix_multiples_regexp = re.compile(
+    '|'.join(sorted(APPENDIX_MULTIPLES, key=len, reverse=True)))
+
+# The informative note makes these split over several lines; we just
+# hardcoded them.  They replace anything parsed for the same readings.
+APPENDIX_HARDCODED = {
+    'しわす': ['師走'],
+    'しはす': ['師走'],
+    'はつか': ['二十日'],
+}
+
+def split_appendix_multiples(orthography):
+    """Split bundled orthographies from the appendix; returns a list.
+
+    Only strings made up entirely of APPENDIX_MULTIPLES are split:
+
+    >>> split_appendix_multiples('海女海士')
+    ['海女', '海士']
+    >>> split_appendix_multiples('二十二十歳')
+    ['二十', '二十歳']
+    >>> split_appendix_multiples('海原')
+    ['海原']
+    """
 
-def add_kanji(string):
-    "Add a kanji object to loaded_data."
-    loaded_data.kanjis.append(Kanji(string))
+    parts = appendix_multiples_regexp.findall(orthography)
+    if len(parts) > 1 and ''.join(parts) == orthography:
+        logging.info("Splitting %s into %s" % (orthography, ','.join(parts)))
+        return(parts)
+    return([orthography])
 
-def current_kanji():
-    "Access the kanji object currently under construction."
-    return(loaded_data.kanjis[-1])
+def parse_appendix_table(joyotxt):
+    """Reads the appendix table (付表) of compound readings, up to the end of
+    the file, in a single pass.  Returns a CompoundDictionary.
+    """
 
-def parse_appendix_table():
     appendix = defaultdict(list)
+    multiples_found = set()
 
-    for line in loaded_data.joyotxt:
+    for line in joyotxt:
         # skip page numbers and index headers
-        if is_empty(line) or is_page_index(line) or is_sound_index(line):
+        if classify_line(line) in SKIPPED_LINES:
             continue
 
         fields = line.split()
 
         if len(fields) == 4:
-            # almost all lines of the table result in 4 fields in the txt, as follows:
-
-            appendix[fields[0]].append(fields[1])
-            appendix[fields[2]].append(fields[3])
-
-
-    # these are the ones with multiple kanji orthographies, marked by
-    # long {} in the PDF; they end up bundled together in the TXT
-    multiples = [
-        '海女',
-        '海士',
-        '河原',
-        '川原',
-        '叔父',
-        '伯父',
-        '叔母',
-        '伯母',
-        '母屋',
-        '母家',
-        '数寄屋',
-        '数奇屋',
-        '二十',
-        '二十歳',
-    ]
-
-    for kana, kanjis in appendix.items():
-        for kanji in kanjis:
-            for multiple in multiples:
-                match = re.match('^(%s)(.+)$' % multiple, kanji)
-                if match:
-                    kanji1 = match[1]
-                    kanji2 = match[2]
-                    logging.info("Splitting %s into %s,%s" % (kanji, kanji1, kanji2))
-
-                    appendix[kana].append(kanji1)
-                    appendix[kana].append(kanji2)
-
-                    appendix[kana].remove(kanji)
-                    multiples.remove(kanji1)
-                    multiples.remove(kanji2)
-    assert(multiples == [])
-
-    # the informative note makes this split over several lines; we just
-    # hardcoded it.
-    appendix['しわす'] = ['師走']
-    appendix['しはす'] = ['師走']
-    appendix['はつか'] = ['二十日']
-
-    loaded_data.compound_readings = appendix
-    loaded_data.joyotxt.close()
-
-def convert_to_tsv():
-    with open(outputdir + '/kanji_variants.tsv', 'wt') as f:
-        f.write(tsv_line('Kanji',
-                         'Codepoint',
-                         'Old',
-                         'Old codepoint',
-                         'Popular',
-                         'Popular codepoint',
-                         'Standard variation sequence',
-                         'Standard variation sequence codepoint',
-                         'Acceptable variation sequence',
-                         'Acceptable variation sequence codepoint',
-                         'Documentation'))
-
-        for k in loaded_data.kanjis:
-            if k.standard_character:
-                kanji = k.standard_character
-                kanji_cp = codepoint_str(kanji)
-                popular = k.kanji
-                popular_cp = codepoint_str(popular)
+            # almost all lines of the table result in 4 fields in the txt:
+            # reading, orthography, reading, orthography.
+            for reading, orthography in (fields[0:2], fields[2:4]):
+                orthographies = split_appendix_multiples(orthography)
+                if len(orthographies) > 1:
+                    multiples_found.update(orthographies)
+                appendix[reading].extend(orthographies)
+
+    assert(multiples_found == set(APPENDIX_MULTIPLES))
+    appendix.update(APPENDIX_HARDCODED)
+    return(CompoundDictionary(appendix))
+
+# Headers of the TSV files generated by convert_to_tsv(), by file name.
+TSV_HEADERS = {
+    'kanji_variants.tsv': ('Kanji',
+                           'Codepoint',
+                           'Old',
+                           'Old codepoint',
+                           'Popular',
+                           'Popular codepoint',
+                           'Standard variation sequence',
+                           'Standard variation sequence codepoint',
+                           'Acceptable variation sequence',
+                           'Acceptable variation sequence codepoint',
+                           'Documentation'),
+    'readings.tsv': ('Kanji', 'Reading', 'Romaji', 'Type', 'Uncommon?',
+                     'Variation of', 'Alternative orthographies'),
+    'alternate_orthographies.tsv': ('Kanji', 'Reading',
+                                    'Alternative orthography'),
+    'old_kanji.tsv': None,
+    'examples.tsv': ('Kanji', 'Reading', 'Uncommon reading?', 'Variation of',
+                     'Example', 'POS of example', 'Literary?'),
+    'notes_for_kanjis.tsv': ('Kanji', 'Note'),
+    'notes_for_readings.tsv': ('Kanji', 'Reading', 'Uncommon?', 'Note'),
+    'compounds_by_reading.tsv': ('Reading', 'Orthography'),
+    'compounds_by_kanji.tsv': ('Kanji', 'Compound', 'Reading'),
+    'placenames.tsv': ('Kanji', 'Placename', 'Reading'),
+}
+
+@register_exporter('tsv')
+def convert_to_tsv(directory=outputdir, db=None):
+    """Save a JoyoDB (by default, loaded_data.db) as TSV files in directory.
+
+    All tables are filled in a single walk over the kanji and their readings,
+    and each file is built in memory, then written at once by
+    write_if_changed(); files whose contents didn't change are left untouched.
+    Returns the list of file names that were actually written.
+    """
+
+    tables = {}
+    for name, header in TSV_HEADERS.items():
+        tables[name] = [tsv_line(*header)] if header else []
+
+    kanji_variants = tables['kanji_variants.tsv']
+    readings = tables['readings.tsv']
+    alternate_orthographies = tables['alternate_orthographies.tsv']
+    old_kanji = tables['old_kanji.tsv']
+    examples = tables['examples.tsv']
+    notes_for_kanjis = tables['notes_for_kanjis.tsv']
+    notes_for_readings = tables['notes_for_readings.tsv']
+    placenames = tables['placenames.tsv']
+    # compounds_by_kanji.tsv is sorted by kanji: (kanji, lines) pairs.
+    compounds_by_kanji = []
+
+    if db is None:
+        db = loaded_data.db
+    for k in db.kanjis:
+        if k.standard_character:
+            kanji = k.standard_character
+            kanji_cp = codepoint_str(kanji)
+            popular = k.kanji
+            popular_cp = codepoint_str(popular)
+        else:
+            kanji = k.kanji
+            kanji_cp = codepoint_str(kanji)
+            popular = popular_cp = ''
+
+        if k.old_kanji:
+            if type(k.old_kanji) ==  str:
+                old = {k.old_kanji: codepoint_str(k.old_kanji)}
             else:
-                kanji = k.kanji
-                kanji_cp = codepoint_str(kanji)
-                popular = popular_cp = ''
+                old={}
+                for o in k.old_kanji:
+                    old[o] = codepoint_str(o)
+        else:
+            old = {}
 
-            if k.old_kanji:
-                if type(k.old_kanji) ==  str:
-                    old = {k.old_kanji: codepoint_str(k.old_kanji)}
-                else:
-                    old={}
-                    for o in k.old_kanji:
-                        old[o] = codepoint_str(o)
+        if k.standard_variant:
+            sv = k.standard_variant
+            sv_cp = codepoint_str(sv)
+            av = k.accepted_variant
+            av_cp = codepoint_str(av)
+        else:
+            sv = sv_cp = av = av_cp = ''
+
+        doc = k.joyo_documentation or ''
+
+        if old:
+            for o, o_cp in sorted(old.items()):
+                kanji_variants.append(tsv_line(kanji,
+                                               kanji_cp,
+                                               o,
+                                               o_cp,
+                                               popular,
+                                               popular_cp,
+                                               sv,
+                                               sv_cp,
+                                               av,
+                                               av_cp,
+                                               doc))
+        elif not ('' == popular == popular_cp == sv == sv_cp == av == av_cp
+                  == doc):
+                kanji_variants.append(tsv_line(kanji,
+                                               kanji_cp,
+                                               '',
+                                               '',
+                                               popular,
+                                               popular_cp,
+                                               sv,
+                                               sv_cp,
+                                               av,
+                                               av_cp,
+                                               doc))
+
+        if type(k.old_kanji) is list:
+            for o in k.old_kanji:
+                old_kanji.append(tsv_line(k.kanji, o))
+        elif k.old_kanji:
+            old_kanji.append(tsv_line(k.kanji, k.old_kanji))
+
+        if k.notes:
+            notes_for_kanjis.append(tsv_line(k.kanji, k.notes))
+
+        if k.compound_readings:
+            compounds_by_kanji.append(
+                (k.kanji, [tsv_line(k.kanji, ort, gloss)
+                           for ort, gloss in sorted(k.compound_readings.items())]))
+
+        for ort, gloss in k.placename_readings.items():
+            placenames.append(tsv_line(k.kanji, ort, gloss))
+
+        for r in k.readings:
+            if r.uncommon:
+                uncommon = 'Y'
             else:
-                old = {}
+                uncommon = ''
+
+            variation = r.variation_of or ''
 
-            if k.standard_variant:
-                sv = k.standard_variant
-                sv_cp = codepoint_str(sv)
-                av = k.accepted_variant
-                av_cp = codepoint_str(av)
+            if r.alternate_orthographies:
+                altort = ','.join(r.alternate_orthographies)
             else:
-                sv = sv_cp = av = av_cp = ''
-
-            doc = k.joyo_documentation or ''
-
-
-            if old:
-                for o, o_cp in sorted(old.items()):
-                    f.write(tsv_line(kanji,
-                                     kanji_cp,
-                                     o,
-                                     o_cp,
-                                     popular,
-                                     popular_cp,
-                                     sv,
-                                     sv_cp,
-                                     av,
-                                     av_cp,
-                                     doc))
-            elif not ('' == popular == popular_cp == sv == sv_cp == av == av_cp
-                      == doc):
-                    f.write(tsv_line(kanji,
-                                     kanji_cp,
-                                     '',
-                                     '',
-                                     popular,
-                                     popular_cp,
-                                     sv,
-                                     sv_cp,
-                                     av,
-                                     av_cp,
-                                     doc))
-
-
-    with open(outputdir + '/readings.tsv', 'wt') as f:
-        f.write("Kanji\tReading\tRomaji\tType\tUncommon?\tVariation of\tAlternative orthographies\n")
-        for k in loaded_data.kanjis:
-            for r in k.readings:
-
-                if r.uncommon:
-                    uncommon = 'Y'
+                altort = ''
+
+            readings.append(tsv_line(
+                k.kanji,
+                r.reading,
+                r.romaji(),
+                r.kind,
+                uncommon,
+                variation,
+                altort))
+
+            for a in r.alternate_orthographies:
+                alternate_orthographies.append(tsv_line(k.kanji, r.reading, a))
+
+            for e in r.examples:
+                if e.pos:
+                    pos = e.pos
                 else:
-                    uncommon = ''
+                    pos = ''
 
-                if r.alternate_orthographies:
-                    altort = ','.join(r.alternate_orthographies)
+                if e.literary:
+                    lit = 'Y'
                 else:
-                    altort = ''
+                    lit = ''
 
-                f.write(tsv_line(
+                examples.append(tsv_line(k.kanji, r.reading, uncommon,
+                                         variation, e.example, pos, lit))
+
+            if r.notes:
+                notes_for_readings.append(tsv_line(
                     k.kanji,
                     r.reading,
-                    r.romaji(),
-                    r.kind,
                     uncommon,
-                    r.variation_of or '',
-                    altort))
-
-    with open(outputdir + '/alternate_orthographies.tsv', 'wt') as f:
-        f.write("Kanji\tReading\tAlternative orthography\n")
-        for k in loaded_data.kanjis:
-            for r in k.readings:
-                for a in r.alternate_orthographies:
-                    f.write(tsv_line(k.kanji, r.reading, a))
-
-
-    with open(outputdir + '/old_kanji.tsv', 'wt') as f:
-        for k in loaded_data.kanjis:
-            if type(k.old_kanji) is list:
-                for old in k.old_kanji:
-                    f.write(tsv_line(k.kanji, old))
-            elif k.old_kanji:
-                f.write(tsv_line(k.kanji, k.old_kanji))
-
-    with open(outputdir + '/examples.tsv', 'wt') as f:
-        f.write("Kanji\tReading\tUncommon reading?\tVariation of\tExample\tPOS of example\tLiterary?\n")
-        for k in loaded_data.kanjis:
-            for r in k.readings:
-                if r.uncommon:
-                    uncommon = 'Y'
-                else:
-                    uncommon = ''
+                    r.notes))
 
-                variation = r.variation_of or ''
+    for kanji, lines in sorted(compounds_by_kanji, key=lambda pair: pair[0]):
+        tables['compounds_by_kanji.tsv'].extend(lines)
 
+    for kana in sorted(db.compound_readings.keys()):
+        for kanji in sorted(db.compound_readings[kana]):
+            tables['compounds_by_reading.tsv'].append(tsv_line(kana, kanji))
 
-                for e in r.examples:
-                    if e.pos:
-                        pos = e.pos
-                    else:
-                        pos = ''
+    written = []
+    for name, lines in tables.items():
+        if write_if_changed(directory + '/' + name, ''.join(lines)):
+            written.append(name)
+    return(written)
 
-                    if e.literary:
-                        lit = 'Y'
-                    else:
-                        lit = ''
+def write_if_changed(filename, content):
+    """Atomically replace filename with string content, unless it's the same.
 
-                    f.write(tsv_line(k.kanji, r.reading, uncommon, variation, e.example, pos, lit))
+    The new content is written with joyodb.cache.atomic_write(), so readers
+    see either the old or the new file, never a partial one.  If the file already has exactly this content, nothing is written, so its
+    modification time is preserved (and tools like rsync or make can skip
+    it).  Returns True if the file was written.
+
+    >>> import tempfile
+    >>> filename = tempfile.mkdtemp() + '/test.tsv'
+    >>> write_if_changed(filename, "a\\tb\\n")
+    True
+    >>> write_if_changed(filename, "a\\tb\\n")
+    False
+    >>> write_if_changed(filename, "a\\tc\\n")
+    True
+    >>> open(filename).read()
+    'a\\tc\\n'
+    """
 
-    with open(outputdir + '/notes_for_kanjis.tsv', 'wt') as f:
-        f.write("Kanji\tNote\n")
-        for k in loaded_data.kanjis:
-            if k.notes:
-                f.write(tsv_line(k.kanji, k.notes))
+    data = content.encode('utf-8')
+    try:
+        if os.path.getsize(filename) == len(data):
+            with open(filename, 'rb') as f:
+                if f.read() == data:
+                    return False
+    except OSError:
+        pass
 
-    with open(outputdir + '/notes_for_readings.tsv', 'wt') as f:
-        f.write("Kanji\tReading\tUncommon?\tNote\n")
-        for k in loaded_data.kanjis:
-            for r in k.readings:
-                if r.uncommon:
-                    uncommon = 'Y'
-                else:
-                    uncommon = ''
-
-                if r.notes:
-                    f.write(tsv_line(
-                        k.kanji,
-                        r.reading,
-                        uncommon,
-                        r.notes))
-
-    with open(outputdir + '/compounds_by_reading.tsv', 'wt') as f:
-        f.write("Reading\tOrthography\n")
-        for kana in sorted(loaded_data.compound_readings.keys()):
-            for kanji in sorted(loaded_data.compound_readings[kana]):
-                f.write(tsv_line(kana, kanji))
-
-    with open(outputdir + '/compounds_by_kanji.tsv', 'wt') as f:
-        f.write("Kanji\tCompound\tReading\n")
-        for k in sorted(loaded_data.kanjis, key=lambda k: k.kanji):
-            for ort, gloss in sorted(k.compound_readings.items()):
-                f.write(tsv_line(k.kanji, ort, gloss))
-
-    with open(outputdir + '/placenames.tsv', 'wt') as f:
-        f.write("Kanji\tPlacename\tReading\n")
-        for k in loaded_data.kanjis:
-            for ort, gloss in k.placename_readings.items():
-                f.write(tsv_line(k.kanji, ort, gloss))
+    with atomic_write(filename) as tmp:
+        with open(tmp, 'wb') as f:
+            f.write(data)
+    return True
 
 def tsv_line(*fields):
     return("\t".join(fields) + "\n")
@@ -823,9 +1237,340 @@ def codepoint_str(string):
     return(','.join(['%04x' % ord(ch)
                      for ch in string]))
 
-def convert_to_sql():
-    pass
-def convert_to_html():
+def load_tsv(directory=outputdir):
+    """Rebuild Kanji, Reading and Example objects from converted TSV files.
+
+    This is the inverse of convert_to_tsv(): it reads the tables in directory
+    (by default, the bundled output/ directory), one pass per file, without
+    needing the Joyo PDF or its .txt conversion.  Returns a JoyoDB snapshot,
+    just like parse().
+
+    >>> db = load_tsv()
+    >>> len(db.kanjis)
+    2136
+    >>> k = db['𠮟']
+    >>> k.standard_character
+    '𠮟'
+    >>> print(k)
+    叱 [シツ,しか.る]
+    >>> k.readings[1].examples[0].example
+    '叱る'
+    >>> db.compound_readings['あす']
+    ('明日',)
+    """
+
+    standard_characters = {popular: default for default, popular
+                           in load_popular_alternatives().items()}
+
+    def rows(filename, header=True):
+        with open(directory + '/' + filename, 'rt') as f:
+            if header:
+                f.readline()
+            for line in f:
+                yield line.rstrip("\n").split("\t")
+
+    kanjis = []
+    by_kanji = {}
+    by_reading = {}
+
+    for (kanji, reading, romaji, kind, uncommon, variation_of,
+         altort) in rows('readings.tsv'):
+        if kanji not in by_kanji:
+            k = Kanji(standard_characters.get(kanji, kanji))
+            kanjis.append(k)
+            by_kanji[kanji] = k
+        k = by_kanji[kanji]
+
+        if uncommon:
+            reading = "\u3000" + reading
+        k.add_reading(reading, kind=kind, variation_of=variation_of or None)
+        r = k.readings[-1]
+        if altort:
+            r.alternate_orthographies = altort.split(',')
+        by_reading[(kanji, r.reading)] = r
+
+    for (kanji, reading, uncommon, variation_of, example, pos,
+         literary) in rows('examples.tsv'):
+        e = Example(example)
+        e.pos = PartOfSpeech(pos) if pos else None
+        e.literary = (literary == 'Y')
+        by_reading[(kanji, reading)].examples.append(e)
+
+    for kanji, old in rows('old_kanji.tsv', header=False):
+        by_kanji[kanji].add_old_kanji(old)
+
+    for fields in rows('kanji_variants.tsv'):
+        kanji, popular, documentation = fields[0], fields[4], fields[10]
+        if documentation:
+            by_kanji[popular or kanji].joyo_documentation = documentation
+
+    for kanji, note in rows('notes_for_kanjis.tsv'):
+        by_kanji[kanji].notes = note
+
+    for kanji, reading, uncommon, note in rows('notes_for_readings.tsv'):
+        by_reading[(kanji, reading)].notes = note
+
+    for kanji, orthography, reading in rows('compounds_by_kanji.tsv'):
+        by_kanji[kanji].add_compound_reading(orthography, reading)
+
+    for kanji, placename, reading in rows('placenames.tsv'):
+        by_kanji[kanji].add_placename_reading(placename, reading, None)
+
+    compound_readings = defaultdict(list)
+    for reading, orthography in rows('compounds_by_reading.tsv'):
+        compound_readings[reading].append(orthography)
+
+    return(JoyoDB(kanjis, compound_readings))
+
+# Schema of the SQLite database generated by convert_to_sql().  Columns follow
+# the attributes of the model classes; see their documentation.
+SQL_SCHEMA = """
+CREATE TABLE kanji (
+    id INTEGER PRIMARY KEY,
+    kanji TEXT NOT NULL UNIQUE,
+    codepoint TEXT NOT NULL,
+    standard_character TEXT,
+    joyo_documentation TEXT
+);
+CREATE TABLE old_kanji (
+    kanji_id INTEGER NOT NULL REFERENCES kanji(id),
+    old_kanji TEXT NOT NULL
+);
+CREATE TABLE variants (
+    kanji_id INTEGER NOT NULL REFERENCES kanji(id),
+    standard_variant TEXT NOT NULL,
+    accepted_variant TEXT NOT NULL
+);
+CREATE TABLE readings (
+    id INTEGER PRIMARY KEY,
+    kanji_id INTEGER NOT NULL REFERENCES kanji(id),
+    reading TEXT NOT NULL,
+    -- the reading in hiragana, without okurigana dot, for lookups
+    hiragana TEXT NOT NULL,
+    romaji TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    uncommon INTEGER NOT NULL,
+    variation_of TEXT
+);
+CREATE TABLE alternate_orthographies (
+    reading_id INTEGER NOT NULL REFERENCES readings(id),
+    orthography TEXT NOT NULL
+);
+CREATE TABLE examples (
+    id INTEGER PRIMARY KEY,
+    reading_id INTEGER NOT NULL REFERENCES readings(id),
+    example TEXT NOT NULL,
+    pos TEXT,
+    literary INTEGER NOT NULL
+);
+-- reading_id is NULL for kanji-scoped notes
+CREATE TABLE notes (
+    id INTEGER PRIMARY KEY,
+    kanji_id INTEGER NOT NULL REFERENCES kanji(id),
+    reading_id INTEGER REFERENCES readings(id),
+    note TEXT NOT NULL
+);
+-- compounds from the appendix (付表)
+CREATE TABLE compounds (
+    reading TEXT NOT NULL,
+    orthography TEXT NOT NULL
+);
+-- compounds listed in the notes for each kanji
+CREATE TABLE kanji_compounds (
+    kanji_id INTEGER NOT NULL REFERENCES kanji(id),
+    orthography TEXT NOT NULL,
+    reading TEXT NOT NULL
+);
+CREATE TABLE placenames (
+    kanji_id INTEGER NOT NULL REFERENCES kanji(id),
+    placename TEXT NOT NULL,
+    reading TEXT NOT NULL
+);
+
+CREATE INDEX old_kanji_old_kanji ON old_kanji(old_kanji);
+CREATE INDEX old_kanji_kanji_id ON old_kanji(kanji_id);
+CREATE INDEX readings_kanji_id ON readings(kanji_id);
+CREATE INDEX readings_hiragana ON readings(hiragana);
+CREATE INDEX readings_romaji ON readings(romaji COLLATE NOCASE);
+CREATE INDEX alternate_orthographies_reading_id ON alternate_orthographies(reading_id);
+CREATE INDEX examples_reading_id ON examples(reading_id);
+CREATE INDEX examples_example ON examples(example);
+CREATE INDEX notes_kanji_id ON notes(kanji_id);
+CREATE INDEX compounds_reading ON compounds(reading);
+CREATE INDEX compounds_orthography ON compounds(orthography);
+CREATE INDEX kanji_compounds_kanji_id ON kanji_compounds(kanji_id);
+CREATE INDEX placenames_kanji_id ON placenames(kanji_id);
+"""
+
+# Full-text index over examples and notes.  'kind' is 'example' or 'note', and
+# 'ref' the id in the corresponding table.  Japanese has no spaces between
+# words, so we index each character as a token (the text is stored with spaces
+# between characters); searching for a phrase of characters then finds any
+# substring, of any length (cf. search_sql()).
+SQL_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE search USING fts5(
+    text,
+    kind UNINDEXED,
+    ref UNINDEXED
+);
+"""
+
+@register_exporter('sql')
+def convert_to_sql(filename=None, db=None):
+    """Save a JoyoDB (by default, loaded_data.db) as an SQLite database (by
+    default, joyodb.sqlite3 in outputdir).
+
+    All rows are inserted with executemany() in a single transaction, into a
+    temporary file which then replaces filename (cf.
+    joyodb.cache.atomic_write()), so readers never see a partial database.  Cf. SQL_SCHEMA for the tables, and open_sql() to query
+    the result.
+    """
+
+    import sqlite3
+
+    filename = filename or outputdir + '/joyodb.sqlite3'
+
+    kanji_rows = []
+    old_kanji_rows = []
+    variant_rows = []
+    reading_rows = []
+    altort_rows = []
+    example_rows = []
+    note_rows = []
+    kanji_compound_rows = []
+    placename_rows = []
+
+    reading_id = example_id = 0
+    data = loaded_data.db if db is None else db
+    for kanji_id, k in enumerate(data.kanjis, 1):
+        kanji_rows.append((kanji_id, k.kanji, codepoint_str(k.kanji),
+                           k.standard_character, k.joyo_documentation))
+
+        if type(k.old_kanji) is list:
+            old_kanjis = k.old_kanji
+        else:
+            old_kanjis = [k.old_kanji] if k.old_kanji else []
+        for old in old_kanjis:
+            old_kanji_rows.append((kanji_id, old))
+
+        if k.standard_variant:
+            variant_rows.append((kanji_id, k.standard_variant,
+                                 k.accepted_variant))
+        if k.notes:
+            note_rows.append((kanji_id, None, k.notes))
+        for ort, gloss in k.compound_readings.items():
+            kanji_compound_rows.append((kanji_id, ort, gloss))
+        for ort, gloss in k.placename_readings.items():
+            placename_rows.append((kanji_id, ort, gloss))
+
+        for r in k.readings:
+            reading_id += 1
+            reading_rows.append((reading_id, kanji_id, r.reading,
+                                 r.to_hiragana().replace('.', ''),
+                                 r.romaji(), r.kind, int(r.uncommon),
+                                 r.variation_of))
+            for a in r.alternate_orthographies:
+                altort_rows.append((reading_id, a))
+            if r.notes:
+                note_rows.append((kanji_id, reading_id, r.notes))
+            for e in r.examples:
+                example_id += 1
+                example_rows.append((example_id, reading_id, e.example,
+                                     e.pos, int(e.literary)))
+
+    compound_rows = [(kana, kanji)
+                     for kana in sorted(data.compound_readings.keys())
+                     for kanji in sorted(data.compound_readings[kana])]
+
+    note_rows = [(note_id,) + row for note_id, row in enumerate(note_rows, 1)]
+
+    search_rows = ([(' '.join(row[2]), 'example', row[0])
+                    for row in example_rows] +
+                   [(' '.join(row[3]), 'note', row[0])
+                    for row in note_rows])
+
+    with atomic_write(filename) as tmp:
+        # Left over by a killed run, perhaps; SQLite would open it as is.
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        conn = sqlite3.connect(tmp)
+        try:
+            # We're writing to a temporary file, which is only renamed when
+            # complete; so there's no need for journaling or syncing.
+            conn.execute('PRAGMA journal_mode = OFF')
+            conn.execute('PRAGMA synchronous = OFF')
+            with conn:
+                conn.executescript(SQL_SCHEMA)
+                try:
+                    conn.executescript(SQL_FTS_SCHEMA)
+                except sqlite3.OperationalError:
+                    logging.warning("SQLite lacks FTS5; "
+                                    "not creating search table.")
+                    search_rows = None
+
+                conn.executemany('INSERT INTO kanji VALUES (?,?,?,?,?)',
+                                 kanji_rows)
+                conn.executemany('INSERT INTO old_kanji VALUES (?,?)',
+                                 old_kanji_rows)
+                conn.executemany('INSERT INTO variants VALUES (?,?,?)',
+                                 variant_rows)
+                conn.executemany(
+                    'INSERT INTO readings VALUES (?,?,?,?,?,?,?,?)',
+                    reading_rows)
+                conn.executemany(
+                    'INSERT INTO alternate_orthographies VALUES (?,?)',
+                    altort_rows)
+                conn.executemany('INSERT INTO examples VALUES (?,?,?,?,?)',
+                                 example_rows)
+                conn.executemany('INSERT INTO notes VALUES (?,?,?,?)',
+                                 note_rows)
+                conn.executemany('INSERT INTO compounds VALUES (?,?)',
+                                 compound_rows)
+                conn.executemany('INSERT INTO kanji_compounds VALUES (?,?,?)',
+                                 kanji_compound_rows)
+                conn.executemany('INSERT INTO placenames VALUES (?,?,?)',
+                                 placename_rows)
+                if search_rows is not None:
+                    conn.executemany('INSERT INTO search VALUES (?,?,?)',
+                                     search_rows)
+                conn.execute('ANALYZE')
+            conn.execute('VACUUM')
+        finally:
+            conn.close()
+
+def open_sql(filename=None):
+    """Open the database made by convert_to_sql(), read-only.
+
+    The file is opened as immutable, so any number of processes can share it
+    without locking.  Rows can be accessed by column name.
+    """
+
+    import sqlite3
+    from urllib.request import pathname2url
+
+    filename = filename or outputdir + '/joyodb.sqlite3'
+    # Quoted, as the path may contain '?', '#', '%'...
+    db = sqlite3.connect('file:%s?mode=ro&immutable=1' %
+                         pathname2url(os.path.abspath(filename)), uri=True)
+    db.row_factory = sqlite3.Row
+    return(db)
+
+def search_sql(db, string):
+    """Full-text search for string in the examples and notes of the database.
+
+    Returns a list of (kind, id) pairs, where kind is 'example' or 'note' and
+    id refers to the corresponding table.
+    """
+
+    # A phrase of single characters, as indexed (cf. SQL_FTS_SCHEMA); quotes
+    # are escaped after the split, as '""' must stay together.
+    phrase = '"%s"' % ' '.join(string).replace('"', '""')
+    return([(row[0], row[1]) for row in
+            db.execute('SELECT kind, ref FROM search WHERE text MATCH ?',
+                       (phrase,))])
+
+@register_exporter('html')
+def convert_to_html(db=None):
     pass
 
 # With this, one can test with: env PYTHONPATH=. python3 convert.py
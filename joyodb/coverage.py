@@ -0,0 +1,184 @@
+# Check how much of a text is written with Joyo kanji.
+#
+# Every character is classified with a lookup table indexed by codepoint,
+# built once from the Joyo data.  Texts are counted per distinct character
+# (collections.Counter does that in C), so the Python-level work per document
+# is proportional to its vocabulary, not to its length.
+
+from collections import Counter
+import multiprocessing
+
+# Character categories, as stored in the lookup table.
+OTHER = 0    # not a kanji (kana, punctuation, Latin...)
+JOYO = 1     # a Joyo kanji, in the form of the Joyo table
+OLD = 2      # an old form (旧字体) of a Joyo kanji
+POPULAR = 3  # a popular-use alternative (通用字体) of a Joyo kanji
+NON_JOYO = 4 # any other kanji
+
+CATEGORY_NAMES = ('other', 'joyo', 'old', 'popular', 'non_joyo')
+
+# Blocks of CJK ideographs, as (first, last) codepoints; anything in them is
+# taken to be a kanji.
+HAN_RANGES = [
+    (0x3400, 0x4DBF),   # Extension A
+    (0x4E00, 0x9FFF),   # CJK Unified Ideographs
+    (0xF900, 0xFAFF),   # Compatibility Ideographs
+    (0x20000, 0x2FA1F), # Extensions B–F, Compatibility Supplement
+    (0x30000, 0x323AF), # Extensions G–H
+]
+
+def build_codepoint_table(kanjis):
+    """Build a category lookup table from a list of Kanji objects.
+
+    The table is a bytearray covering all of Unicode; table[ord(ch)] is the
+    category of character ch.
+
+    >>> from joyodb.model import Kanji
+    >>> k1 = Kanji('亜')
+    >>> k1.add_old_kanji('亞')
+    >>> table = build_codepoint_table([k1, Kanji('𠮟')])
+    >>> [CATEGORY_NAMES[table[ord(ch)]] for ch in '亜亞𠮟叱鬱あ']
+    ['joyo', 'old', 'joyo', 'popular', 'non_joyo', 'other']
+    """
+
+    table = bytearray(0x110000)
+    for first, last in HAN_RANGES:
+        table[first:last + 1] = bytes([NON_JOYO]) * (last - first + 1)
+
+    for k in kanjis:
+        if type(k.old_kanji) is list:
+            old_kanjis = k.old_kanji
+        else:
+            old_kanjis = [k.old_kanji] if k.old_kanji else []
+        for old in old_kanjis:
+            table[ord(old)] = OLD
+
+    for k in kanjis:
+        if k.standard_character:
+            table[ord(k.kanji)] = POPULAR
+            table[ord(k.standard_character)] = JOYO
+        else:
+            table[ord(k.kanji)] = JOYO
+
+    return(table)
+
+class Coverage:
+    """Character counts for a text, by category.
+
+    - counts: A dictionary from category name to number of characters.
+    - characters: For the 'old', 'popular' and 'non_joyo' categories, a
+      Counter of the characters found (the "offending" characters).
+    """
+
+    def __init__(self):
+        self.counts = dict.fromkeys(CATEGORY_NAMES, 0)
+        self.characters = {name: Counter()
+                           for name in CATEGORY_NAMES[OLD:]}
+
+    def update(self, other):
+        "Add the counts from another Coverage object."
+        for name, count in other.counts.items():
+            self.counts[name] += count
+        for name, characters in other.characters.items():
+            self.characters[name].update(characters)
+
+    def kanji_count(self):
+        "Total number of kanji, of any category."
+        return(sum(self.counts[name] for name in CATEGORY_NAMES[JOYO:]))
+
+    def joyo_ratio(self):
+        "Proportion of Joyo kanji among all kanji (1.0 if there's no kanji)."
+        total = self.kanji_count()
+        if total:
+            return(self.counts['joyo'] / total)
+        else:
+            return(1.0)
+
+    def __str__(self):
+        return(', '.join('%s: %d' % item for item in self.counts.items()))
+
+class CoverageScanner:
+    """Classifies the characters in texts, according to the Joyo table.
+
+    >>> from joyodb.model import Kanji
+    >>> k = Kanji('亜')
+    >>> k.add_old_kanji('亞')
+    >>> scanner = CoverageScanner([k, Kanji('𠮟'), Kanji('鉛')])
+    >>> c = scanner.scan_text('亜鉛を亞鉛と書くな。𠮟る叱る')
+    >>> print(c)
+    other: 7, joyo: 4, old: 1, popular: 1, non_joyo: 1
+    >>> c.characters['non_joyo']
+    Counter({'書': 1})
+    >>> c.joyo_ratio()
+    0.5714285714285714
+    """
+
+    def __init__(self, kanjis=None, table=None):
+        if table is None:
+            table = build_codepoint_table(kanjis)
+        self.table = table
+
+    def count(self, characters, coverage):
+        "Add a Counter of characters to a Coverage object."
+        table = self.table
+        counts = coverage.counts
+        for ch, n in characters.items():
+            category = table[ord(ch)]
+            name = CATEGORY_NAMES[category]
+            counts[name] += n
+            if category >= OLD:
+                coverage.characters[name][ch] += n
+
+    def scan_text(self, text):
+        "Return a Coverage object for a string."
+        coverage = Coverage()
+        self.count(Counter(text), coverage)
+        return(coverage)
+
+    def scan_file(self, filename, chunk_size=1 << 22, encoding='utf-8'):
+        """Return a Coverage object for a text file.
+
+        The file is read in chunks of chunk_size characters, so it needn't fit
+        in memory.
+        """
+
+        characters = Counter()
+        with open(filename, 'rt', encoding=encoding) as f:
+            for chunk in iter(lambda: f.read(chunk_size), ''):
+                characters.update(chunk)
+        coverage = Coverage()
+        self.count(characters, coverage)
+        return(coverage)
+
+    def scan_files(self, filenames, processes=None, chunk_size=1 << 22):
+        """Yield (filename, Coverage) for each file, scanning them in parallel.
+
+        Files are distributed to a pool of processes (by default, one per
+        CPU).  Results are yielded in the same order as filenames.
+        """
+
+        with multiprocessing.Pool(processes,
+                                  initializer=init_coverage_process,
+                                  initargs=(bytes(self.table), chunk_size)) as pool:
+            for result in pool.imap(scan_file_in_process, filenames):
+                yield(result)
+
+# The scanner and chunk size of CoverageScanner.scan_files() worker processes.
+coverage_process_scanner = None
+coverage_process_chunk_size = None
+
+def init_coverage_process(table, chunk_size):
+    global coverage_process_scanner, coverage_process_chunk_size
+    coverage_process_scanner = CoverageScanner(table=table)
+    coverage_process_chunk_size = chunk_size
+
+def scan_file_in_process(filename):
+    "Scan a file, in a worker process; returns (filename, Coverage)."
+    return((filename,
+            coverage_process_scanner.scan_file(
+                filename, chunk_size=coverage_process_chunk_size)))
+
+# With this, one can test with: python3 coverage.py -v
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,111 @@
+# Prebuilt indexes over the Joyo data, for fast lookups.
+
+from collections import defaultdict, namedtuple
+
+import joyodb.kana
+
+# What a reading lookup returns: the Kanji and Reading objects, plus the flags
+# most callers want to check without digging into the Reading.
+ReadingEntry = namedtuple('ReadingEntry',
+                          ['kanji', 'reading', 'uncommon', 'variation_of'])
+
+def normalize_reading(string):
+    """Normalize a reading to the form used for index keys.
+
+    Kana are converted to hiragana, and rōmaji to lowercase:
+
+    >>> normalize_reading('ショク')
+    'しょく'
+    >>> normalize_reading('た.べる')
+    'た.べる'
+    >>> normalize_reading('SHOKU')
+    'shoku'
+
+    Indentation (as in uncommon readings) and surrounding whitespace are
+    ignored:
+
+    >>> normalize_reading('\\u3000ジョウ ')
+    'じょう'
+    """
+
+    string = string.strip()
+    if string.isascii():
+        return(string.lower())
+    else:
+        return(joyodb.kana.to_hiragana(string))
+
+def reading_keys(reading):
+    """All index keys for a Reading object.
+
+    These are the reading as hiragana and as rōmaji; for kun-readings, both
+    with and without the okurigana dot.
+
+    >>> from joyodb.model import Kanji, Reading
+    >>> k = Kanji('食')
+    >>> r = Reading(k, 'たべる')
+    >>> r.add_examples('食べる')
+    >>> sorted(reading_keys(r))
+    ['ta.beru', 'taberu', 'た.べる', 'たべる']
+    >>> sorted(reading_keys(Reading(k, 'ショク')))
+    ['shoku', 'しょく']
+    """
+
+    keys = set()
+    for key in (reading.to_hiragana(), reading.romaji().lower()):
+        keys.add(key)
+        keys.add(key.replace('.', ''))
+    return(keys)
+
+class ReadingIndex:
+    """Reverse index from readings to the kanji that can be read that way.
+
+    Build it once from a list of Kanji objects (e.g. loaded_data.kanjis), then
+    query it with kana (hiragana or katakana, with or without okurigana dot) or
+    rōmaji.  Queries return a list of ReadingEntry tuples.
+
+    >>> from joyodb.model import Kanji
+    >>> kanjis = [Kanji('食'), Kanji('色')]
+    >>> kanjis[0].add_reading('ショク')
+    >>> kanjis[0].add_reading('たべる')
+    >>> kanjis[0].add_examples('食べる')
+    >>> kanjis[1].add_reading('ショク')
+    >>> index = ReadingIndex(kanjis)
+    >>> [e.kanji.kanji for e in index.lookup('しょく')]
+    ['食', '色']
+    >>> [e.kanji.kanji for e in index.lookup('SHOKU')]
+    ['食', '色']
+    >>> e = index.lookup('たべる')[0]
+    >>> e.reading.reading, e.uncommon, e.variation_of
+    ('た.べる', False, None)
+    >>> index.lookup('ta.beru') == index.lookup('た.べる') == [e]
+    True
+    >>> index.lookup('のむ')
+    []
+    """
+
+    def __init__(self, kanjis):
+        self.entries = defaultdict(list)
+        for kanji in kanjis:
+            for reading in kanji.readings:
+                entry = ReadingEntry(kanji, reading,
+                                     reading.uncommon, reading.variation_of)
+                for key in reading_keys(reading):
+                    self.entries[key].append(entry)
+
+        # Lookups of missing keys shouldn't grow the index.
+        self.entries.default_factory = None
+
+    def lookup(self, query):
+        """Return ReadingEntry tuples for all readings matching query."""
+        return(list(self.entries.get(normalize_reading(query), ())))
+
+    def __contains__(self, query):
+        return(normalize_reading(query) in self.entries)
+
+    def __len__(self):
+        return(len(self.entries))
+
+# With this, one can test with: python3 index.py -v
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
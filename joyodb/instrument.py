@@ -0,0 +1,221 @@
+# Instrumentation of the conversion: where time, lines and memory go.
+#
+# convert() and parse() take an Instrumentation object, and run each of their
+# stages (opening the file, each table, each exporter...) within its stage()
+# context, which records wall time, lines read and peak traced memory.
+# Counters (rows per type, notes per rule...) are recorded at the end.
+# Hooks are called with each finished stage, so that a build pipeline can
+# export the metrics; they can also be saved as JSON, as a Chrome trace
+# (chrome://tracing, Perfetto, speedscope...), and with a cProfile file.
+
+from contextlib import contextmanager
+import json
+import os
+import time
+
+class StageMetrics:
+    """What was measured for a stage:
+
+        - name: The stage name, e.g. 'parse_main_table' or 'export.tsv'.
+        - start: When it started, in seconds since the instrumentation
+          started.
+        - seconds: Wall time.
+        - lines: Lines read from the Joyo .txt file, or None.
+        - peak_memory: Peak traced memory during the stage, in bytes, above
+          what was allocated when it started; None unless memory is traced
+          (cf. Instrumentation).
+        - pid: The process which ran the stage.
+    """
+
+    __slots__ = ('name', 'start', 'seconds', 'lines', 'peak_memory', 'pid')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = 0.0
+        self.seconds = 0.0
+        self.lines = None
+        self.peak_memory = None
+        self.pid = os.getpid()
+
+    def as_dict(self):
+        return({attr: getattr(self, attr) for attr in self.__slots__})
+
+    def __str__(self):
+        s = '%-24s %9.2f ms' % (self.name, self.seconds * 1000)
+        if self.lines is not None:
+            s += ' %7d lines' % self.lines
+        if self.peak_memory is not None:
+            s += ' %10.1f KiB peak' % (self.peak_memory / 1024)
+        return(s)
+
+class LineCounter:
+    """Wraps a text file, counting the lines read from it.
+
+    >>> import io
+    >>> f = LineCounter(io.StringIO('a\\nb\\nc\\n'))
+    >>> f.readline(), [line for line in f], f.lines
+    ('a\\n', ['b\\n', 'c\\n'], 3)
+    """
+
+    def __init__(self, f):
+        self.file = f
+        self.lines = 0
+
+    def __iter__(self):
+        for line in self.file:
+            self.lines += 1
+            yield(line)
+
+    def readline(self):
+        line = self.file.readline()
+        if line:
+            self.lines += 1
+        return(line)
+
+@contextmanager
+def measure(name, memory=False, lines=None, origin=None):
+    """Context to measure a stage; yields its StageMetrics, which are filled
+    in on exit.
+
+    - memory: Trace memory (with tracemalloc), to get the stage's peak.
+    - lines: A LineCounter to count the lines read during the stage.
+    - origin: The time.perf_counter() value that start times are relative
+      to (cf. Instrumentation.started).  It's a system-wide clock on the usual
+      platforms, so stages can be measured in worker processes too.
+    """
+
+    metrics = StageMetrics(name)
+    if memory:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        memory_before = tracemalloc.get_traced_memory()[0]
+    lines_before = lines.lines if lines else 0
+
+    begin = time.perf_counter()
+    if origin is not None:
+        metrics.start = begin - origin
+    try:
+        yield(metrics)
+    finally:
+        metrics.seconds = time.perf_counter() - begin
+        if lines:
+            metrics.lines = lines.lines - lines_before
+        if memory:
+            metrics.peak_memory = (tracemalloc.get_traced_memory()[1] -
+                                   memory_before)
+
+class Instrumentation:
+    """Collects StageMetrics and counters for a run of convert() or parse().
+
+    - memory: Trace memory, to record the peak of each stage.  This makes
+      everything quite slower.
+    - profile: A filename to save cProfile stats to (cf. pstats); the profiler
+      runs between start() and stop().
+
+    Functions added with add_hook() are called with each StageMetrics as soon
+    as its stage is over.
+
+    >>> inst = Instrumentation()
+    >>> inst.add_hook(lambda metrics: print('done:', metrics.name))
+    >>> with inst.stage('parse_main_table') as metrics:
+    ...     pass
+    done: parse_main_table
+    >>> inst.count('rows', {'C4': 3, 'C6': 1})
+    >>> inst.as_dict()['counters']
+    {'rows': {'C4': 3, 'C6': 1}}
+    >>> [event['name'] for event in inst.trace_events()]
+    ['parse_main_table']
+    """
+
+    def __init__(self, memory=False, profile=None):
+        self.memory = memory
+        self.profile = profile
+        self.stages = []
+        self.counters = {}
+        self.hooks = []
+        self.started = time.perf_counter()
+        self.profiler = None
+
+    def add_hook(self, hook):
+        "Call hook(metrics) with the StageMetrics of each finished stage."
+        self.hooks.append(hook)
+
+    def start(self):
+        "Start the profiler, if any."
+        self.started = time.perf_counter()
+        if self.profile:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stop(self):
+        "Stop the profiler, if any, and save its stats."
+        if self.profiler:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile)
+            self.profiler = None
+
+    def __enter__(self):
+        self.start()
+        return(self)
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @contextmanager
+    def stage(self, name, lines=None):
+        "Context to measure a stage (cf. measure()), then record it."
+        with measure(name, self.memory, lines, self.started) as metrics:
+            yield(metrics)
+        self.record(metrics)
+
+    def record(self, metrics):
+        "Add a StageMetrics (e.g. measured in another process), calling hooks."
+        self.stages.append(metrics)
+        for hook in self.hooks:
+            hook(metrics)
+
+    def count(self, name, counter):
+        "Record a group of counters (a mapping from name to number)."
+        self.counters[name] = dict(sorted(counter.items()))
+
+    def as_dict(self):
+        return({'stages': [metrics.as_dict() for metrics in self.stages],
+                'counters': self.counters})
+
+    def save_json(self, filename):
+        with open(filename, 'wt') as f:
+            json.dump(self.as_dict(), f, indent=2, ensure_ascii=False)
+            f.write('\n')
+
+    def trace_events(self):
+        """The stages as Chrome trace events (complete events, with times in
+        µs), which flame graph viewers can load."""
+
+        return([{'name': metrics.name, 'ph': 'X', 'cat': 'joyodb',
+                 'pid': metrics.pid, 'tid': 0,
+                 'ts': round(metrics.start * 1e6),
+                 'dur': round(metrics.seconds * 1e6),
+                 'args': {'lines': metrics.lines,
+                          'peak_memory': metrics.peak_memory}}
+                for metrics in self.stages])
+
+    def save_trace(self, filename):
+        with open(filename, 'wt') as f:
+            json.dump({'traceEvents': self.trace_events()}, f)
+            f.write('\n')
+
+    def __str__(self):
+        lines = [str(metrics) for metrics in self.stages]
+        for name, counter in self.counters.items():
+            lines.append('%s:' % name)
+            lines += ['    %-20s %8g' % (key, value)
+                      for key, value in counter.items()]
+        return('\n'.join(lines))
+
+# With this, one can test with: python3 instrument.py -v
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
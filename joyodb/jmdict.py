@@ -0,0 +1,142 @@
+# Index of JMdict, to check and enrich the Joyo examples.
+#
+# JMdict is a ~100 MB XML file; parsing it into a tree takes hundreds of MB
+# and tens of seconds.  Here it's streamed instead (lxml's iterparse(), with
+# each entry cleared as soon as it's read), keeping only what we use: the
+# readings and parts of speech for each kanji expression (keb).  The result
+# is saved as a compact snapshot in cachedir (cf. joyodb.cache.cached_build()),
+# which is reused until the JMdict file changes.
+
+import collections.abc
+from collections import namedtuple
+import functools
+import sys
+import types
+
+from joyodb import cachedir
+from joyodb.cache import cached_build, files_stamp
+
+# Downloaded by the Makefile.
+JMDICT_FILE = cachedir + '/JMdict'
+
+# What we keep of a JMdict entry.  Parts of speech are entity names, as in
+# the XML (e.g. '&v5r;').
+JMdictEntry = namedtuple('JMdictEntry', ['readings', 'parts_of_speech'])
+
+class JMdictIndex(collections.abc.Mapping):
+    """Read-only mapping from kanji expressions (keb) to a tuple of the
+    JMdictEntry objects listing them.
+
+    Build it from (kanji_expressions, readings, parts_of_speech) triples, as
+    yielded by iter_jmdict_entries().
+
+    >>> index = JMdictIndex([(['明日'], ['あした', 'あす'], ['&n;']),
+    ...                      (['明日'], ['みょうにち'], ['&n;']),
+    ...                      (['成る', '為る'], ['なる'], ['&v5r;'])])
+    >>> len(index), '為る' in index
+    (3, True)
+    >>> index['成る']
+    (JMdictEntry(readings=('なる',), parts_of_speech=('&v5r;',)),)
+    >>> index.lookup('明日', reading='あす')
+    (JMdictEntry(readings=('あした', 'あす'), parts_of_speech=('&n;',)),)
+    >>> index.lookup('明後日')
+    ()
+    """
+
+    __slots__ = ('entries',)
+
+    def __init__(self, entries):
+        index = {}
+        for kanji_expressions, readings, parts_of_speech in entries:
+            # Strings repeat a lot (parts of speech, above all); interned,
+            # they're stored once, in memory and in the snapshot.
+            entry = JMdictEntry(
+                tuple(sys.intern(r) for r in readings),
+                tuple(sys.intern(p) for p in parts_of_speech))
+            for keb in kanji_expressions:
+                keb = sys.intern(keb)
+                index[keb] = index.get(keb, ()) + (entry,)
+        self.entries = types.MappingProxyType(index)
+
+    def __getitem__(self, keb):
+        return(self.entries[keb])
+
+    def __iter__(self):
+        return(iter(self.entries))
+
+    def __len__(self):
+        return(len(self.entries))
+
+    # Mapping proxies can't be pickled; rebuild from the plain dict, without
+    # going through __init__() again.
+    def __reduce__(self):
+        return(rebuild_jmdict_index, (dict(self.entries),))
+
+    def lookup(self, keb, reading=None):
+        """Entries for kanji expression keb (none if it isn't in JMdict).
+
+        If reading is given, only the entries with that reading are returned.
+        """
+
+        entries = self.entries.get(keb, ())
+        if reading is not None:
+            entries = tuple(e for e in entries if reading in e.readings)
+        return(entries)
+
+def rebuild_jmdict_index(entries):
+    "Unpickle a JMdictIndex (cf. JMdictIndex.__reduce__())."
+    index = JMdictIndex(())
+    index.entries = types.MappingProxyType(entries)
+    return(index)
+
+def iter_jmdict_entries(filename=JMDICT_FILE):
+    """Stream the entries with kanji expressions from a JMdict XML file.
+
+    Yields (kanji_expressions, readings, parts_of_speech) triples of lists.
+    Entities are not resolved, so parts of speech are entity names like
+    '&n;'.  Requires lxml.
+    """
+
+    from lxml import etree
+
+    for event, entry in etree.iterparse(filename, events=('end',),
+                                        tag='entry', resolve_entities=False):
+        kanji_expressions = [keb.text for keb in entry.iter('keb')]
+        if kanji_expressions:
+            readings = [reb.text for reb in entry.iter('reb')]
+            parts_of_speech = [str(entity)
+                               for pos in entry.iter('pos')
+                               for entity in pos.iter(tag=etree.Entity)]
+            yield((kanji_expressions, readings, parts_of_speech))
+
+        # Free the entry, and the (now empty) entries before it, which the
+        # root element still holds.
+        entry.clear()
+        while entry.getprevious() is not None:
+            del entry.getparent()[0]
+
+JMDICT_INDEX_SNAPSHOT = cachedir + '/jmdict_index.pickle'
+
+def load_jmdict_index(filename=JMDICT_FILE):
+    """Return a JMdictIndex for a JMdict file (by default, JMDICT_FILE).
+
+    The index is cached in cachedir (cf. joyodb.cache.cached_build()), and
+    rebuilt only when the JMdict file (or this module) changes.  Within a
+    process, it's kept in memory while the file keeps its modification time
+    and size; if the file changes, the next call loads the new index.
+    """
+
+    return(cached_jmdict_index(filename, files_stamp(filename, __file__)))
+
+@functools.lru_cache(maxsize=1)
+def cached_jmdict_index(filename, stamp):
+    """load_jmdict_index(), memoized; stamp is only part of the key, so that
+    a changed file isn't served from memory."""
+
+    return(cached_build(lambda: JMdictIndex(iter_jmdict_entries(filename)),
+                        JMDICT_INDEX_SNAPSHOT, filename, __file__))
+
+# With this, one can test with: python3 jmdict.py -v
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,106 @@
+# Kana conversions: katakana ↔ hiragana, and kana → Hepburn rōmaji.
+#
+# These give the same results as the romkan functions used before, but
+# katakana ↔ hiragana is a plain str.translate() (the two scripts are laid out
+# in parallel in Unicode), instead of a round trip through rōmaji; and rōmaji
+# is a single longest-match substitution over a precompiled table.
+
+import functools
+
+import regex as re
+
+KATAKANA = ''.join(chr(c) for c in range(0x30A1, 0x30F7)) # ァ–ヶ
+HIRAGANA = ''.join(chr(c) for c in range(0x3041, 0x3097)) # ぁ–ゖ
+
+TO_HIRAGANA = str.maketrans(KATAKANA, HIRAGANA)
+TO_KATAKANA = str.maketrans(HIRAGANA, KATAKANA)
+
+# ン is transcribed as n', but the apostrophe is only kept where needed to
+# disambiguate (before a vowel, y or n).
+APOSTROPHE_REGEXP = re.compile("n'(?=[^aeiuoyn]|$)")
+
+@functools.lru_cache(maxsize=None)
+def hepburn_table():
+    """Return (table, regexp) for to_hepburn().
+
+    The table maps kana sequences to Hepburn rōmaji.  It's romkan's table, for
+    both scripts (keys never mix scripts, so one table can hold both); it's
+    only built on first use, since importing romkan takes a while.  The regexp
+    matches the longest sequence at each position, so that e.g. キャ wins over
+    キ.
+    """
+
+    from romkan.common import KANROM, KANROM_H
+
+    table = dict(KANROM)
+    table.update(KANROM_H)
+    regexp = re.compile('|'.join(sorted(table, key=len, reverse=True)))
+    return((table, regexp))
+
+def to_hiragana(string):
+    """Convert katakana to hiragana; anything else is kept as is.
+
+    >>> to_hiragana('ジョウ')
+    'じょう'
+    >>> to_hiragana('た.べる')
+    'た.べる'
+    """
+
+    return(string.translate(TO_HIRAGANA))
+
+def to_katakana(string):
+    """Convert hiragana to katakana; anything else is kept as is.
+
+    >>> to_katakana('じょう')
+    'ジョウ'
+    """
+
+    return(string.translate(TO_KATAKANA))
+
+@functools.lru_cache(maxsize=None)
+def to_hepburn(string):
+    """Transcribe kana (either script) as lowercase Hepburn rōmaji.
+
+    >>> to_hepburn('ジョウ')
+    'jou'
+    >>> to_hepburn('た.べる')
+    'ta.beru'
+    >>> to_hepburn('ゲンイン'), to_hepburn('シンブン')
+    ("gen'in", 'shinbun')
+
+    A lone small tsu, as in reading variations like み→みっ, is written out:
+
+    >>> to_hepburn('みっ')
+    'mixtsu'
+    """
+
+    table, regexp = hepburn_table()
+    string = regexp.sub(lambda m: table[m[0]], string)
+    return(APOSTROPHE_REGEXP.sub('n', string))
+
+def to_hiragana_many(strings):
+    """Convert a whole column of strings with to_hiragana().
+
+    >>> to_hiragana_many(['ア', 'イ', 'あ'])
+    ['あ', 'い', 'あ']
+    """
+
+    table = TO_HIRAGANA
+    return([s.translate(table) for s in strings])
+
+def to_hepburn_many(strings):
+    """Convert a whole column of strings with to_hepburn().
+
+    Each distinct string is only transcribed once.
+
+    >>> to_hepburn_many(['ショウ', 'ショウ', 'よ.む'])
+    ['shou', 'shou', 'yo.mu']
+    """
+
+    cache = {s: to_hepburn(s) for s in set(strings)}
+    return([cache[s] for s in strings])
+
+# With this, one can test with: python3 kana.py -v
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
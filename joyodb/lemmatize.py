@@ -0,0 +1,206 @@
+# Lemmatization of Joyo examples with MeCab (and UniDic), to look up
+# inflected examples (e.g. 成った) in dictionaries.
+#
+# MeCab is slow to call once per word, so examples are sent in batches, as a
+# single text with a sentinel between examples.  Results are kept in an SQLite
+# database in cachedir, keyed by the example, the kanji looked for, and the
+# versions of MeCab and its dictionary; so warm runs hardly call MeCab at all.
+
+import functools
+import os
+
+from joyodb import cachedir
+import joyodb.kana
+
+LEMMA_CACHE = cachedir + '/lemmas.sqlite3'
+
+# Put between examples in a batch.  It's a token of its own for MeCab, and
+# never part of an example.
+SENTINEL = '。'
+
+# Fields of UniDic features (comma-separated, in the node.feature string).
+READING_FIELD = 6
+LEMMA_FIELD = 10
+
+@functools.lru_cache(maxsize=None)
+def mecab_tagger():
+    "The MeCab tagger, with UniDic; created once per process."
+    import MeCab
+    return(MeCab.Tagger('-Ounidic'))
+
+@functools.lru_cache(maxsize=None)
+def mecab_version():
+    "A string identifying the versions of MeCab and of its dictionary."
+    import MeCab
+    dictionary = mecab_tagger().dictionary_info()
+    return('%s %s %s' % (MeCab.VERSION, os.path.basename(dictionary.filename),
+                         dictionary.version))
+
+def mecab_nodes(text):
+    "Parse text with MeCab; return a list of (surface, feature) pairs."
+    nodes = []
+    node = mecab_tagger().parseToNode(text)
+    while node:
+        if node.surface:
+            nodes.append((node.surface, node.feature))
+        node = node.next
+    return(nodes)
+
+def split_segments(nodes, count):
+    """Split the nodes of a batch at the sentinels; returns a list with a list
+    of nodes per example, or None if there aren't count examples (which means
+    the sentinel got merged into some other token).
+
+    >>> nodes = [('成っ', 'a'), ('た', 'b'), ('。', 'c'), ('明日', 'd')]
+    >>> split_segments(nodes, 2)
+    [[('成っ', 'a'), ('た', 'b')], [('明日', 'd')]]
+    >>> split_segments(nodes, 3) is None
+    True
+    """
+
+    segments = [[]]
+    for surface, feature in nodes:
+        if surface == SENTINEL:
+            segments.append([])
+        else:
+            segments[-1].append((surface, feature))
+    if len(segments) != count:
+        return(None)
+    return(segments)
+
+def find_lemma(nodes, kanji):
+    """Find the first word containing kanji; return (lemma, reading), the
+    reading in hiragana, or None if there's none.
+
+    >>> features = '動詞,一般,*,*,*,*,ナル,成る,成っ,ナッ,成る,ナル,和,*,*,*,*'
+    >>> find_lemma([('成っ', features), ('た', '助動詞')], '成')
+    ('成る', 'なる')
+    >>> find_lemma([('た', '助動詞')], '成') is None
+    True
+    """
+
+    for surface, feature in nodes:
+        fields = feature.split(',')
+        if len(fields) > LEMMA_FIELD and kanji in fields[LEMMA_FIELD]:
+            return((fields[LEMMA_FIELD],
+                    joyodb.kana.to_hiragana(fields[READING_FIELD])))
+    return(None)
+
+def lemmatize_batch(pairs):
+    """Lemmatize a list of (example, kanji) pairs with a single MeCab call;
+    returns a list of find_lemma() results.
+
+    If the batch can't be split back into examples, they're parsed one by one.
+    Can be called in worker processes; each one creates its own tagger.
+    """
+
+    text = SENTINEL.join(example for example, kanji in pairs)
+    segments = split_segments(mecab_nodes(text), len(pairs))
+    if segments is None:
+        segments = [mecab_nodes(example) for example, kanji in pairs]
+    return([find_lemma(nodes, kanji)
+            for nodes, (example, kanji) in zip(segments, pairs)])
+
+def open_lemma_cache(filename=LEMMA_CACHE):
+    """Open (creating it if needed) an SQLite lemma cache.
+
+    >>> import tempfile
+    >>> d = tempfile.mkdtemp()
+    >>> conn = open_lemma_cache(d + '/lemmas.sqlite3')
+    >>> save_lemmas(conn, 'v1', {('成った', '成'): ('成る', 'なる'),
+    ...                          ('ナった', '成'): None})
+    >>> sorted(cached_lemmas(conn, 'v1', [('成った', '成'), ('ナった', '成'),
+    ...                                   ('明日', '明')]).items())
+    [(('ナった', '成'), None), (('成った', '成'), ('成る', 'なる'))]
+    >>> cached_lemmas(conn, 'v2', [('成った', '成')])
+    {}
+    >>> conn.close()
+    """
+
+    import sqlite3
+
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    conn = sqlite3.connect(filename)
+    conn.execute('''CREATE TABLE IF NOT EXISTS lemmas (
+                        example TEXT NOT NULL,
+                        kanji TEXT NOT NULL,
+                        version TEXT NOT NULL,
+                        lemma TEXT,
+                        reading TEXT,
+                        PRIMARY KEY (example, kanji, version)
+                    ) WITHOUT ROWID''')
+    return(conn)
+
+def cached_lemmas(conn, version, pairs):
+    """Look up (example, kanji) pairs in a lemma cache; returns a dictionary
+    from the pairs found to their find_lemma() result.
+
+    The pairs are put in a temporary table and joined with the cache, so it
+    takes a single query, however many pairs there are.
+    """
+
+    with conn:
+        conn.execute('CREATE TEMP TABLE wanted (example TEXT, kanji TEXT)')
+        conn.executemany('INSERT INTO wanted VALUES (?, ?)', pairs)
+    try:
+        rows = conn.execute('SELECT example, kanji, lemma, reading '
+                            'FROM wanted JOIN lemmas USING (example, kanji) '
+                            'WHERE version = ?', (version,)).fetchall()
+    finally:
+        conn.execute('DROP TABLE temp.wanted')
+
+    found = {}
+    for example, kanji, lemma, reading in rows:
+        found[(example, kanji)] = None if lemma is None else (lemma, reading)
+    return(found)
+
+def save_lemmas(conn, version, lemmas):
+    """Save a dictionary from (example, kanji) pairs to find_lemma() results
+    into a lemma cache, in a single transaction."""
+
+    with conn:
+        conn.executemany('INSERT OR REPLACE INTO lemmas VALUES (?, ?, ?, ?, ?)',
+                         [(example, kanji, version) + (lemma or (None, None))
+                          for (example, kanji), lemma in lemmas.items()])
+
+def lemmatize(pairs, jobs=1, batch_size=1000, cache=LEMMA_CACHE):
+    """Lemmatize (example, kanji) pairs; returns a dictionary from each pair
+    to (lemma, reading), or None if MeCab found no word with the kanji.
+
+    Pairs found in the cache (a filename; None to disable it) aren't parsed
+    again.  The others are parsed in batches of batch_size; with jobs > 1,
+    batches are parsed in a pool of that many processes.
+    """
+
+    pairs = list(dict.fromkeys(pairs))
+    version = mecab_version()
+    conn = open_lemma_cache(cache) if cache else None
+    try:
+        lemmas = cached_lemmas(conn, version, pairs) if conn else {}
+        missing = [pair for pair in pairs if pair not in lemmas]
+        batches = [missing[i:i + batch_size]
+                   for i in range(0, len(missing), batch_size)]
+
+        if jobs > 1 and len(batches) > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=min(jobs, len(batches))) as pool:
+                results = list(pool.map(lemmatize_batch, batches))
+        else:
+            results = [lemmatize_batch(batch) for batch in batches]
+
+        new_lemmas = {pair: lemma
+                      for batch, batch_lemmas in zip(batches, results)
+                      for pair, lemma in zip(batch, batch_lemmas)}
+        if conn and new_lemmas:
+            save_lemmas(conn, version, new_lemmas)
+    finally:
+        if conn:
+            conn.close()
+
+    lemmas.update(new_lemmas)
+    return(lemmas)
+
+# With this, one can test with: python3 lemmatize.py -v
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
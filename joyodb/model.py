@@ -1,12 +1,96 @@
 # database/ORM models
 
-from collections import defaultdict
+import collections.abc
+from collections import Counter, defaultdict
+import enum
+import functools
 import logging
+import sys
+import time
+import types
 logging.basicConfig(format='%(levelname)s: %(message)s')
 
-import romkan
 import regex as re
 from joyodb import *
+import joyodb.kana
+
+class NotesStats:
+    """Hits and timings of the rules for the "notes" (参考) column (cf.
+    NoteRules).
+
+    - hits: Counter of note lines handled by each rule.
+    - tested: Counter of the times each rule was tried.
+    - seconds: Total time spent classifying and handling the lines of each
+      rule; only measured if timed is true (cf. joyodb.convert.parse()).
+    """
+
+    def __init__(self, timed=False):
+        self.timed = timed
+        self.hits = Counter()
+        self.tested = Counter()
+        self.seconds = defaultdict(float)
+
+    def count(self, rule, seconds=None):
+        self.hits[rule] += 1
+        if seconds is not None:
+            self.seconds[rule] += seconds
+
+    def __str__(self):
+        if not self.timed:
+            return("\n".join('%-24s %5d hits %5d tests' %
+                             (rule, self.hits[rule], self.tested[rule])
+                             for rule in sorted(self.tested)))
+        return("\n".join('%-24s %5d hits %5d tests %8.2f ms' %
+                         (rule, self.hits[rule], self.tested[rule],
+                          self.seconds.get(rule, 0.0) * 1000)
+                         for rule in sorted(self.tested)))
+
+class Kind(str, enum.Enum):
+    """Kind of a reading.
+
+    Members are strings, so they compare (and hash, and print) just like the
+    plain strings used before:
+
+    >>> Kind('On') == 'On', str(Kind.KUN), Kind.ON
+    (True, 'Kun', 'On')
+    """
+
+    ON = 'On'
+    KUN = 'Kun'
+
+    __str__ = str.__str__
+    __format__ = str.__format__
+
+    def __repr__(self):
+        return(repr(self.value))
+
+class PartOfSpeech(str, enum.Enum):
+    """Part-of-speech marker of an example (cf. Example.pos).
+
+    >>> PartOfSpeech('Adverb') == 'Adverb', PartOfSpeech.SUFFIX
+    (True, 'Suffix')
+    """
+
+    ADVERB = 'Adverb'
+    CONJUNCTION = 'Conjunction'
+    SUFFIX = 'Suffix'
+
+    __str__ = str.__str__
+    __format__ = str.__format__
+
+    def __repr__(self):
+        return(repr(self.value))
+
+@functools.lru_cache(maxsize=None)
+def variant_image(kanji, form):
+    """Contents of the reference image of a glyph variant, as bytes.
+
+    form is 'standard' or 'accepted'.  Files are only read once per process.
+    """
+
+    filename = '%s/variants_img/%x-%s.png' % (datadir, ord(kanji), form)
+    with open(filename, 'rb') as f:
+        return(f.read())
 
 class Kanji:
     """A kanji with its associated Jōyō information:
@@ -54,20 +138,31 @@ class Kanji:
           Unicode variation sequence to select the graphical variant listed as
           default (cf. self.accepted_variant).
 
-        - acceped_variant_image: If the character has variant glyphs, this is a
-          file object pointing to a reference png image of the "acceptable"
-          variant (see self.accepted_variant).
+        - accepted_variant_image: If the character has variant glyphs, this is
+          a reference png image of the "acceptable" variant (see
+          self.accepted_variant), as bytes.  Images are read on first access,
+          and shared by all Kanji objects.
 
-        - standard_variant_image: If the character has variant glyphs, this is a
-          file object pointing to a reference png image of the default variant
-          (see self.standard_variant).
+        - standard_variant_image: If the character has variant glyphs, this is
+          a reference png image of the default variant (see
+          self.standard_variant), as bytes.
 
         - joyo_documentation: This character has minor graphical variations,
           documented in the given section of the Joyo text.
 
     """
 
+    # There are thousands of these objects, and no other attributes; slots
+    # save a dict per object.
+    __slots__ = ('kanji', 'standard_character',
+                 'standard_variant', 'accepted_variant',
+                 'old_kanji', 'readings', 'placename_readings',
+                 'compound_readings', 'notes', 'joyo_documentation',
+                 'pending_note')
+
     def __init__(self, kanji):
+        popular_alternatives = load_popular_alternatives()
+        variants = load_variants()
         if kanji in popular_alternatives.keys():
             self.kanji = popular_alternatives[kanji]
             self.standard_character = kanji
@@ -77,17 +172,9 @@ class Kanji:
 
         if kanji in variants.keys():
             self.standard_variant, self.accepted_variant = variants[kanji]
-
-            codepoint = '%x' % ord(kanji)
-            file_prefix = datadir + '/variants_img/' + codepoint.lower()
-            self.standard_variant_image = open(file_prefix + '-standard.png', 'rb')
-            self.accepted_variant_image = open(file_prefix + '-accepted.png', 'rb')
-
         else:
             self.standard_variant = None
             self.accepted_variant = None
-            self.standard_variant_image = None
-            self.accepted_variant_image = None
 
         self.old_kanji = None
         self.readings = list()
@@ -99,6 +186,27 @@ class Kanji:
         # if true, next note line should be appended to current note
         self.pending_note = False
 
+    @property
+    def standard_variant_image(self):
+        if self.standard_variant:
+            return(variant_image(self.standard_character or self.kanji,
+                                 'standard'))
+
+    @property
+    def accepted_variant_image(self):
+        """Reference images of the glyph variants, as png bytes (or None).
+
+        >>> k = Kanji('餌')
+        >>> k.accepted_variant_image[1:4]
+        b'PNG'
+        >>> Kanji('亜').accepted_variant_image is None
+        True
+        """
+
+        if self.accepted_variant:
+            return(variant_image(self.standard_character or self.kanji,
+                                 'accepted'))
+
     # prettier representations; useful when debugging
     def __str__(self):
         s = self.kanji
@@ -137,7 +245,7 @@ class Kanji:
         else:
             self.old_kanji = string
 
-    def append_to_notes(self, string):
+    def append_to_notes(self, string, stats=None):
         """Intelligently add a line from the "notes" (参考) column.
 
         If the note is kanji-scoped, add it to self; otherwise call call
@@ -158,56 +266,14 @@ class Kanji:
 
         - 漢（か）: compound reading with gloss.
 
-
+        Cf. KANJI_NOTE_RULES; the rules used are counted in stats, if given
+        (a NotesStats).
         """
 
 
         string = string.strip()
-
-        m = re.match(r'［\p{Han}］＝許容字体，', string)
-        if m:
-            self.notes = string
-            self.pending_note = True
-
-            # ignore this data; it's already availabe in
-            # self.acceptable_variant.
-            return
-
-        m = re.match(r'＊［(（付）.*)参照］$', string)
-        if m:
-            if self.pending_note:
-                self.notes += m[1]
-                self.pending_note = False
-            else:
-                self.notes = m[1]
-            self.joyo_documentation = m[1]
-            return
-
-
-        # no $
-        m = re.match(r'(お?)([\p{Han}・\p{Hiragana}]+)（(\p{Hiragana}+)）(.*)', string)
-        if m:
-            self.notes = string
-            # cf. 茨城（いばらき）県
-            parts = string.split('，')
-            for part in parts:
-                # now with $
-                m = re.match(r'(お?)([\p{Han}・\p{Hiragana}]+)（(\p{Hiragana}+)）(.*)$', part)
-                prefix = m[1]
-                orthographies = (m[2]).split('・')
-                gloss = m[3]
-                suffix = (m[4])
-                if suffix and suffix in '都道府県':
-                    for ort in orthographies:
-                        self.add_placename_reading(ort, gloss, suffix)
-                else:
-                    for ort in orthographies:
-                        self.add_compound_reading(prefix + ort + suffix,
-                                                  prefix + gloss + suffix)
-                return
-
-
-        self.readings[-1].append_to_notes(string)
+        if not KANJI_NOTE_RULES.apply(self, string, stats):
+            self.readings[-1].append_to_notes(string, stats)
 
     def add_placename_reading(self, orthography, gloss, kind):
         self.placename_readings[orthography] = gloss
@@ -338,29 +404,72 @@ def delimit_okurigana(kanji, canonical_reading, example):
     if example == kanji:
         return(canonical_reading)
 
+    for pattern, delimited in okurigana_matcher(kanji, canonical_reading):
+        if type(pattern) is str:
+            if pattern in example:
+                return(delimited)
+        elif pattern.search(example):
+            return(delimited)
+
+    return(canonical_reading)
+
+@functools.lru_cache(maxsize=4096)
+def okurigana_matcher(kanji, canonical_reading):
+    """The patterns tried by delimit_okurigana(), precompiled.
+
+    Returns a tuple of (pattern, delimited reading) pairs, in the order they
+    must be tried; the first pattern found in an example gives its delimited
+    reading.  Patterns without inflection classes are plain strings, to be
+    tested with `in`; the others are compiled regexps.
+
+    Results are cached per (kanji, reading), since every example of a reading
+    is matched against the same patterns.  The cache is bounded, as callers
+    may pass any reading; 4096 entries hold all the readings of the table.
+
+    >>> for pattern, delimited in okurigana_matcher('生', 'おう'):
+    ...     print(getattr(pattern, 'pattern', pattern), delimited)
+    生おう .おう
+    生お[わえいおう] .おう
+    生う お.う
+    生[わえいおう] お.う
+    """
+
+    patterns = []
+    ichidan = is_ichidan_verb(kanji, canonical_reading)
     for suffix in all_suffixes(canonical_reading):
-        prefix = canonical_reading[0:-len(suffix)]
+        delimited = canonical_reading[0:-len(suffix)] + '.' + suffix
         ok_regex = kanji + suffix
-        match = re.search(ok_regex, example)
-        if match:
-            return(prefix + '.' + suffix)
+        candidates = [ok_regex]
 
-        if is_ichidan_verb(kanji, canonical_reading):
+        if ichidan:
             ok_regex = ok_regex[:-1] # lose the る
-            match = re.search(ok_regex, example)
-            if match:
-                return(prefix + '.' + suffix)
+            candidates.append(ok_regex)
 
         last = ok_regex[-1]
-        if last in GODAN_INFLECTION.keys():
-            ok_regex = re.sub('.$', GODAN_INFLECTION[last], ok_regex)
-            match = re.search(ok_regex, example)
-            if match:
-                return(prefix + '.' + suffix)
+        if last in GODAN_INFLECTION:
+            candidates.append(re.compile(ok_regex[:-1] + GODAN_INFLECTION[last]))
 
-        ok_regex += 'だ'
+        for pattern in candidates:
+            if (pattern, delimited) not in patterns:
+                patterns.append((pattern, delimited))
 
-    return(canonical_reading)
+    return(tuple(patterns))
+
+def delimit_many(triples):
+    """Delimit okurigana for many (kanji, reading, example) triples at once.
+
+    Useful to validate large lists of words (e.g. from a dictionary) against
+    the Jōyō readings.  Readings may be given with or without an okurigana
+    dot; returns a list of delimited readings, in the same order.
+
+    >>> delimit_many([('食', 'たべる', '食べ物'),
+    ...               ('生', 'お.う', '生い立ち'),
+    ...               ('昼', 'ひる', '真昼')])
+    ['た.べる', 'お.う', 'ひる']
+    """
+
+    return([delimit_okurigana(kanji, reading.replace('.', ''), example)
+            for kanji, reading, example in triples])
 
 class Reading:
     """A kanji reading.
@@ -371,8 +480,10 @@ class Reading:
                    will have okurigana delimited by a dot '.'.  Uncommon readings,
                    indented on table, will lose the indentation and be marked with
                    self.uncommon=True.
-        - kind: one of On, Kun, TODO: jukujikun/exceptional readings.  If not
-                passed, will autodetect as On for katakana and Kun otherwise.
+        - kind: one of On, Kun, or any other string (e.g. for
+                jukujikun/exceptional readings), which is kept as given.  If
+                not passed, will autodetect as On for katakana and Kun
+                otherwise.
 
         >>> k = Kanji('成')
         >>> r1 = Reading(k, reading='セイ')
@@ -394,6 +505,10 @@ class Reading:
         >>> r1.uncommon == r2.uncommon == False # no indent = not uncommon
         True
 
+        >>> r4 = Reading(k, reading='おとな', kind='Jukujikun')
+        >>> r4.kind, r4.romaji(), r4.to_hiragana()
+        ('Jukujikun', 'Otona', 'おとな')
+
         - examples: Example words from the Jōyō table; a list of strings.
         - uncommon: If true, this is a rarely-used reading, or a prefecture-name
                    reading.  This is equivalento to readings indented
@@ -408,29 +523,42 @@ class Reading:
           same sound, marked with a ⇔ on the document.
     """
 
+    __slots__ = ('kanji', 'reading', 'uncommon', 'examples', 'kind',
+                 'variation_of', 'notes', 'alternate_orthographies',
+                 '_conversions')
+
     def __init__(self, kanji, reading, variation_of=None, kind=None):
         self.kanji = kanji
+        # The same readings recur under many kanji; interning makes them
+        # share a single string object.
         if reading[0] == "\u3000":
-            self.reading = reading[1:]
+            self.reading = sys.intern(reading[1:])
             self.uncommon = True
         else:
-            self.reading = reading
+            self.reading = sys.intern(reading)
             self.uncommon = False
 
         self.examples = list()
 
         if kind:
-            self.kind = kind
+            try:
+                self.kind = Kind(kind)
+            except ValueError:
+                # Other kinds (e.g. jukujikun) are kept as given.
+                self.kind = kind
         else:
             if re.match("\p{Katakana}", self.reading):
-                self.kind = 'On'
+                self.kind = Kind.ON
             else:
-                self.kind = 'Kun'
+                self.kind = Kind.KUN
 
-        self.variation_of = variation_of
+        self.variation_of = variation_of and sys.intern(variation_of)
         self.notes = ''
         self.alternate_orthographies = []
 
+        # (reading, kind) → (romaji, hiragana); see self.conversions().
+        self._conversions = (None, None)
+
     def add_examples(self, examples_str):
         """Add an example to the list.
 
@@ -530,6 +658,10 @@ class Reading:
         examples = examples_str.split('，')
         examples = list(filter(None, examples))
 
+        # Only the examples added by this call need their okurigana checked;
+        # the older ones were already checked when they were added.
+        new_examples = []
+
         for example in examples:
 
             gloss_match = re.match('(.*)（(.*)）$', example)
@@ -562,12 +694,14 @@ class Reading:
                 # normal example, without glosses
 
                 # creating Example objects also clean up part-of-speech markers
-                self.examples.append(Example(example))
+                example_obj = Example(example)
+                self.examples.append(example_obj)
+                new_examples.append(example_obj)
 
         if self.kind == 'Kun':
             clean_reading = self.reading.replace('.', '')
 
-            for example_obj in self.examples:
+            for example_obj in new_examples:
                 example = example_obj.example
                 new_reading = delimit_okurigana(self.kanji.kanji, clean_reading, example)
 
@@ -616,13 +750,7 @@ class Reading:
         'iya'
         """
 
-        hepburn = romkan.to_hepburn(self.reading)
-        if self.kind == 'On':
-            return(hepburn.upper())
-        elif self.kind == 'Kun':
-            return(hepburn)
-        else:
-            return(hepburn.title())
+        return(self.conversions()[0])
 
     def to_hiragana(self):
         """Return the reading as hiragana, even if it's On.
@@ -644,12 +772,37 @@ class Reading:
 
         """
 
-        if self.kind == 'On':
-            return(romkan.to_hiragana(romkan.to_roma(self.reading)))
-        else:
-            return(self.reading)
+        return(self.conversions()[1])
 
-    def append_to_notes(self, string):
+    def conversions(self):
+        """Return (romaji, hiragana) for this reading, as romaji() and
+        to_hiragana() do.
+
+        These are cached, and recomputed only if self.reading or self.kind
+        change (as they do when okurigana are delimited):
+
+        >>> k = Kanji('成')
+        >>> r = Reading(k, 'なる')
+        >>> r.conversions()
+        ('naru', 'なる')
+        >>> r.add_examples('成る')
+        >>> r.conversions()
+        ('na.ru', 'な.る')
+        """
+
+        key, values = self._conversions
+        if key != (self.reading, self.kind):
+            hepburn = joyodb.kana.to_hepburn(self.reading)
+            if self.kind == 'On':
+                values = (hepburn.upper(), joyodb.kana.to_hiragana(self.reading))
+            elif self.kind == 'Kun':
+                values = (hepburn, self.reading)
+            else:
+                values = (hepburn.title(), self.reading)
+            self._conversions = ((self.reading, self.kind), values)
+        return(values)
+
+    def append_to_notes(self, string, stats=None):
         """Intelligently add data from the "notes" column.
 
         Notes field can have two kinds of scope: per-reading, or whole-kanji.
@@ -672,106 +825,12 @@ class Reading:
         - 多く文語の「亡き」で使う。
         only this line; literary usage.
 
+        Cf. READING_NOTE_RULES; the rules used are counted in stats, if given
+        (a NotesStats).
         """
 
-        # test hardcoded notes first
-        if string == '多く文語の「亡き」で使う。':
-            self.add_examples('亡き')
-            for e in self.examples:
-                if '亡き' in e.example:
-                    e.literary = True
-            self.notes = string
-            return
-
-        if string == '「三位一体」，「従三位」は，「サン':
-            self.notes = string
-            self.kanji.pending_note = True
-            return
-        elif string == 'ミイッタイ」，「ジュサンミ」。':
-            self.kanji.readings[-2].notes += string
-            self.kanji.pending_note = False
-
-            self.kanji.add_reading("ミ")
-            self.kanji.readings[-1].variation_of = 'イ'
-            self.kanji.readings[-1].add_examples('三位一体，従三位')
-            return
-
-        if string == '「春雨」，「小雨」，「霧雨」などは，':
-            self.notes = string
-            self.kanji.pending_note = True
-            return
-        elif string == '「はるさめ」，「こさめ」，「きりさめ」。':
-            self.notes += string
-            self.kanji.pending_note = False
-
-            self.kanji.add_reading("さめ")
-            self.kanji.readings[-1].variation_of = 'あめ'
-            self.kanji.readings[-1].add_examples('春雨，小雨，霧雨')
-            return
-
-        if string == '「憂き」は，文語の連体形。':
-            e = next(e for e in self.examples if '憂き' in e.example)
-            e.literary = True
-
-
-        m = re.match(r'⇔ *(.+)', string)
-        if m:
-            self.notes = string
-            assert(re.match('[\p{Han}\p{Hiragana}，]+', m[1]))
-            self.alternate_orthographies = m[1].split('，')
-            return
-
-
-
-        m = re.match(r'(「.*」，?)+(など)?は，', string)
-        if m:
-            self.notes = string
-            if not re.search('。$', string):
-                self.kanji.pending_note = True
-            return
-
-        m = re.match(r'(「(.*)」，?)+などと使う。$', string)
-        if m:
-            self.notes = string
-            return
-
-        if self.kanji.pending_note == True:
-            m = re.search('。$', string)
-            if m:
-
-                # previous half of note could have been in this reading...
-                if self.notes:
-                    self.notes += string
-                # or the previous one.
-                elif self.kanji.readings[-2].notes:
-                    self.kanji.readings[-2].notes += string
-                else:
-                    raise(ValueError("BUG: can't find where to attach half-note."))
-
-                self.kanji.pending_note = False
-                return
-
-        m = re.match(r'(「[\p{Han}\p{Hiragana}\p{Katakana}]+」,?)+とも(書く)?。', string)
-        if m:
-            self.notes = string
-            return
-
-        m = re.match(r'「(\p{Han})」.*転用。', string)
-        if m:
-            self.notes = string
-            return
-
-        m = re.match(r'「(.*)」.*の意。', string)
-        if m:
-            self.notes = string
-            return
-
-        m = re.search(r'」になる。$', string)
-        if m:
-            self.notes = string
-            return
-
-        raise(RuntimeError("BUG: unknown note format:\n  '%s'" % string))
+        if not READING_NOTE_RULES.apply(self, string, stats):
+            raise(RuntimeError("BUG: unknown note format:\n  '%s'" % string))
 
 
     # pretty representation; useful when debugging
@@ -784,34 +843,540 @@ class Reading:
         return(s)
 
 class Example:
+    __slots__ = ('example', 'pos', 'literary')
+
     def __init__(self, example):
         """Model for each item in a list of examples (例 column).
 
-         - self.reading: The parent Reading object.
          - self.example: The cleaned text string.
          - self.pos: If a part-of-speech marker is given, this is set to one of
-          'Adverb', 'Conjunction' or 'Suffix'.
+          PartOfSpeech.ADVERB, .CONJUNCTION or .SUFFIX (which compare equal to
+          'Adverb', 'Conjunction' and 'Suffix').
          - self.literary: True if the example is marked as "literary" (文語) in
          the PDF.
       """
 
         if '〔副〕' in example:
-            self.example = example.replace('〔副〕', '')
-            self.pos = 'Adverb'
+            example = example.replace('〔副〕', '')
+            self.pos = PartOfSpeech.ADVERB
         elif '〔接〕' in example:
-            self.example = example.replace('〔接〕', '')
-            self.pos = 'Conjunction'
+            example = example.replace('〔接〕', '')
+            self.pos = PartOfSpeech.CONJUNCTION
         elif re.match('^……', example):
-            self.example = example.replace('……', '')
-            self.pos = 'Suffix'
+            example = example.replace('……', '')
+            self.pos = PartOfSpeech.SUFFIX
         else:
-            self.example = example
             self.pos = None
+        # Examples of words with two Joyo kanji are listed under both.
+        self.example = sys.intern(example)
         self.literary = False
 
     def __str__(self):
         return self.example
 
+class NoteRule:
+    """A rule of the notes classifier (cf. NoteRules).
+
+    - name: For statistics (cf. NotesStats).
+    - handler: Called as handler(obj, string, match) when the rule applies;
+      obj is the Kanji or Reading the note belongs to, and match is the
+      match object of pattern (or None).
+    - pattern: A regexp, which must match at the start of the note (or
+      anywhere in it, with search=True); None to not test any.
+    - exact: The rule only applies to this very string.
+    - first: The characters a note must start with for the rule to apply (or
+      None for any).  Used for pre-dispatch (cf. NoteRules).
+    - suffix, contains: Strings that the note must end with, or contain.
+      They're tested before the pattern, so they should be implied by it.
+    - when: A predicate on obj, tested before the pattern.
+    - final: If false, the next rules are still tried after this one.
+    """
+
+    __slots__ = ('name', 'handler', 'pattern', 'search', 'exact', 'first',
+                 'suffix', 'contains', 'when', 'final')
+
+    def __init__(self, name, handler, pattern=None, search=False, exact=None,
+                 first=None, suffix=None, contains=None, when=None,
+                 final=True):
+        self.name = name
+        self.handler = handler
+        self.pattern = pattern and re.compile(pattern)
+        self.search = search
+        self.exact = exact
+        self.first = first
+        self.suffix = suffix
+        self.contains = contains
+        self.when = when
+        self.final = final
+
+    def apply(self, obj, string, stats=None):
+        """Apply the rule to a note, if it matches; return whether it did.
+        The try is counted in stats, if given (a NotesStats)."""
+
+        if stats is not None:
+            stats.tested[self.name] += 1
+        if self.suffix and not string.endswith(self.suffix):
+            return(False)
+        if self.contains and self.contains not in string:
+            return(False)
+        if self.when and not self.when(obj):
+            return(False)
+        m = None
+        if self.pattern:
+            if self.search:
+                m = self.pattern.search(string)
+            else:
+                m = self.pattern.match(string)
+            if not m:
+                return(False)
+        self.handler(obj, string, m)
+        return(True)
+
+class NoteRules:
+    """A table of NoteRule objects, tried in order on each note line, until a
+    (final) one applies.
+
+    Rules with an exact string are looked up first, in a dictionary.  The
+    others are pre-dispatched on the first character of the note: only the
+    rules which allow that character (cf. NoteRule.first) are tried, in their
+    order in the table.
+
+    >>> rules = NoteRules([
+    ...     NoteRule('exact', lambda o, s, m: print('exact'), exact='「亜」'),
+    ...     NoteRule('quoted', lambda o, s, m: print('quoted', m[1]),
+    ...              r'「(.+)」', first='「'),
+    ...     NoteRule('any', lambda o, s, m: print('any'), suffix='。')])
+    >>> [rule.name for rule in rules.candidates('「亜」')]
+    ['exact', 'quoted', 'any']
+    >>> [rule.name for rule in rules.candidates('亜。')]
+    ['any']
+    >>> rules.apply(None, '「亜」')
+    exact
+    True
+    >>> rules.apply(None, '「亞」。')
+    quoted 亞
+    True
+    >>> rules.apply(None, '亜')
+    False
+    """
+
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+        # Statistics are kept by rule name (cf. NotesStats).
+        assert(len({rule.name for rule in self.rules}) == len(self.rules))
+
+        self.exact = defaultdict(list)
+        for rule in self.rules:
+            if rule.exact:
+                self.exact[rule.exact].append(rule)
+        self.exact.default_factory = None
+
+        general = [rule for rule in self.rules if not rule.exact]
+        self.by_first = {}
+        for rule in general:
+            for ch in rule.first or '':
+                self.by_first[ch] = tuple(r for r in general
+                                          if r.first is None or ch in r.first)
+        self.default = tuple(r for r in general if r.first is None)
+
+    def candidates(self, string):
+        "The rules to try on a note, in order."
+        return(tuple(self.exact.get(string, ())) +
+               self.by_first.get(string[:1], self.default))
+
+    def apply(self, obj, string, stats=None):
+        """Apply the first matching rule to a note; return whether any did.
+
+        If stats (a NotesStats) is given, the rules tried and applied are
+        counted there; and if stats.timed, so is the time spent for the rule
+        that applied.
+        """
+
+        if stats is None:
+            for rule in self.candidates(string):
+                if rule.apply(obj, string) and rule.final:
+                    return(True)
+            return(False)
+
+        if stats.timed:
+            start = time.perf_counter()
+        for rule in self.candidates(string):
+            if rule.apply(obj, string, stats):
+                if not rule.final:
+                    stats.hits[rule.name] += 1
+                elif stats.timed:
+                    stats.count(rule.name, time.perf_counter() - start)
+                    return(True)
+                else:
+                    stats.count(rule.name)
+                    return(True)
+        return(False)
+
+# Handlers of kanji-scoped notes: handler(kanji, string, match).
+
+def note_variant_reference(kanji, string, m):
+    kanji.notes = string
+    kanji.pending_note = True
+
+    # ignore this data; it's already availabe in
+    # self.acceptable_variant.
+
+def note_documentation(kanji, string, m):
+    if kanji.pending_note:
+        kanji.notes += m[1]
+        kanji.pending_note = False
+    else:
+        kanji.notes = m[1]
+    kanji.joyo_documentation = m[1]
+
+def note_compound_reading(kanji, string, m):
+    kanji.notes = string
+    # cf. 茨城（いばらき）県
+    parts = string.split('，')
+    for part in parts:
+        # now with $
+        m = COMPOUND_PART_REGEXP.match(part)
+        prefix = m[1]
+        orthographies = (m[2]).split('・')
+        gloss = m[3]
+        suffix = (m[4])
+        if suffix and suffix in '都道府県':
+            for ort in orthographies:
+                kanji.add_placename_reading(ort, gloss, suffix)
+        else:
+            for ort in orthographies:
+                kanji.add_compound_reading(prefix + ort + suffix,
+                                           prefix + gloss + suffix)
+        return
+
+COMPOUND_PART_REGEXP = re.compile(
+    r'(お?)([\p{Han}・\p{Hiragana}]+)（(\p{Hiragana}+)）(.*)$')
+
+# Kanji-scoped notes; anything else goes to the current reading (cf.
+# READING_NOTE_RULES).
+KANJI_NOTE_RULES = NoteRules([
+    NoteRule('variant_reference', note_variant_reference,
+             r'［\p{Han}］＝許容字体，', first='［'),
+    NoteRule('documentation', note_documentation,
+             r'＊［(（付）.*)参照］$', first='＊', suffix='参照］'),
+    # no $
+    NoteRule('compound_reading', note_compound_reading,
+             r'(お?)([\p{Han}・\p{Hiragana}]+)（(\p{Hiragana}+)）(.*)'),
+])
+
+# Handlers of reading-scoped notes: handler(reading, string, match).
+
+def note_literary_naki(reading, string, m):
+    reading.add_examples('亡き')
+    for e in reading.examples:
+        if '亡き' in e.example:
+            e.literary = True
+    reading.notes = string
+
+def note_pending(reading, string, m):
+    reading.notes = string
+    reading.kanji.pending_note = True
+
+def note_sanmi_end(reading, string, m):
+    reading.kanji.readings[-2].notes += string
+    reading.kanji.pending_note = False
+
+    reading.kanji.add_reading("ミ")
+    reading.kanji.readings[-1].variation_of = 'イ'
+    reading.kanji.readings[-1].add_examples('三位一体，従三位')
+
+def note_harusame_end(reading, string, m):
+    reading.notes += string
+    reading.kanji.pending_note = False
+
+    reading.kanji.add_reading("さめ")
+    reading.kanji.readings[-1].variation_of = 'あめ'
+    reading.kanji.readings[-1].add_examples('春雨，小雨，霧雨')
+
+def note_literary_uki(reading, string, m):
+    e = next(e for e in reading.examples if '憂き' in e.example)
+    e.literary = True
+
+def note_alternate_orthographies(reading, string, m):
+    reading.notes = string
+    assert(re.match('[\p{Han}\p{Hiragana}，]+', m[1]))
+    reading.alternate_orthographies = m[1].split('，')
+
+def note_reading_examples(reading, string, m):
+    reading.notes = string
+    if not string.endswith('。'):
+        reading.kanji.pending_note = True
+
+def note_continuation(reading, string, m):
+    # previous half of note could have been in this reading...
+    if reading.notes:
+        reading.notes += string
+    # or the previous one.
+    elif reading.kanji.readings[-2].notes:
+        reading.kanji.readings[-2].notes += string
+    else:
+        raise(ValueError("BUG: can't find where to attach half-note."))
+
+    reading.kanji.pending_note = False
+
+def note_plain(reading, string, m):
+    reading.notes = string
+
+# Reading-scoped notes.  Order matters: e.g. a continuation line is only
+# taken as such if it's not a whole note by itself.
+READING_NOTE_RULES = NoteRules([
+    # hardcoded notes first, named after the readings they patch
+    NoteRule('hardcoded_naki', note_literary_naki,
+             exact='多く文語の「亡き」で使う。'),
+    NoteRule('hardcoded_sanmi_start', note_pending,
+             exact='「三位一体」，「従三位」は，「サン'),
+    NoteRule('hardcoded_sanmi_end', note_sanmi_end,
+             exact='ミイッタイ」，「ジュサンミ」。'),
+    NoteRule('hardcoded_harusame_start', note_pending,
+             exact='「春雨」，「小雨」，「霧雨」などは，'),
+    NoteRule('hardcoded_harusame_end', note_harusame_end,
+             exact='「はるさめ」，「こさめ」，「きりさめ」。'),
+    # marks an example, then goes on as a 'reading_examples' note
+    NoteRule('literary', note_literary_uki, exact='「憂き」は，文語の連体形。',
+             final=False),
+
+    NoteRule('alternate_orthographies', note_alternate_orthographies,
+             r'⇔ *(.+)', first='⇔'),
+    NoteRule('reading_examples', note_reading_examples,
+             r'(「.*」，?)+(など)?は，', first='「', contains='は，'),
+    NoteRule('usage', note_plain,
+             r'(「(.*)」，?)+などと使う。$', first='「', suffix='などと使う。'),
+    NoteRule('continuation', note_continuation, suffix='。',
+             when=lambda reading: reading.kanji.pending_note == True),
+    NoteRule('also_written', note_plain,
+             r'(「[\p{Han}\p{Hiragana}\p{Katakana}]+」,?)+とも(書く)?。',
+             first='「', contains='とも'),
+    NoteRule('diverted_use', note_plain,
+             r'「(\p{Han})」.*転用。', first='「', contains='転用。'),
+    NoteRule('meaning', note_plain,
+             r'「(.*)」.*の意。', first='「', contains='の意。'),
+    NoteRule('becomes', note_plain, suffix='」になる。'),
+])
+
+class CompoundDictionary(collections.abc.Mapping):
+    """The compound readings of the appendix table (付表), indexed both ways.
+
+    As a read-only mapping, the keys are readings (kana) and the values are
+    tuples of orthographies.  by_orthography is the inverse index: a read-only
+    mapping from orthography to a tuple of readings.
+
+    >>> compounds = CompoundDictionary({'けさ': ['今朝'],
+    ...                                 'しわす': ['師走'],
+    ...                                 'しはす': ['師走']})
+    >>> compounds['けさ']
+    ('今朝',)
+    >>> compounds.by_orthography['師走']
+    ('しわす', 'しはす')
+    >>> len(compounds), '今朝' in compounds.by_orthography
+    (3, True)
+    """
+
+    __slots__ = ('readings', 'by_orthography')
+
+    def __init__(self, compound_readings):
+        self.readings = types.MappingProxyType(
+            {reading: tuple(orthographies)
+             for reading, orthographies in compound_readings.items()})
+
+        by_orthography = defaultdict(list)
+        for reading, orthographies in self.readings.items():
+            for orthography in orthographies:
+                by_orthography[orthography].append(reading)
+        self.by_orthography = types.MappingProxyType(
+            {orthography: tuple(readings)
+             for orthography, readings in by_orthography.items()})
+
+    def __getitem__(self, reading):
+        return(self.readings[reading])
+
+    def __iter__(self):
+        return(iter(self.readings))
+
+    def __len__(self):
+        return(len(self.readings))
+
+    def __repr__(self):
+        return('CompoundDictionary(%r)' % dict(self.readings))
+
+    # Mapping proxies can't be pickled; rebuild from the plain data.
+    def __reduce__(self):
+        return((CompoundDictionary, (dict(self.readings),)))
+
+class CrossReferences:
+    """Links between the words and kanji of the Joyo data, for O(1) lookups:
+
+        - alternates: Read-only mapping from a kanji to a tuple of the
+          alternate orthographies (⇔ notes) of its readings.
+
+        - alternate_kanjis: Read-only mapping from a kanji to the frozenset of
+          kanji used in the alternate orthographies (⇔ notes) of its readings;
+          cf. are_alternates() for symmetric links.
+
+        - alternate_readings: Read-only mapping from an alternate orthography
+          to a tuple of the Reading objects whose ⇔ notes list it.
+
+        - compounds: Read-only mapping from a kanji to a tuple of the compound
+          orthographies it's used in: from the appendix (付表), and from the
+          kanji's own compound readings.
+
+        - components: Read-only mapping from a compound orthography to a tuple
+          of the Kanji objects used in it, in order.
+
+    Built by JoyoDB from its data (cf. JoyoDB.cross_references).
+
+    >>> k1 = Kanji('会')
+    >>> k1.add_reading('あう')
+    >>> k1.append_to_notes('⇔合う')
+    >>> k2 = Kanji('合')
+    >>> k2.add_reading('あう')
+    >>> k2.append_to_notes('⇔会う')
+    >>> k3 = Kanji('日')
+    >>> k3.add_compound_reading('明日', 'あす')
+    >>> xref = JoyoDB([k1, k2, k3], {'あす': ['明日']}).cross_references
+    >>> xref.are_alternates('会', '合'), xref.are_alternates('会', '日')
+    (True, False)
+    >>> [r.kanji.kanji for r in xref.alternate_readings['合う']]
+    ['会']
+    >>> xref.compounds['日'], [k.kanji for k in xref.components['明日']]
+    (('明日',), ['日'])
+    >>> xref.related_words('会')
+    ('合う',)
+    """
+
+    __slots__ = ('alternates', 'alternate_kanjis', 'alternate_readings',
+                 'compounds', 'components')
+
+    def __init__(self, kanjis, compound_readings, by_kanji):
+        alternates = defaultdict(dict)
+        alternate_kanjis = defaultdict(set)
+        alternate_readings = defaultdict(list)
+        compounds = defaultdict(dict)
+        for k in kanjis:
+            for r in k.readings:
+                for orthography in r.alternate_orthographies:
+                    alternates[k.kanji][orthography] = True
+                    alternate_readings[orthography].append(r)
+                    alternate_kanjis[k.kanji].update(
+                        han for han in orthography if han in by_kanji)
+            for orthography in k.compound_readings:
+                compounds[k.kanji][orthography] = True
+
+        components = {}
+        orthographies = list(compound_readings.by_orthography)
+        orthographies += [o for k in kanjis for o in k.compound_readings]
+        for orthography in orthographies:
+            if orthography in components:
+                continue
+            components[orthography] = tuple(by_kanji[han]
+                                            for han in orthography
+                                            if han in by_kanji)
+            for k in components[orthography]:
+                compounds[k.kanji][orthography] = True
+
+        self.alternates = types.MappingProxyType(
+            {kanji: tuple(orthographies)
+             for kanji, orthographies in alternates.items()})
+        self.alternate_kanjis = types.MappingProxyType(
+            {kanji: frozenset(linked)
+             for kanji, linked in alternate_kanjis.items()})
+        self.alternate_readings = types.MappingProxyType(
+            {orthography: tuple(readings)
+             for orthography, readings in alternate_readings.items()})
+        self.compounds = types.MappingProxyType(
+            {kanji: tuple(orthographies)
+             for kanji, orthographies in compounds.items()})
+        self.components = types.MappingProxyType(components)
+
+    def are_alternates(self, kanji1, kanji2):
+        "Whether each of two kanji is used in alternates of the other's readings."
+        return(kanji2 in self.alternate_kanjis.get(kanji1, ()) and
+               kanji1 in self.alternate_kanjis.get(kanji2, ()))
+
+    def related_words(self, kanji):
+        """Words related to a kanji: the alternate orthographies of its
+        readings, then the compounds it's used in; a tuple."""
+
+        return(self.alternates.get(kanji, ()) + self.compounds.get(kanji, ()))
+
+class JoyoDB:
+    """A read-only snapshot of the Joyo data, as returned by
+    joyodb.convert.parse(), joyodb.convert.load_tsv() and joyodb.load().
+
+        - kanjis: Tuple of Kanji objects, in the order of the Joyo table.
+
+        - compound_readings: The compound readings from the appendix (付表),
+          as a CompoundDictionary: keys are readings, values are tuples of
+          orthographies, and .by_orthography indexes them the other way.
+
+        - by_kanji: Read-only mapping from a character to its Kanji object.
+          Both the popular and the standard characters are keys (cf.
+          Kanji.standard_character).
+
+        - cross_references: A CrossReferences graph of alternate
+          orthographies and compounds, built with the snapshot.
+
+    Snapshots can't be changed after construction, so they can be shared
+    between threads; to update the data, build a new snapshot and replace the
+    reference to the old one.  The Kanji objects in a snapshot must be treated
+    as read-only too.
+
+    >>> db = JoyoDB([Kanji('亜'), Kanji('𠮟')], {'あす': ['明日']})
+    >>> len(db), db['亜'].kanji, db['𠮟'] is db['叱'], '鬱' in db
+    (2, '亜', True, False)
+    >>> db.compound_readings['あす']
+    ('明日',)
+    >>> db.kanjis = []
+    Traceback (most recent call last):
+      ...
+    AttributeError: JoyoDB objects are read-only
+    """
+
+    __slots__ = ('kanjis', 'compound_readings', 'by_kanji', 'cross_references')
+
+    def __init__(self, kanjis, compound_readings):
+        kanjis = tuple(kanjis)
+        by_kanji = {}
+        for k in kanjis:
+            by_kanji[k.kanji] = k
+            if k.standard_character:
+                by_kanji[k.standard_character] = k
+
+        object.__setattr__(self, 'kanjis', kanjis)
+        if not isinstance(compound_readings, CompoundDictionary):
+            compound_readings = CompoundDictionary(compound_readings)
+        object.__setattr__(self, 'compound_readings', compound_readings)
+        object.__setattr__(self, 'by_kanji', types.MappingProxyType(by_kanji))
+        object.__setattr__(self, 'cross_references',
+                           CrossReferences(kanjis, compound_readings, by_kanji))
+
+    def __setattr__(self, name, value):
+        raise(AttributeError("JoyoDB objects are read-only"))
+
+    def __delattr__(self, name):
+        raise(AttributeError("JoyoDB objects are read-only"))
+
+    # Mapping proxies can't be pickled; rebuild from the plain data.
+    def __reduce__(self):
+        return((JoyoDB, (self.kanjis, dict(self.compound_readings))))
+
+    def __len__(self):
+        return(len(self.kanjis))
+
+    def __iter__(self):
+        return(iter(self.kanjis))
+
+    def __contains__(self, character):
+        return(character in self.by_kanji)
+
+    def __getitem__(self, character):
+        "The Kanji object for a character; raises KeyError if it isn't Joyo."
+        return(self.by_kanji[character])
+
 # With this, one can test with: python3 model.py -v
 if __name__ == "__main__":
     import doctest
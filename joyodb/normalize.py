@@ -0,0 +1,145 @@
+# Normalize Japanese text to the character forms used in joyodb.
+#
+# This generalizes joyodb.popularize(): besides the popular-use alternatives
+# (通用字体), it can also handle the Unicode variation sequences for the five
+# kanji with accepted variant forms (許容字体; cf. data/variants.tsv).  All
+# mappings are applied in a single pass over the text.
+
+import regex as re
+
+from joyodb import load_popular_alternatives, load_variants
+
+# Variation selectors (VS1–VS16, and the ideographic VS17–VS256), as a regexp
+# character class.
+VARIATION_SELECTORS = r'\ufe00-\ufe0f\U000e0100-\U000e01ef'
+
+# What to do with variant kanji, by Normalizer(variants=...) name:
+# a function from (base, (standard sequence, accepted sequence)) to the output.
+VARIANT_MODES = {
+    'strip': lambda base, sequences: base,
+    'standard': lambda base, sequences: sequences[0],
+    'accepted': lambda base, sequences: sequences[1],
+}
+
+class Normalizer:
+    """Single-pass text normalizer.
+
+    - popular: If true (the default), convert MEXT-style kanji to their
+      popular alternatives, as joyodb.popularize() does.
+
+    - variants: What to do with the five kanji which have accepted variant
+      forms.  None (the default) leaves them alone; 'strip' removes any
+      variation selector after them; 'standard' and 'accepted' replace them
+      (and any variation selector they already have) with the variation
+      sequence for the standard or accepted forms.
+
+    >>> n = Normalizer()
+    >>> n.normalize('1: 塡 2: 剝 3: 頰 4: 𠮟')
+    '1: 填 2: 剥 3: 頬 4: 叱'
+
+    >>> n = Normalizer(variants='strip')
+    >>> s = n.normalize('餌\\U000e0100を𠮟る')
+    >>> s, len(s)
+    ('餌を叱る', 4)
+
+    >>> n = Normalizer(popular=False, variants='accepted')
+    >>> ['%x' % ord(ch) for ch in n.normalize('餌\\U000e0103𠮟')]
+    ['990c', 'e0100', '20b9f']
+    """
+
+    def __init__(self, popular=True, variants=None):
+        self.popular = popular
+        self.variants = variants
+
+        mapping = {}
+        if popular:
+            mapping.update(load_popular_alternatives())
+        # Variant bases which must also consume a following selector.
+        self.variant_bases = ''
+        if variants:
+            convert = VARIANT_MODES[variants]
+            for base, sequences in load_variants().items():
+                mapping[base] = convert(base, sequences)
+                self.variant_bases += base
+
+        self.mapping = mapping
+        if self.variant_bases:
+            self.regexp = re.compile('[%s][%s]?|[%s]' % (
+                self.variant_bases, VARIATION_SELECTORS,
+                ''.join(mapping.keys())))
+        else:
+            # Single-character replacements can be done by str.translate(),
+            # in C.
+            self.regexp = None
+            self.table = str.maketrans(mapping)
+
+    def normalize(self, s):
+        "Return a normalized copy of string s."
+        if self.regexp:
+            mapping = self.mapping
+            return(self.regexp.sub(lambda m: mapping[m[0][0]], s))
+        else:
+            return(s.translate(self.table))
+
+    def normalize_chunks(self, chunks):
+        """Yield normalized text for an iterable of string chunks.
+
+        Chunks may be split anywhere: a variant kanji at the end of a chunk is
+        held back until the next chunk, so that it's kept together with its
+        variation selector.
+
+        >>> n = Normalizer(variants='strip')
+        >>> ''.join(n.normalize_chunks(['剝がした餌', '\\U000e0100']))
+        '剥がした餌'
+        """
+
+        held = ''
+        for chunk in chunks:
+            chunk = held + chunk
+            if chunk and chunk[-1] in self.variant_bases:
+                held = chunk[-1]
+                chunk = chunk[:-1]
+            else:
+                held = ''
+            if chunk:
+                yield(self.normalize(chunk))
+        if held:
+            yield(self.normalize(held))
+
+    def normalize_stream(self, f, chunk_size=1 << 20):
+        """Yield normalized text from a text file object, chunk by chunk.
+
+        The file must be opened in text mode; its decoder already keeps
+        multi-byte (and surrogate-pair) sequences together, and
+        normalize_chunks() does the same for variation sequences.
+
+        >>> import io
+        >>> n = Normalizer(variants='strip')
+        >>> f = io.StringIO('頰餌\\U000e0100' * 3)
+        >>> ''.join(n.normalize_stream(f, chunk_size=2))
+        '頬餌頬餌頬餌'
+        """
+
+        return(self.normalize_chunks(iter(lambda: f.read(chunk_size), '')))
+
+    def normalize_file(self, source, destination, chunk_size=1 << 20,
+                       encoding='utf-8'):
+        "Normalize file source into file destination (both given by name)."
+        with open(source, 'rt', encoding=encoding) as fin:
+            with open(destination, 'wt', encoding=encoding) as fout:
+                for chunk in self.normalize_stream(fin, chunk_size):
+                    fout.write(chunk)
+
+def normalize(s, popular=True, variants=None):
+    """Shortcut to Normalizer(popular, variants).normalize(s).
+
+    >>> normalize('剝\\ufe00', variants='strip')
+    '剥\\ufe00'
+    """
+
+    return(Normalizer(popular, variants).normalize(s))
+
+# With this, one can test with: python3 normalize.py -v
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,110 @@
+# Reference datasets that the Joyo data is checked against: kanjidic,
+# Wikipedia's list of Joyo kanji, and our own list of old (旧字体) forms.
+#
+# Each source is parsed once into a compact index, which is cached in
+# cachedir (cf. joyodb.cache.cached_build()), and rebuilt only when the source
+# file (or this module) changes.
+
+import regex as re
+
+from joyodb import cachedir, datadir
+from joyodb.cache import cached_build
+
+# Downloaded by the Makefile.
+KANJIDIC_FILE = cachedir + '/kanjidic_comb_utf8'
+WIKIPEDIA_FILE = cachedir + '/List_of_joyo_kanji.html'
+
+SHIN2KYUU_FILE = datadir + '/old_shin2kyuu.tsv'
+
+# A reading in kanjidic: kana, with okurigana after a dot; bound affixes are
+# marked with '-', which we don't use.
+KANJIDIC_READING_REGEXP = re.compile(r'^-?([\p{Katakana}\p{Hiragana}ー.]+)-?$')
+
+def parse_kanjidic(lines):
+    """Parse kanjidic lines; returns a dictionary from kanji to a frozenset of
+    their readings.
+
+    >>> index = parse_kanjidic(['# KANJIDIC',
+    ...                         '亜 3021 U4e9c B1 ア つ.ぐ T1 や {Asia}',
+    ...                         '就 3D22 U5c31 ジュ つ.く -つ.き'])
+    >>> sorted(index['亜']), sorted(index['就'])
+    (['つ.ぐ', 'や', 'ア'], ['つ.き', 'つ.く', 'ジュ'])
+    """
+
+    index = {}
+    for line in lines:
+        if line.startswith('#'):
+            continue
+        kanji, *fields = line.split()
+        readings = set()
+        for field in fields:
+            match = KANJIDIC_READING_REGEXP.match(field)
+            if match:
+                readings.add(match[1])
+        index[kanji] = frozenset(readings)
+    return(index)
+
+def parse_wikipedia(html):
+    """Parse Wikipedia's List of jōyō kanji; returns a dictionary from kanji to
+    (old kanji or None, readings), readings being the text of their column.
+    Requires bs4 and lxml.
+    """
+
+    from bs4 import BeautifulSoup
+
+    tables = BeautifulSoup(html, 'lxml').find_all("table", class_="wikitable")
+    if len(tables) != 1:
+        raise(RuntimeError("Wikipedia changed too much! Can't test against it!"))
+
+    index = {}
+    for tr in tables[0].find_all('tr')[1:]:
+        tds = tr.find_all('td')
+
+        new = tds[1].find('a').text
+        old = None
+        a = tds[2].find('a')
+        if a:
+            old = a.text
+
+        index[new] = (old, tds[7].get_text().strip())
+    return(index)
+
+def parse_shin2kyuu(lines):
+    """Parse old_shin2kyuu.tsv; returns a dictionary from kanji to their old
+    form.
+
+    >>> parse_shin2kyuu(['亜\\t亞\\n', '悪\\t惡\\n'])
+    {'亜': '亞', '悪': '惡'}
+    """
+
+    index = {}
+    for line in lines:
+        shin, kyuu = line.strip().split("\t")
+        index[shin] = kyuu
+    return(index)
+
+def load_reference(name, filename, parse, mode='rt'):
+    "Return parse(file contents), cached as cachedir/reference_<name>.pickle."
+
+    def build():
+        with open(filename, mode) as f:
+            return(parse(f))
+    return(cached_build(build, cachedir + '/reference_%s.pickle' % name,
+                        filename, __file__))
+
+def load_kanjidic(filename=KANJIDIC_FILE):
+    "Dictionary from kanji to a frozenset of their readings in kanjidic."
+    return(load_reference('kanjidic', filename, parse_kanjidic))
+
+def load_wikipedia(filename=WIKIPEDIA_FILE):
+    "Dictionary from kanji to (old kanji or None, readings), from Wikipedia."
+    return(load_reference('wikipedia', filename, parse_wikipedia, mode='rb'))
+
+def load_shin2kyuu(filename=SHIN2KYUU_FILE):
+    "Dictionary from kanji to their old form, from data/old_shin2kyuu.tsv."
+    return(load_reference('shin2kyuu', filename, parse_shin2kyuu))
+
+# With this, one can test with: python3 reference.py -v
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
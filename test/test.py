@@ -4,13 +4,6 @@ import os
 import sys
 import logging
 logging.basicConfig(format='%(levelname)s: %(message)s')
-from collections import defaultdict
-
-from bs4 import BeautifulSoup
-from lxml import etree
-import romkan
-import MeCab
-mecab_tagger = MeCab.Tagger('-Ounidic')
 
 # "The parent dir of the directory of the full path of this file."
 basedir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
@@ -26,6 +19,16 @@ jmdict_missing_examples_file = basedir + '/data/examples_not_in_jmdict.tsv'
 import joyodb
 import joyodb.model
 import joyodb.convert
+import joyodb.cache
+import joyodb.index
+import joyodb.annotate
+import joyodb.coverage
+import joyodb.normalize
+import joyodb.kana
+import joyodb.columnar
+import joyodb.jmdict
+import joyodb.lemmatize
+import joyodb.reference
 import regex as re
 
 
@@ -79,53 +82,86 @@ with open(jmdict_missing_examples_file, 'rt') as f:
         kanji, reading, example, furigana = line.strip().split("\t")
         JMDICT_MISSING_EXAMPLES.append((kanji, reading, example))
 
-jmdict_index = defaultdict(list)
-class JMdictEntry():
-
-    def __init__(self, entry):
-        self.kanji_expressions = []
-        for k_ele in entry.iter('k_ele'):
-            keb = k_ele.find('keb')
-            self.kanji_expressions.append(keb.text)
-            jmdict_index[keb.text].append(self)
-
-        self.readings = []
-        for r_ele in entry.iter('r_ele'):
-            reb = r_ele.find('reb')
-            self.readings.append(reb.text)
-
-        self.parts_of_speech = []
-        for pos in entry.iter('pos'):
-            for entity in pos.iter(tag=etree.Entity):
-                self.parts_of_speech.append(str(entity))
-
-def jmdict_is_kanji_entry(entry):
-    if entry.find('k_ele') is not None:
-        return True
-
-def lemmatize_with_mecab(expression, kanji):
-    '''Find the first word containing kanji; return (lemma, reading).'''
-    nodes = mecab_tagger.parseToNode(expression)
-    while nodes:
-        features = nodes.feature.split(',')
-        if kanji in features[10]:
-            lemma = features[10]
-            reading = romkan.to_hiragana(romkan.to_roma(features[6]))
-            return((lemma, reading))
-        nodes = nodes.next
-    raise(ValueError("Mecab failed: %s, %s" % (expression, kanji)))
-
-
 class TestLoadedData(unittest.TestCase):
 
     def setUpClass():
-        joyodb.convert.parse()
+        TestLoadedData.db = joyodb.convert.parse()
         TestLoadedData.kanjis = {}
 
         # convenience mapping by string
         for k in joyodb.loaded_data.kanjis:
             TestLoadedData.kanjis[k.kanji] = k
 
+    def test_snapshot(self):
+        """parse() returns a read-only snapshot, indexed by character."""
+
+        db = TestLoadedData.db
+        self.assertIs(db, joyodb.loaded_data.db)
+        for k in db.kanjis:
+            self.assertIs(db[k.kanji], k)
+            if k.standard_character:
+                self.assertIs(db[k.standard_character], k)
+        with self.assertRaises(AttributeError):
+            db.kanjis = ()
+
+    def test_parse_cache(self):
+        """The parse snapshot must load the same data as a fresh parse."""
+
+        def summary():
+            kanjis = [(k.kanji, k.old_kanji, k.notes,
+                       [(r.reading, r.kind, r.uncommon, r.notes,
+                         [e.example for e in r.examples])
+                        for r in k.readings])
+                      for k in joyodb.loaded_data.kanjis]
+            return((kanjis, dict(joyodb.loaded_data.compound_readings)))
+
+        joyodb.convert.parse(use_cache=False)
+        fresh = summary()
+        joyodb.convert.parse()
+        self.assertEqual(summary(), fresh)
+
+    def test_load_tsv(self):
+        """Objects rebuilt from the TSV output must match the parsed ones."""
+
+        kanjis = joyodb.convert.load_tsv().kanjis
+        self.assertEqual([k.kanji for k in kanjis],
+                         [k.kanji for k in joyodb.loaded_data.kanjis])
+        for loaded, parsed in zip(kanjis, joyodb.loaded_data.kanjis):
+            self.assertEqual(loaded.old_kanji, parsed.old_kanji)
+            self.assertEqual(loaded.compound_readings, parsed.compound_readings)
+            self.assertEqual([(r.reading, r.kind, r.uncommon, r.variation_of,
+                               [(e.example, e.pos, e.literary) for e in r.examples])
+                              for r in loaded.readings],
+                             [(r.reading, r.kind, r.uncommon, r.variation_of,
+                               [(e.example, e.pos, e.literary) for e in r.examples])
+                              for r in parsed.readings])
+
+    def test_sql(self):
+        """The SQLite export must have every reading and example."""
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = directory + '/joyodb.sqlite3'
+            joyodb.convert.convert_to_sql(filename, db=TestLoadedData.db)
+            db = joyodb.convert.open_sql(filename)
+
+            readings = [r for k in joyodb.loaded_data.kanjis for r in k.readings]
+            examples = [e for r in readings for e in r.examples]
+            self.assertEqual(db.execute('SELECT COUNT(*) FROM readings').fetchone()[0],
+                             len(readings))
+            self.assertEqual(db.execute('SELECT COUNT(*) FROM examples').fetchone()[0],
+                             len(examples))
+
+            row = db.execute('SELECT kanji.kanji, readings.reading '
+                             'FROM readings JOIN kanji ON kanji.id = readings.kanji_id '
+                             'WHERE hiragana = ?', ('たべる',)).fetchone()
+            self.assertEqual(tuple(row), ('食', 'た.べる'))
+            self.assertIn(('example',
+                           db.execute('SELECT id FROM examples WHERE example = ?',
+                                      ('雨戸',)).fetchone()[0]),
+                          joyodb.convert.search_sql(db, '雨戸'))
+            db.close()
+
     def test_okurigana_delimit(self):
         """Simple test to look for suspicious non-delimited readings."""
 
@@ -139,27 +175,7 @@ class TestLoadedData(unittest.TestCase):
 
 
     def test_against_wikipedia(self):
-        with open(wikipedia_file, 'rt') as f:
-            w = BeautifulSoup(f)
-        table = w.find_all("table", class_="wikitable")
-        if len(list(table)) != 1:
-            raise(RuntimeError("Wikipedia changed too much! Can't test against it!"))
-
-        table = table[0]
-
-        wikipedia_kanjis = {}
-        for tr in table.find_all('tr')[1:]:
-            tds = tr.find_all('td')
-
-            new = tds[1].find('a').text
-            old = None
-            a = tds[2].find('a')
-            if a:
-                old = a.text
-
-            readings = tds[7]
-
-            wikipedia_kanjis[new] = (old, readings)
+        wikipedia_kanjis = joyodb.reference.load_wikipedia(wikipedia_file)
 
         self.assertEqual(len(TestLoadedData.kanjis.keys()), len(wikipedia_kanjis.keys()))
 
@@ -182,11 +198,7 @@ class TestLoadedData(unittest.TestCase):
                 self.assertEqual(kanji.old_kanji, wikipedia_kanjis[kanji.kanji][0])
 
     def test_against_old_shin2kyuu(self):
-        old_data = {}
-        with open(shin2kyuu_file, 'rt') as f:
-            for line in f:
-                shin, kyuu = line.strip().split("\t")
-                old_data[shin] = kyuu
+        old_data = joyodb.reference.load_shin2kyuu(shin2kyuu_file)
 
         kanjis_with_old = list(filter(lambda k: k.old_kanji, joyodb.loaded_data.kanjis))
         self.assertEqual(len(kanjis_with_old), len(old_data))
@@ -207,17 +219,7 @@ class TestLoadedData(unittest.TestCase):
                     self.assertEqual(len(matches), 1)
 
     def test_against_kanjidic(self):
-        kanjidic_data = {}
-        with open(kanjidic_file, 'rt') as f:
-            for line in f:
-                kanji, *fields = line.strip().split()
-
-                if kanji in TestLoadedData.kanjis.keys():
-                    # kanjidic marks bound affixes with '-', but we don't
-                    fields = [re.sub('-$', '', f) for f in fields]
-                    fields = [re.sub('^-', '', f) for f in fields]
-
-                    kanjidic_data[kanji] = fields
+        kanjidic_data = joyodb.reference.load_kanjidic(kanjidic_file)
 
         for kanji in joyodb.loaded_data.kanjis:
             for reading in kanji.readings:
@@ -227,15 +229,16 @@ class TestLoadedData(unittest.TestCase):
                     self.assertIn(reading.reading, kanjidic_data[kanji.kanji])
 
     def test_against_edict(self):
-        # list of EdictEntry objects
-        jmdict_data = []
+        jmdict_index = joyodb.jmdict.load_jmdict_index(jmdict_file)
 
-        parser = etree.XMLParser(resolve_entities=False)
-        tree = etree.parse(jmdict_file, parser)
-        for entry in  tree.getroot().iter('entry'):
-            if jmdict_is_kanji_entry(entry):
-                jmdict_entry = JMdictEntry(entry)
-                jmdict_data.append(jmdict_entry)
+        # Lemmatize all examples not found as is, in one go.
+        lemmas = joyodb.lemmatize.lemmatize(
+            (e.example, k.kanji)
+            for k in joyodb.loaded_data.kanjis
+            for r in k.readings
+            for e in r.examples
+            if e.example not in jmdict_index.keys()
+            and (k.kanji, r.reading, e.example) not in JMDICT_MISSING_EXAMPLES)
 
         for k in joyodb.loaded_data.kanjis:
             for r in k.readings:
@@ -248,11 +251,13 @@ class TestLoadedData(unittest.TestCase):
                     elif (k.kanji, r.reading, e.example) in JMDICT_MISSING_EXAMPLES:
                         continue
                     else:
-                        lemma, lemma_reading = lemmatize_with_mecab(e.example, k.kanji)
+                        if not lemmas[(e.example, k.kanji)]:
+                            raise(ValueError("Mecab failed: %s, %s" %
+                                             (e.example, k.kanji)))
+                        lemma, lemma_reading = lemmas[(e.example, k.kanji)]
                         if lemma in jmdict_index.keys():
-                            jmdict_entries = jmdict_index[lemma]
-                            jmdict_entries = [je for je in jmdict_entries
-                                              if lemma_reading in je.readings]
+                            jmdict_entries = jmdict_index.lookup(
+                                lemma, reading=lemma_reading)
                             if not jmdict_entries:
                                 raise(RuntimeError(
                                     "Could not find example: %s (lemma: %s,%s)" %
@@ -265,7 +270,19 @@ class TestLoadedData(unittest.TestCase):
                         raise(RuntimeError("Could not find example: %s"
                               % e.example))
 
+    def test_lemmatize_batches(self):
+        """Examples parsed in batches must get the same lemmas as one by one."""
+
+        pairs = [(e.example, k.kanji)
+                 for k in joyodb.loaded_data.kanjis
+                 for r in k.readings
+                 for e in r.examples]
+        self.assertEqual(joyodb.lemmatize.lemmatize(pairs, cache=None),
+                         joyodb.lemmatize.lemmatize(pairs, batch_size=1,
+                                                    cache=None))
+
     def test_alternate_orthographies(self):
+        xref = TestLoadedData.db.cross_references
         for k in joyodb.loaded_data.kanjis:
             for r in k.readings:
                 for a in r.alternate_orthographies:
@@ -274,17 +291,8 @@ class TestLoadedData(unittest.TestCase):
                     alt_kanji_ch = looks_like_alternate[1]
                     assert(alt_kanji_ch)
 
-                    alt_kanji_list = [obj for obj in joyodb.loaded_data.kanjis
-                                      if obj.kanji == alt_kanji_ch]
-                    assert(len(alt_kanji_list) == 1)
-                    alt_kanji = alt_kanji_list[0]
-
-                    found=False
-                    for their_readings in alt_kanji.readings:
-                        for their_alternates in their_readings.alternate_orthographies:
-                            if k.kanji in their_alternates:
-                                found=True
-                    assert(found)
+                    assert(alt_kanji_ch in TestLoadedData.db)
+                    assert(xref.are_alternates(k.kanji, alt_kanji_ch))
 
     def test_compound_readings(self):
         '''Test compound readings from the main table and appendix against each other.'''
@@ -306,26 +314,27 @@ class TestLoadedData(unittest.TestCase):
 
                 for ch in orthography:
                     if re.match(r'\p{Han}', ch):
-                        k = next(k for k in joyodb.loaded_data.kanjis
-                                 if k.kanji == ch)
-                        all_glosses = list(k.compound_readings.values()) + list(k.placename_readings.values())
-                        if gloss not in all_glosses:
-                            found=False
-                            for reading in [r.to_hiragana() for r in k.readings]:
-                                if reading in gloss:
-                                    logging.info("Assuming regular reading for %s: %s in %s" %
-                                                    (ch, reading, orthography))
-                                    found=True
-
-                            for k_ort, k_gloss in k.compound_readings.items():
-                                if k_gloss in gloss:
-                                    logging.info("Assuming double-compound reading for %s: %s(%s) in %s(%s)" %
-                                                    (ch, k_ort, k_gloss, orthography, gloss))
-                                    found=True
-
-                            if not found:
-                                raise(RuntimeError("Couldn't find compound %s in kanji %s" %
-                                    (orthography, k.kanji)))
+                        assert(ch in TestLoadedData.db)
+                for k in TestLoadedData.db.cross_references.components[orthography]:
+                    ch = k.kanji
+                    all_glosses = list(k.compound_readings.values()) + list(k.placename_readings.values())
+                    if gloss not in all_glosses:
+                        found=False
+                        for reading in [r.to_hiragana() for r in k.readings]:
+                            if reading in gloss:
+                                logging.info("Assuming regular reading for %s: %s in %s" %
+                                                (ch, reading, orthography))
+                                found=True
+
+                        for k_ort, k_gloss in k.compound_readings.items():
+                            if k_gloss in gloss:
+                                logging.info("Assuming double-compound reading for %s: %s(%s) in %s(%s)" %
+                                                (ch, k_ort, k_gloss, orthography, gloss))
+                                found=True
+
+                        if not found:
+                            raise(RuntimeError("Couldn't find compound %s in kanji %s" %
+                                (orthography, k.kanji)))
 
 def load_tests(loader, tests, ignore):
     """Load doctests into unit tests suite.
@@ -334,6 +343,16 @@ def load_tests(loader, tests, ignore):
     tests.addTests(doctest.DocTestSuite(joyodb))
     tests.addTests(doctest.DocTestSuite(joyodb.model))
     tests.addTests(doctest.DocTestSuite(joyodb.convert))
+    tests.addTests(doctest.DocTestSuite(joyodb.cache))
+    tests.addTests(doctest.DocTestSuite(joyodb.index))
+    tests.addTests(doctest.DocTestSuite(joyodb.annotate))
+    tests.addTests(doctest.DocTestSuite(joyodb.coverage))
+    tests.addTests(doctest.DocTestSuite(joyodb.normalize))
+    tests.addTests(doctest.DocTestSuite(joyodb.kana))
+    tests.addTests(doctest.DocTestSuite(joyodb.columnar))
+    tests.addTests(doctest.DocTestSuite(joyodb.jmdict))
+    tests.addTests(doctest.DocTestSuite(joyodb.lemmatize))
+    tests.addTests(doctest.DocTestSuite(joyodb.reference))
     return tests
 
 if __name__ == '__main__':